@@ -0,0 +1,171 @@
+from oracle_client import encode_number, LENGTH
+import asyncio
+import os
+
+
+def encode_request(binary, *numbers):
+    if binary:
+        return b"".join(encode_number(x) for x in numbers)
+    return "".join(f"{x}\n" for x in numbers).encode()
+
+
+class _Worker:
+    """
+    one C oracle in server mode, with a bounded `queue` of requests waiting
+    to be written and up to `pipeline_depth` written ones waiting on a reply
+    """
+    def __init__(self, proc, returns_cycles, binary, queue_size, pipeline_depth) -> None:
+        self.proc = proc
+        self.returns_cycles = returns_cycles
+        self.binary = binary
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.in_flight = asyncio.Queue(maxsize=pipeline_depth)
+        self.error = None # set once the oracle has gone, for every request left
+        self.tasks = [asyncio.create_task(self.__write()), asyncio.create_task(self.__read())]
+
+    def load(self):
+        return self.queue.qsize() + self.in_flight.qsize()
+
+    def __fail(self, future):
+        if self.error is None:
+            code = self.proc.returncode # None if it hasn't been waited on yet
+            self.error = RuntimeError("oracle exited" + (f" with {code}" if code is not None else ""))
+        if not future.done():
+            future.set_exception(self.error)
+
+    async def __write(self):
+        while True:
+            request = await self.queue.get()
+            if request is None:
+                if self.error is None:
+                    self.proc.stdin.close()
+                await self.in_flight.put(None)
+                return
+            m, f, future = request
+            if self.error is not None:
+                # the oracle has gone, so everything still queued fails
+                self.__fail(future)
+                continue
+            try:
+                self.proc.stdin.write(encode_request(self.binary, m, f))
+                await self.proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                self.__fail(future)
+                continue
+            await self.in_flight.put(future)
+
+    async def __read_number(self):
+        if self.binary:
+            n, = LENGTH.unpack(await self.proc.stdout.readexactly(LENGTH.size))
+            return int.from_bytes(await self.proc.stdout.readexactly(n), "big")
+        return int(await self.proc.stdout.readline())
+
+    async def __recv(self):
+        c = await self.__read_number()
+        if not self.returns_cycles:
+            return c
+        return c, await self.__read_number()
+
+    async def __read(self):
+        # replies come back in the order the requests were written
+        while True:
+            future = await self.in_flight.get()
+            if future is None:
+                return
+            try:
+                reply = await self.__recv()
+            except (ValueError, asyncio.IncompleteReadError): # once the oracle has exited
+                self.__fail(future)
+                continue
+            if not future.done():
+                future.set_result(reply)
+
+
+class AsyncOracleClient:
+    """
+    asyncio version of oracle_client.OracleClient that spreads requests
+    over `n_workers` C oracles (default: one per core), all with the same key
+
+        async with AsyncOracleClient('task2_in_c.exe', p, q, N, d) as oracle:
+            c, cycles = await oracle.D(m, f)
+            replies = await oracle.D_batch([(m, f) for f in fs])
+
+    each request goes to the worker with the least outstanding work, and
+    waits for room if every worker already has `queue_size` queued
+    """
+    n_workers: int
+    workers: list[_Worker]
+
+    def __init__(self, exe: str, p: int, q: int, N: int, d: int, n_workers: int=None,
+                 returns_cycles: bool=True, queue_size: int=64, pipeline_depth: int=16,
+                 extra_args=(), binary: bool=True) -> None:
+        """
+        `returns_cycles`, `extra_args` and `binary` are as for OracleClient
+        `pipeline_depth` is how many requests a worker has written before
+        it waits for a reply
+        """
+        self.exe = exe
+        self.key = (p, q, N, d)
+        self.n_workers = n_workers or os.cpu_count()
+        self.returns_cycles = returns_cycles
+        self.queue_size = queue_size
+        self.pipeline_depth = pipeline_depth
+        self.extra_args = (*extra_args, "-b") if binary else extra_args
+        self.binary = binary
+        self.workers = []
+
+    async def start(self):
+        for _ in range(self.n_workers):
+            proc = await asyncio.create_subprocess_exec(
+                self.exe, "-s", *self.extra_args,
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+            proc.stdin.write(encode_request(self.binary, *self.key))
+            self.workers.append(_Worker(proc, self.returns_cycles, self.binary,
+                                        self.queue_size, self.pipeline_depth))
+
+    def __alive(self):
+        """
+        the workers whose oracle is still running, raising a dead one's
+        error if there are none left
+        """
+        alive = [worker for worker in self.workers if worker.error is None]
+        if not alive:
+            raise self.workers[-1].error if self.workers else RuntimeError("oracle client not started")
+        return alive
+
+    async def D(self, m, f=0):
+        """
+        signs `m` with a fault at `f` on the least busy worker whose oracle
+        is still running (a dead one's queue is always empty, so it would
+        otherwise take every request)
+        """
+        worker = min(self.__alive(), key=_Worker.load)
+        future = asyncio.get_running_loop().create_future()
+        await worker.queue.put((m, f, future))
+        return await future
+
+    async def D_batch(self, requests):
+        """
+        signs every (m, f) in `requests` across all the workers at once
+        returns the replies in the same order as `requests`
+        """
+        self.__alive()
+        return await asyncio.gather(*(self.D(m, f) for m, f in requests))
+
+    async def close(self):
+        """
+        lets every worker finish what it has queued, then closes them
+        """
+        for worker in self.workers:
+            await worker.queue.put(None)
+        for worker in self.workers:
+            await asyncio.gather(*worker.tasks)
+            await worker.proc.wait()
+        self.workers = []
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
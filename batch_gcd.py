@@ -0,0 +1,156 @@
+from task1 import gcd_extended, rsa_keygen
+import collections
+import math
+import random
+import sys
+import time
+
+
+def product_tree(xs):
+    """
+    levels of the product tree of `xs`: the leaves first, then each level
+    multiplies neighbouring pairs of the one below, up to [product of xs]
+    https://facthacks.cr.yp.to/product.html
+    """
+    tree = [list(xs)]
+    while len(tree[-1]) > 1:
+        level = tree[-1]
+        tree.append([level[i]*level[i+1] if i+1 < len(level) else level[i]
+                     for i in range(0, len(level), 2)])
+    return tree
+
+
+def remainder_tree(x, tree, square=False):
+    """
+    `x` mod each leaf of `tree` (or mod the leaf squared), reducing down
+    the tree so each step only divides by a number half the size
+    https://facthacks.cr.yp.to/remainder.html
+    """
+    rems = [x]
+    for level in reversed(tree):
+        rems = [rems[i//2] % (n*n if square else n) for i, n in enumerate(level)]
+    return rems
+
+
+def batch_gcd(moduli):
+    """
+    gcd(N, product of the other moduli) for each N in `moduli`, in
+    quasi-linear time rather than a gcd for every pair
+    (the moduli should be distinct)
+    https://facthacks.cr.yp.to/batchgcd.html
+    """
+    tree = product_tree(moduli)
+    rems = remainder_tree(tree[-1][0], tree, square=True)
+    return [math.gcd(r // N, N) for r, N in zip(rems, moduli)]
+
+
+def lenstra_value(N, m, S_faulty, e):
+    """
+    m - S^e (mod N), which is a multiple of exactly one prime of N when S
+    is only wrong mod that prime, and 0 when S isn't faulty at all
+    https://link.springer.com/article/10.1007/s001450010016 (Lenstra's version)
+    """
+    return (m - pow(S_faulty, e, N)) % N
+
+
+def accumulated_gcd(values, N):
+    """
+    a factor of N from the Lenstra values of many signatures under N with a
+    single gcd of their product (mod N)
+    if the product has both primes in it, it is split in half until a part
+    only has one; returns None if no part gives a factor
+    """
+    if not values:
+        return None
+    acc = 1
+    for v in values:
+        acc = acc * v % N
+    g = math.gcd(acc, N)
+    if 1 < g < N:
+        return g
+    if g == 1 or len(values) == 1:
+        return None
+    half = len(values) // 2
+    return accumulated_gcd(values[:half], N) or accumulated_gcd(values[half:], N)
+
+
+def private_exponent(p, q, e):
+    # d such that d*e == 1 (mod phi(N)), same as the end of each attack
+    phi_n = (p-1)*(q-1)
+    d, _, gcd = gcd_extended(e, phi_n)
+    assert(gcd == 1)
+    return d % phi_n
+
+
+def batch_factor(signatures, verbosity=0):
+    """
+    `signatures` is an iterable of (N, m, S_faulty, e) from any number of keys
+    returns {N: (p, q, d)} for every modulus that could be factored, by:
+    1. each N's faulty signatures, with one accumulated gcd per N
+    2. primes shared between moduli, with a batch gcd over all of them
+    3. the primes found so far against every modulus, with one remainder tree
+    """
+    values = collections.defaultdict(list)
+    exponents = {}
+    for N, m, S_faulty, e in signatures:
+        exponents[N] = e
+        v = lenstra_value(N, m, S_faulty, e)
+        if v != 0:
+            values[N].append(v)
+    moduli = list(exponents)
+
+    factors = {}
+    for N, vs in values.items():
+        p = accumulated_gcd(vs, N)
+        if p is not None:
+            factors[N] = p
+    if verbosity >= 1: print(f"\t{len(factors)}/{len(moduli)} moduli factored from their signatures")
+
+    if len(moduli) > 1:
+        for N, g in zip(moduli, batch_gcd(moduli)):
+            if 1 < g < N:
+                factors.setdefault(N, g)
+        if verbosity >= 1: print(f"\t{len(factors)}/{len(moduli)} after a batch gcd of the moduli")
+
+    primes = {p for N, p in factors.items()} | {N // p for N, p in factors.items()}
+    if primes and len(factors) < len(moduli):
+        tree = product_tree(moduli)
+        prime_product = product_tree(primes)[-1][0]
+        for N, r in zip(moduli, remainder_tree(prime_product, tree)):
+            g = math.gcd(r, N)
+            if 1 < g < N:
+                factors.setdefault(N, g)
+        if verbosity >= 1: print(f"\t{len(factors)}/{len(moduli)} after trying the primes found on every modulus")
+
+    result = {}
+    for N, p in factors.items():
+        q = N // p
+        assert(p*q == N)
+        result[N] = (p, q, private_exponent(p, q, exponents[N]))
+    return result
+
+
+if __name__ == '__main__':
+    # python batch_gcd.py [n_keys] [n_bits]
+    # a fleet of task1.rsa_sign devices, each giving a few signatures of
+    # which some are faulty, plus a few keys that share a prime
+    from task1 import rsa_sign
+    n_keys = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    l = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    keys = [rsa_keygen(l, verbosity=0, n_checks=1) for _ in range(n_keys)]
+    for i in range(n_keys // 8):
+        # a device with a bad RNG that reuses another's p
+        p = keys[i][0]
+        q = rsa_keygen(l, verbosity=0, n_checks=1)[1]
+        e = 65537
+        keys.append((p, q, p*q, e, private_exponent(p, q, e)))
+    signatures = []
+    for p, q, N, e, d in keys:
+        for _ in range(4):
+            m = random.randint(2, N-1)
+            signatures.append((N, m, rsa_sign(p, q, N, d, l, m, random.choice((0, 0, 1, 2))), e))
+    start_time = time.perf_counter()
+    found = batch_factor(signatures, verbosity=1)
+    print(f"factored {len(found)}/{len(keys)} moduli from {len(signatures)} signatures "
+          f"in {time.perf_counter()-start_time :.3f} seconds")
+    assert(all(found[N][2] == d for _, _, N, _, d in keys if N in found))
@@ -0,0 +1,159 @@
+from oracle_client import OracleClient
+from oracle_middleware import OracleMiddleware
+from task1 import rsa_keygen
+import task1
+import task2
+import task1_shamir_countermeasure
+import task2_nonCRT_attack
+import contextlib
+import functools
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+BITS = (512, 1024, 2048, 4096)
+
+# name -> (rsa_sign, attack, returns_cycles) for the Python signers
+PY_TARGETS = {
+    "task1": (task1.rsa_sign, task1.attack, False),
+    "task2": (task2.rsa_sign, task2.attack, True),
+    "shamir": (task1_shamir_countermeasure.rsa_sign, task1_shamir_countermeasure.attack, False),
+}
+
+# name -> (exe, extra args, attack, returns_cycles, key sizes it was built for)
+# task2_nonCRT.c has l fixed at 512, so it is skipped for other key sizes
+C_TARGETS = {
+    "c_task1": ("task1_in_c.exe", (), task1.attack, False, BITS),
+    "c_task2": ("task2_in_c.exe", (), task2.attack, True, BITS),
+    "c_task2_crt": ("task2_in_c.exe", ("-k",), task2.attack, True, BITS),
+    "c_task2_sliding": ("task2_in_c.exe", ("-k", "-p", "sliding"), task2.attack, True, BITS),
+    "c_nonCRT": ("task2_nonCRT.exe", (), task2_nonCRT_attack.attack, True, (512,)),
+}
+
+TARGETS = (*PY_TARGETS, *C_TARGETS)
+
+
+def bench_target(D, attack, returns_cycles, N, e, d, n_signs=100, n_attacks=10):
+    """
+    times `n_signs` fault-free signatures and `n_attacks` attacks with D
+    returns a dict of the measurements, where the per success ones are
+    None if no attack succeeded
+    """
+    messages = [random.randint(2, N-1) for _ in range(n_signs)]
+    # no cache, every call should reach the oracle
+    oracle = OracleMiddleware(D, cache_size=0)
+    start = time.perf_counter()
+    for m in messages:
+        oracle(m, 0)
+    sign_seconds = (time.perf_counter() - start) / n_signs
+
+    result = {
+        "sign_seconds": sign_seconds,
+        "sign_cycles": oracle.cycles / n_signs if returns_cycles else None,
+    }
+
+    oracle.reset()
+    n_passed = 0
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(n_attacks):
+            try:
+                assert(attack(oracle, N, e) == d)
+                n_passed += 1
+            except AssertionError:
+                continue
+    attack_seconds = time.perf_counter() - start
+
+    per_success = lambda x: x / n_passed if n_passed else None
+    result.update({
+        "n_attacks": n_attacks,
+        "n_passed": n_passed,
+        "attack_seconds": attack_seconds / n_attacks,
+        "seconds_per_success": per_success(attack_seconds),
+        "calls_per_success": per_success(oracle.n_calls),
+        "cycles_per_success": per_success(oracle.cycles) if returns_cycles else None,
+        "oracle": oracle.stats(),
+    })
+    return result
+
+
+def run_benchmarks(bits=BITS, targets=TARGETS, n_signs=100, n_attacks=10, verbosity=1):
+    """
+    benchmarks every target in `targets` at each key size in `bits`,
+    with one key per key size shared by all the targets
+    returns a dict ready to be written as JSON
+    """
+    results = []
+    for n_bits in bits:
+        p, q, N, e, d = rsa_keygen(n_bits, verbosity=0, n_checks=1)
+        for target in targets:
+            entry = {"target": target, "n_bits": n_bits}
+            if target in PY_TARGETS:
+                sign_func, attack, returns_cycles = PY_TARGETS[target]
+                D = functools.partial(sign_func, p, q, N, d, n_bits)
+                entry.update(bench_target(D, attack, returns_cycles, N, e, d, n_signs, n_attacks))
+            else:
+                exe, extra_args, attack, returns_cycles, supported = C_TARGETS[target]
+                if n_bits not in supported or not os.path.exists(exe):
+                    entry["skipped"] = f"{exe} not built" if n_bits in supported else f"{exe} only handles {supported} bits"
+                else:
+                    with OracleClient(os.path.abspath(exe), p, q, N, d, returns_cycles, extra_args=extra_args) as D:
+                        entry.update(bench_target(D, attack, returns_cycles, N, e, d, n_signs, n_attacks))
+            results.append(entry)
+            if verbosity >= 1:
+                print(format_entry(entry))
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "n_signs": n_signs,
+        "n_attacks": n_attacks,
+        "results": results,
+    }
+
+
+def format_entry(entry):
+    name = f"{entry['target']:>12} {entry['n_bits']:>5} bits:"
+    if "skipped" in entry:
+        return f"{name} skipped ({entry['skipped']})"
+    line = f"{name} sign {1000*entry['sign_seconds'] :.3f}ms"
+    if entry["sign_cycles"] is not None:
+        line += f" / {entry['sign_cycles'] :.0f} cycles"
+    line += f", attacks {entry['n_passed']}/{entry['n_attacks']}"
+    if entry["n_passed"]:
+        line += f", {entry['seconds_per_success'] :.3f}s and {entry['calls_per_success'] :.1f} calls per success"
+    return line
+
+
+def compare(old, new):
+    """
+    prints how each timing in `new` compares with the same target and
+    key size in `old` (both as returned by run_benchmarks)
+    """
+    old_entries = {(entry["target"], entry["n_bits"]): entry for entry in old["results"]}
+    for entry in new["results"]:
+        before = old_entries.get((entry["target"], entry["n_bits"]))
+        if before is None or "skipped" in entry or "skipped" in before:
+            continue
+        ratios = []
+        for field in ("sign_seconds", "seconds_per_success", "calls_per_success", "cycles_per_success"):
+            if entry.get(field) and before.get(field):
+                ratios.append(f"{field} {entry[field] / before[field] :.2f}x")
+        print(f"{entry['target']:>12} {entry['n_bits']:>5} bits: {', '.join(ratios)}")
+
+
+if __name__ == '__main__':
+    # python benchmark.py <out.json> [bits, comma separated] [targets, comma separated]
+    # python benchmark.py compare <old.json> <new.json>
+    if sys.argv[1] == "compare":
+        with open(sys.argv[2]) as old, open(sys.argv[3]) as new:
+            compare(json.load(old), json.load(new))
+    else:
+        bits = tuple(map(int, sys.argv[2].split(","))) if len(sys.argv) > 2 else BITS
+        targets = tuple(sys.argv[3].split(",")) if len(sys.argv) > 3 else TARGETS
+        report = run_benchmarks(bits, targets)
+        with open(sys.argv[1], "w") as file:
+            json.dump(report, file, indent=2)
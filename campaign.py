@@ -0,0 +1,182 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from journal import Journal
+from oracle_middleware import OracleMiddleware
+from task1 import rsa_keygen
+from trace_store import TraceStore
+import task1
+import task2
+import task1_shamir_countermeasure
+import contextlib
+import functools
+import math
+import multiprocessing
+import os
+import queue
+import random
+import sys
+
+# name -> (rsa_sign, attack) for each target that run_campaign knows about
+TARGETS = {
+    "task1": (task1.rsa_sign, task1.attack),
+    "task2": (task2.rsa_sign, task2.attack),
+    "shamir": (task1_shamir_countermeasure.rsa_sign, task1_shamir_countermeasure.attack),
+}
+
+# per-worker state, set up once by _init_worker
+_key = None
+_D = None
+_attack = None
+_private_key = None
+_trace = None
+
+
+def wilson_interval(n_passed, n_trials, z=1.96):
+    """
+    confidence interval for the success rate n_passed/n_trials
+    (default z gives 95%)
+    https://en.wikipedia.org/wiki/Binomial_proportion_confidence_interval#Wilson_score_interval
+    """
+    if n_trials == 0:
+        return 0.0, 1.0
+    rate = n_passed / n_trials
+    denom = 1 + z*z/n_trials
+    centre = (rate + z*z/(2*n_trials)) / denom
+    spread = z*math.sqrt(rate*(1-rate)/n_trials + z*z/(4*n_trials*n_trials)) / denom
+    return max(0.0, centre - spread), min(1.0, centre + spread)
+
+
+class CampaignResult:
+    n_passed: int
+    n_trials: int
+
+    def __init__(self) -> None:
+        self.n_passed = 0
+        self.n_trials = 0
+
+    def merge(self, n_passed, n_trials):
+        self.n_passed += n_passed
+        self.n_trials += n_trials
+
+    @property
+    def rate(self):
+        return self.n_passed / self.n_trials if self.n_trials else 0.0
+
+    def interval(self, z=1.96):
+        return wilson_interval(self.n_passed, self.n_trials, z)
+
+    def __str__(self):
+        lo, hi = self.interval()
+        return (f"{self.n_passed}/{self.n_trials} attacks successful ({100*self.rate :.4f}%, "
+                f"95% CI {100*lo :.4f}%-{100*hi :.4f}%)")
+
+
+def _init_worker(target, n_bits, keys=None, trace=None):
+    """
+    generates this worker's key and oracle once, so the trials
+    it runs only pay for the attack itself
+    `keys` is a queue of keys from a journal to use before generating new ones
+    `trace` is the path of a trace_store.TraceStore for every oracle call
+    """
+    global _key, _D, _attack, _private_key, _trace
+    random.seed() # forked workers would otherwise share the parent's random state
+    sign_func, _attack = TARGETS[target]
+    try:
+        p, q, N, e, d = keys.get_nowait() if keys is not None else rsa_keygen(n_bits, verbosity=0, n_checks=1)
+    except queue.Empty:
+        p, q, N, e, d = rsa_keygen(n_bits, verbosity=0, n_checks=1)
+    _key = (N, e, d)
+    _private_key = (p, q, N, e, d)
+    _trace = TraceStore(trace) if trace is not None else None
+    # no cache, so every call the attacks make is counted
+    _D = OracleMiddleware(functools.partial(sign_func, p, q, N, d, n_bits), cache_size=0, trace=_trace)
+
+
+def _run_chunk(n_trials, quiet=True):
+    """
+    runs `n_trials` attacks against this worker's key
+    returns (n_passed, n_trials, oracle calls by fault class, the worker's key)
+    """
+    N, e, d = _key
+    n_passed = 0
+    _D.reset()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+        for _ in range(n_trials):
+            try:
+                d2 = _attack(_D, N, e)
+                assert(d == d2)
+                n_passed += 1
+            except AssertionError:
+                continue
+    if _trace is not None:
+        _trace.flush()
+    return n_passed, n_trials, dict(_D.calls), _private_key
+
+
+def run_campaign(target, n_trials, n_bits=1024, n_workers=None, chunk_size=100, verbosity=1, journal=None,
+                 trace=None):
+    """
+    runs `n_trials` attacks on `target` (a key of TARGETS) spread over a
+    pool of `n_workers` processes (default: one per core), each with its own key
+    trials are handed out `chunk_size` at a time and merged as they complete
+
+    with a `journal` (a journal.Journal or a path to one) every completed
+    chunk is recorded, and a campaign restarted on the same journal only
+    runs the trials that are left, reusing the keys the workers had
+    with a `trace` (a directory) every worker appends each oracle call to
+    the same trace_store.TraceStore there
+    """
+    if isinstance(journal, str):
+        with Journal(journal) as opened:
+            return run_campaign(target, n_trials, n_bits, n_workers, chunk_size, verbosity, opened, trace)
+    if trace is not None:
+        TraceStore(trace, n_bits).close() # made here so the workers don't race to make it
+
+    result = CampaignResult()
+    keys = None
+    if journal is not None:
+        settings = journal.last("campaign")
+        if settings is None:
+            journal.append("campaign", target=target, n_bits=n_bits)
+        else:
+            assert(settings["target"] == target and settings["n_bits"] == n_bits), \
+                f"journal is for {settings['target']} at {settings['n_bits']} bits"
+        for record in journal.find("trials"):
+            result.merge(record["n_passed"], record["n_trials"])
+        known_keys = [tuple(r[x] for x in ("p", "q", "N", "e", "d")) for r in journal.find("private_key")]
+        keys = multiprocessing.Queue()
+        for key in known_keys:
+            keys.put(key)
+        known_N = {key[2] for key in known_keys}
+        if verbosity >= 1 and result.n_trials:
+            print(f"resuming from {journal.path}: {result}")
+
+    n_left = max(n_trials - result.n_trials, 0)
+    chunks = [chunk_size] * (n_left // chunk_size)
+    if n_left % chunk_size:
+        chunks.append(n_left % chunk_size)
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(target, n_bits, keys, trace)) as pool:
+        futures = [pool.submit(_run_chunk, n) for n in chunks]
+        for future in as_completed(futures):
+            n_passed, n_run, calls, key = future.result()
+            result.merge(n_passed, n_run)
+            if journal is not None:
+                if key[2] not in known_N:
+                    p, q, N, e, d = key
+                    journal.append("private_key", p=p, q=q, N=N, e=e, d=d)
+                    known_N.add(N)
+                journal.append("trials", N=key[2], n_passed=n_passed, n_trials=n_run, calls=calls)
+            if verbosity >= 1:
+                print(f"attacks {100*result.n_trials/n_trials :.3f}% done, {result}")
+    return result
+
+
+if __name__ == '__main__':
+    # python campaign.py [target] [n_att] [journal] [trace directory]
+    # run again with the same journal to carry on from where it stopped
+    # ("-" for no journal), see trace_store.py for reading a trace
+    target = sys.argv[1] if len(sys.argv) > 1 else "shamir"
+    n_att = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    journal = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] != "-" else None
+    trace = sys.argv[4] if len(sys.argv) > 4 else None
+    print(run_campaign(target, n_att, journal=journal, trace=trace))
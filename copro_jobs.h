@@ -0,0 +1,159 @@
+/*
+Fault RNG and threaded signing for the C oracles, shared by task2_in_c.c
+and task2_nonCRT.c.
+
+each oracle keeps everything a run touches in its own struct copro, so the
+driver here only needs three things from it: how to make a context for a
+thread, how to sign with one, and how to free it (`struct copro_jobs`)
+*/
+#ifndef COPRO_JOBS_H
+#define COPRO_JOBS_H
+
+#include <stdlib.h>
+#include <string.h>
+#include <assert.h>
+#include <pthread.h>
+#include <gmp.h>
+
+static inline void copro_rng_seed(unsigned long long *rng, unsigned long long seed) {
+    // splitmix64 of `seed`, so nearby seeds (like seed + job) give unrelated
+    // streams, https://prng.di.unimi.it/splitmix64.c
+    unsigned long long z = seed + 0x9E3779B97F4A7C15ULL;
+    z = (z ^ (z >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    z = (z ^ (z >> 27)) * 0x94D049BB133111EBULL;
+    z ^= z >> 31;
+    *rng = z != 0 ? z : 1; // xorshift gets stuck on 0
+}
+
+static inline unsigned int copro_rng_next(unsigned long long *rng) {
+    // xorshift64*, https://en.wikipedia.org/wiki/Xorshift#xorshift*
+    *rng ^= *rng >> 12;
+    *rng ^= *rng << 25;
+    *rng ^= *rng >> 27;
+    return (*rng * 0x2545F4914F6CDD1DULL) >> 32;
+}
+
+static inline unsigned long long copro_rng_next64(unsigned long long *rng) {
+    return (unsigned long long)copro_rng_next(rng) << 32 | copro_rng_next(rng);
+}
+
+static inline long export_padded(mpz_t x, unsigned char *buf, size_t size) {
+    // x as exactly `size` big-endian bytes, zero padded on the left
+    // returns size, or -1 if x doesn't fit
+    size_t len = mpz_sgn(x) == 0 ? 0 : (mpz_sizeinbase(x, 2) + 7) / 8;
+    if (len > size) {
+        return -1;
+    }
+    memset(buf, 0, size - len);
+    mpz_export(buf + (size - len), NULL, 1, 1, 1, 0, x);
+    return size;
+}
+
+// many signatures, each with its own fault cycle (and message), shared out
+// between threads in this process
+// each thread makes one context with ctx_new and reuses it for every job it
+// takes, and job i is signed with seed + i so what a job gives doesn't
+// depend on which thread ran it
+struct copro_jobs {
+    mpz_t *ms; // one message for every job, or the same one if n_ms is 1
+    size_t n_ms;
+    const unsigned long *faults;
+    size_t n_jobs, next;
+    unsigned long long seed;
+    void *arg; // for the oracle's callbacks (its key and so on)
+    void *(*ctx_new)(struct copro_jobs *jobs);
+    // signs `m` into `c` on `ctx` with its fault RNG seeded from `seed`,
+    // returns the cycles it took
+    unsigned long (*sign)(struct copro_jobs *jobs, void *ctx, unsigned long long seed,
+                          unsigned long fault, mpz_t *m, mpz_t *c);
+    void (*ctx_free)(void *ctx);
+    // called with `lock` held as each job finishes, `out` is for it to use
+    void (*done)(struct copro_jobs *jobs, size_t i, unsigned long cycles, mpz_t c);
+    void *out;
+    pthread_mutex_t lock; // guards next and done
+};
+
+static inline void *copro_worker(void *arg) {
+    struct copro_jobs *jobs = arg;
+    void *ctx = jobs->ctx_new(jobs);
+    mpz_t c;
+    mpz_init(c);
+    while (1) {
+        pthread_mutex_lock(&jobs->lock);
+        size_t i = jobs->next++;
+        pthread_mutex_unlock(&jobs->lock);
+        if (i >= jobs->n_jobs) {
+            break;
+        }
+        unsigned long cycles = jobs->sign(jobs, ctx, jobs->seed + i, jobs->faults[i],
+                                          &jobs->ms[jobs->n_ms == 1 ? 0 : i], &c);
+        pthread_mutex_lock(&jobs->lock);
+        jobs->done(jobs, i, cycles, c);
+        pthread_mutex_unlock(&jobs->lock);
+    }
+    mpz_clear(c);
+    jobs->ctx_free(ctx);
+    return NULL;
+}
+
+static inline void copro_run_jobs(struct copro_jobs *jobs, int n_threads) {
+    if (n_threads < 1) {
+        n_threads = 1;
+    }
+    pthread_t *threads = malloc(n_threads * sizeof(pthread_t));
+    assert(threads != NULL);
+    pthread_mutex_init(&jobs->lock, NULL);
+    jobs->next = 0;
+    for (int i=0; i<n_threads; ++i) {
+        int err = pthread_create(&threads[i], NULL, copro_worker, jobs);
+        assert(err == 0);
+    }
+    for (int i=0; i<n_threads; ++i) {
+        pthread_join(threads[i], NULL);
+    }
+    pthread_mutex_destroy(&jobs->lock);
+    free(threads);
+}
+
+// copro_sign_batch's replies: job i's signature at c + i*c_size and its cycles
+struct copro_batch {
+    unsigned char *c;
+    size_t c_size;
+    unsigned long *cycles;
+    int overflow;
+};
+
+static inline void copro_batch_done(struct copro_jobs *jobs, size_t i, unsigned long cycles, mpz_t c) {
+    struct copro_batch *batch = jobs->out;
+    batch->cycles[i] = cycles;
+    if (export_padded(c, batch->c + i*batch->c_size, batch->c_size) < 0) {
+        batch->overflow = 1;
+    }
+}
+
+static inline long copro_sign_batch(struct copro_jobs *jobs, const unsigned char *m, size_t m_size, size_t n_m,
+                                    unsigned char *c, size_t c_size, unsigned long *cycles, int n_threads) {
+    // runs `jobs` (with its faults, n_jobs, seed and callbacks set) on
+    // n_m (1 or n_jobs) messages of m_size big-endian bytes each, writing
+    // the signatures and cycle counts in order, see copro_signer_sign_batch
+    // returns c_size, or -1 if a signature doesn't fit
+    mpz_t *ms = malloc(n_m * sizeof(mpz_t));
+    assert(ms != NULL && (n_m == 1 || n_m == jobs->n_jobs));
+    for (size_t i=0; i<n_m; ++i) {
+        mpz_init(ms[i]);
+        mpz_import(ms[i], m_size, 1, 1, 1, 0, m + i*m_size);
+    }
+    struct copro_batch batch = {c, c_size, cycles, 0};
+    jobs->ms = ms;
+    jobs->n_ms = n_m;
+    jobs->done = copro_batch_done;
+    jobs->out = &batch;
+    copro_run_jobs(jobs, n_threads);
+    for (size_t i=0; i<n_m; ++i) {
+        mpz_clear(ms[i]);
+    }
+    free(ms);
+    return batch.overflow ? -1 : (long)c_size;
+}
+
+#endif
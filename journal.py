@@ -0,0 +1,155 @@
+import json
+import os
+import sys
+import zlib
+
+# file layout: one record per line, each "<crc32 of the JSON, 8 hex digits> <JSON>\n"
+# records are only ever appended, so a crash can only leave a torn last line,
+# which fails its checksum and is cut off when the journal is next opened
+# every record is a JSON object with a "kind", e.g.
+#   {"kind": "key", "N": ..., "e": ...}            the key the campaign is against
+#   {"kind": "bit", "pos": 510, "bit": 1, "calls": 1}
+#   {"kind": "trials", "n_passed": 100, "n_trials": 100, "calls": {...}}
+
+
+def _encode(record):
+    payload = json.dumps(record, separators=(",", ":"))
+    return f"{zlib.crc32(payload.encode()) :08x} {payload}\n".encode()
+
+
+def _decode(line):
+    # the record on `line`, or None if it is torn or doesn't match its checksum
+    if not line.endswith(b"\n"):
+        return None
+    crc, _, payload = line[:-1].partition(b" ")
+    try:
+        if int(crc, 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+class Journal:
+    """
+    append-only, checksummed log of a long run's progress, so a run that is
+    interrupted can pick up where it stopped rather than starting over
+
+    opening a journal reads back every record written before; anything
+    from the first bad record on (a write cut short by a crash) is dropped
+    from the file, so new records always follow a good one
+    """
+    path: str
+    records: list[dict]
+    sync: bool
+
+    def __init__(self, path, sync=True) -> None:
+        """
+        opens the journal at `path`, making an empty one if it doesn't exist
+        `sync` fsyncs after every record, so a record that `append`
+        returned from survives a power cut and not just a crash
+        """
+        self.path = path
+        self.sync = sync
+        self.records = []
+        good_size = 0
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                for line in file:
+                    record = _decode(line)
+                    if record is None:
+                        break
+                    self.records.append(record)
+                    good_size += len(line)
+        self.__file = open(path, "ab")
+        if self.__file.tell() != good_size:
+            self.__file.truncate(good_size)
+            self.__file.seek(good_size)
+
+    def append(self, kind, **fields):
+        """
+        writes a record of `kind` with `fields` (JSON values, ints of any size)
+        """
+        record = {"kind": kind, **fields}
+        self.__file.write(_encode(record))
+        self.__file.flush()
+        if self.sync:
+            os.fsync(self.__file.fileno())
+        self.records.append(record)
+        return record
+
+    def find(self, kind):
+        """
+        every record of `kind`, oldest first
+        """
+        return [record for record in self.records if record["kind"] == kind]
+
+    def last(self, kind):
+        """
+        the newest record of `kind`, or None
+        """
+        for record in reversed(self.records):
+            if record["kind"] == kind:
+                return record
+        return None
+
+    def close(self):
+        self.__file.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def check_key(journal, N, e):
+    """
+    records the public key a journaled attack is against, or if it already
+    has one, checks it is the same key so progress isn't mixed between keys
+    """
+    record = journal.last("key")
+    if record is None:
+        journal.append("key", N=N, e=e)
+    else:
+        assert(record["N"] == N and record["e"] == e), "journal is for a different key"
+
+
+def journaled_keygen(journal, keygen):
+    """
+    the private key (p, q, N, e, d) saved in `journal` by an earlier run,
+    or a new one from `keygen()` that is saved for the next
+    (only for keys generated for an experiment, it is written in the clear)
+    """
+    record = journal.last("private_key")
+    if record is not None:
+        return tuple(record[x] for x in ("p", "q", "N", "e", "d"))
+    p, q, N, e, d = keygen()
+    journal.append("private_key", p=p, q=q, N=N, e=e, d=d)
+    return p, q, N, e, d
+
+
+def recovered_bits(journal):
+    """
+    {pos: bit} of every "bit" record, for attacks that find d a bit at a time
+    """
+    return {record["pos"]: record["bit"] for record in journal.find("bit")}
+
+
+if __name__ == '__main__':
+    # python journal.py <path>
+    # prints how many of each kind of record a journal holds
+    with Journal(sys.argv[1]) as journal:
+        kinds = {}
+        for record in journal.records:
+            kinds[record["kind"]] = kinds.get(record["kind"], 0) + 1
+        print(f"{len(journal)} records: " + ", ".join(f"{n} {kind}" for kind, n in kinds.items()))
+        trials = journal.find("trials")
+        if trials:
+            print(f"{sum(r['n_passed'] for r in trials)}/{sum(r['n_trials'] for r in trials)} trials passed")
+        bits = journal.find("bit")
+        if bits:
+            print(f"{len(bits)} bits recovered with {sum(r.get('calls', 0) for r in bits)} oracle calls")
@@ -0,0 +1,180 @@
+from concurrent.futures import ProcessPoolExecutor
+from task1 import rsa_keygen, gcd_extended
+from file_lock import FileLock
+import os
+import random
+import struct
+import sys
+
+# file layout: a header, then fixed size records so key i is at a known offset
+# header:  magic, n_bits
+# record:  p, q, N, e, d, dp, dq, q_inv as big-endian unsigned ints, where
+#          p, q, dp, dq, q_inv take n_bits/2 bits and N, e, d take n_bits
+MAGIC = b"ORISKEYS"
+HEADER = struct.Struct(">8sI")
+# <path>.cursor holds the index of the next key `draw` hands out, so no two
+# draws (from any process or run) get the same key; <path>.lock guards it
+CURSOR = struct.Struct(">Q")
+FIELDS = ("p", "q", "N", "e", "d", "dp", "dq", "q_inv")
+HALF_FIELDS = ("p", "q", "dp", "dq", "q_inv")
+
+
+def _field_widths(n_bits):
+    half = (n_bits//2 + 7) // 8
+    full = (n_bits + 7) // 8
+    return [half if field in HALF_FIELDS else full for field in FIELDS]
+
+
+def _init_worker():
+    random.seed() # forked workers would otherwise all pick the same e's
+
+
+def make_key(n_bits, n_checks=1):
+    """
+    one full key: p, q, N, e, d plus the CRT parameters
+    dp = d mod p-1, dq = d mod q-1, q_inv = 1/q mod p
+    """
+    p, q, N, e, d = rsa_keygen(n_bits, verbosity=0, n_checks=n_checks)
+    q_inv, _, gcd = gcd_extended(q, p)
+    assert(gcd == 1)
+    return p, q, N, e, d, d % (p-1), d % (q-1), q_inv % p
+
+
+class KeyPool:
+    """
+    a file of pre-generated keys, all of `n_bits` bits
+    keys are read straight from their offset so drawing one doesn't
+    depend on how many keys the file holds
+    """
+    path: str
+    n_bits: int
+
+    def __init__(self, path, n_bits=None) -> None:
+        """
+        opens the pool at `path`, making an empty one if `n_bits` is given
+        and the file doesn't exist yet
+        """
+        self.path = path
+        if not os.path.exists(path):
+            if n_bits is None:
+                raise FileNotFoundError(path)
+            with open(path, "wb") as file:
+                file.write(HEADER.pack(MAGIC, n_bits))
+        with open(path, "rb") as file:
+            magic, self.n_bits = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a key pool")
+        if n_bits is not None and n_bits != self.n_bits:
+            raise ValueError(f"{path} holds {self.n_bits} bit keys, not {n_bits}")
+        self.widths = _field_widths(self.n_bits)
+        self.record_size = sum(self.widths)
+        self.__cursor_path = path + ".cursor"
+        self.__lock = FileLock(path + ".lock")
+        self.__file = open(path, "rb")
+
+    def __len__(self):
+        return (os.path.getsize(self.path) - HEADER.size) // self.record_size
+
+    def __getitem__(self, i):
+        """
+        key `i` as (p, q, N, e, d, dp, dq, q_inv)
+        """
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        self.__file.seek(HEADER.size + i*self.record_size)
+        record = self.__file.read(self.record_size)
+        key = []
+        offset = 0
+        for width in self.widths:
+            key.append(int.from_bytes(record[offset:offset+width], "big"))
+            offset += width
+        return tuple(key)
+
+    def __read_cursor(self):
+        if not os.path.exists(self.__cursor_path):
+            return 0
+        with open(self.__cursor_path, "rb") as file:
+            return CURSOR.unpack(file.read(CURSOR.size))[0]
+
+    def __write_cursor(self, i):
+        # to a temporary file that then replaces the cursor, so a crash
+        # leaves either the old cursor or the new one, never an empty file
+        tmp_path = self.__cursor_path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(CURSOR.pack(i))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.__cursor_path)
+
+    @property
+    def next_index(self):
+        """
+        index of the key the next `draw` will hand out
+        """
+        with self.__lock:
+            return self.__read_cursor()
+
+    def draw(self):
+        """
+        the next key that no draw has handed out yet, from this process or
+        any other, in this run or an earlier one (the cursor is kept in
+        <path>.cursor, deleting it starts again from key 0 and so reissues
+        every key)
+        raises IndexError once every key has been drawn
+        """
+        with self.__lock:
+            i = self.__read_cursor()
+            if i >= len(self):
+                raise IndexError(f"all {len(self)} keys in {self.path} have been drawn, generate more")
+            self.__write_cursor(i + 1)
+        return self[i]
+
+    def draw_random(self):
+        """
+        a random key from the pool, without touching the cursor
+        draws are independent, so this can hand out the same key twice
+        (in one run or across runs): use `draw` where keys must differ
+        """
+        return self[random.randrange(len(self))]
+
+    def append(self, keys):
+        """
+        adds the (p, q, N, e, d, dp, dq, q_inv) tuples in `keys` to the file
+        """
+        with open(self.path, "ab") as file:
+            for key in keys:
+                file.write(b"".join(x.to_bytes(width, "big") for x, width in zip(key, self.widths)))
+
+    def generate(self, n_keys, n_workers=None, n_checks=1):
+        """
+        makes `n_keys` new keys over a pool of `n_workers` processes
+        (default: one per core) and appends them to the file
+        """
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker) as pool:
+            keys = pool.map(make_key, [self.n_bits]*n_keys, [n_checks]*n_keys,
+                            chunksize=max(1, n_keys // (4 * (n_workers or os.cpu_count()))))
+            self.append(keys)
+
+    def close(self):
+        self.__file.close()
+        self.__lock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == '__main__':
+    # python key_pool.py generate <path> <n_bits> <n_keys>
+    # python key_pool.py draw <path> <index>
+    #   prints p, q, N, d one per line, which is what the C oracles read first
+    if sys.argv[1] == "generate":
+        with KeyPool(sys.argv[2], int(sys.argv[3])) as pool:
+            pool.generate(int(sys.argv[4]))
+            print(f"{sys.argv[2]} now holds {len(pool)} keys")
+    elif sys.argv[1] == "draw":
+        with KeyPool(sys.argv[2]) as pool:
+            p, q, N, e, d, *_ = pool[int(sys.argv[3])]
+            print(p, q, N, d, sep="\n")
@@ -0,0 +1,174 @@
+from subprocess import Popen, PIPE
+import collections
+import struct
+
+# binary mode framing of a number, see oracle_io.h
+LENGTH = struct.Struct(">I")
+
+
+def encode_number(x):
+    """
+    `x` as a 4 byte big-endian length followed by its big-endian bytes
+    """
+    n = (x.bit_length() + 7) // 8
+    return LENGTH.pack(n) + x.to_bytes(n, "big")
+
+
+def read_number(stream):
+    """
+    reads a number written by `encode_number` from the binary `stream`
+    """
+    header = stream.read(LENGTH.size)
+    if len(header) < LENGTH.size:
+        raise EOFError("oracle closed its output")
+    n, = LENGTH.unpack(header)
+    return int.from_bytes(stream.read(n), "big")
+
+
+class OracleClient:
+    """
+    long lived connection to one of the C signing oracles
+    (task1_in_c, task2_in_c, task2_nonCRT) started in server mode
+
+    the key is sent once when the client is made, after that each
+    request is just `m` and `f` on stdin and the reply is read back
+    from stdout, so there is one process for the whole campaign
+    instead of one per call to D
+
+    numbers go over the pipes in the oracles' binary mode (`-b`), unless
+    `binary` is False, which uses the base 10 text mode instead
+    """
+    prog: Popen
+    returns_cycles: bool
+    pipeline_depth: int
+
+    def __init__(self, exe: str, p: int, q: int, N: int, d: int,
+                 returns_cycles: bool=True, pipeline_depth: int=64, extra_args=(),
+                 sweep: bool=False, binary: bool=True) -> None:
+        """
+        `returns_cycles` should be False for task1_in_c which only replies with c
+        `extra_args` are passed on to the oracle after `-s` (e.g. `-k` for task2_in_c)
+        `sweep` starts task2_in_c in sweep mode (`-w`) so `sweep` can be used,
+        D still works the same
+        `pipeline_depth` is how many requests `D_batch` writes before reading
+        the replies back (bounded so neither pipe buffer fills up and deadlocks)
+        """
+        self.returns_cycles = returns_cycles
+        self.pipeline_depth = pipeline_depth
+        self.sweep_mode = sweep
+        self.binary = binary
+        if sweep:
+            extra_args = (*extra_args, "-w")
+        if binary:
+            extra_args = (*extra_args, "-b")
+        self.prog = Popen([exe, "-s", *extra_args], stdin=PIPE, stdout=PIPE, universal_newlines=not binary)
+        self.__tokens = collections.deque() # text mode numbers read but not used yet
+        for x in (p, q, N, d):
+            self.__write_number(x)
+        self.prog.stdin.flush()
+
+    def __write_number(self, x):
+        if self.binary:
+            self.prog.stdin.write(encode_number(x))
+        else:
+            print(x, file=self.prog.stdin)
+
+    def __read_number(self):
+        if self.binary:
+            return read_number(self.prog.stdout)
+        while not self.__tokens:
+            line = self.prog.stdout.readline()
+            if not line:
+                raise EOFError("oracle closed its output")
+            self.__tokens.extend(line.split())
+        return int(self.__tokens.popleft())
+
+    def __send(self, m, f):
+        self.__write_number(m)
+        self.__write_number(f)
+        if self.sweep_mode:
+            self.__write_number(f) # a sweep of just f
+
+    def __recv(self):
+        if self.sweep_mode:
+            c = None
+            for f, c_f in self.__recv_sweep():
+                c = c_f if f else c
+            return c if c is not None else self.__fault_free, self.__cycles
+        c = self.__read_number()
+        if not self.returns_cycles:
+            return c
+        cycles = self.__read_number()
+        return c, cycles
+
+    def D(self, m, f=0):
+        """
+        signs `m` with a fault at `f`, same interface as the old
+        one-process-per-call D functions
+        """
+        self.__send(m, f)
+        self.prog.stdin.flush()
+        return self.__recv()
+
+    def D_batch(self, requests):
+        """
+        signs every (m, f) in `requests`, writing up to `pipeline_depth`
+        requests before reading any replies
+        returns the replies in the same order as `requests`
+        """
+        requests = list(requests)
+        results = []
+        for i in range(0, len(requests), self.pipeline_depth):
+            chunk = requests[i:i+self.pipeline_depth]
+            for m, f in chunk:
+                self.__send(m, f)
+            self.prog.stdin.flush()
+            for _ in chunk:
+                results.append(self.__recv())
+        return results
+
+    def __recv_sweep(self):
+        # (f, c) pairs up to the (0, c, cycles) that ends a sweep
+        while True:
+            f, c = self.__read_number(), self.__read_number()
+            if f == 0:
+                self.__fault_free, self.__cycles = c, self.__read_number()
+                return
+            yield f, c
+
+    def sweep(self, m, f_lo, f_hi):
+        """
+        signs `m` once with a fault at each cycle from `f_lo` to `f_hi`
+        (needs `sweep`), yielding (f, c) as each one completes, which
+        isn't necessarily in order of f
+        stopping early still waits for the rest of the sweep to finish
+        """
+        assert(self.sweep_mode)
+        for x in (m, f_lo, f_hi):
+            self.__write_number(x)
+        self.prog.stdin.flush()
+        replies = self.__recv_sweep()
+        try:
+            for reply in replies: # not `yield from`, which would close `replies` too
+                yield reply
+        finally:
+            for _ in replies:
+                pass
+
+    def close(self):
+        """
+        closes stdin so the oracle leaves its request loop and exits
+        """
+        if self.prog.poll() is None:
+            self.prog.stdin.close()
+            self.prog.wait()
+        self.prog.stdout.close()
+
+    def __call__(self, m, f=0):
+        return self.D(m, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,110 @@
+/*
+Reading and writing numbers for the C oracles, shared by all of them.
+
+text mode (the default, for debugging by hand): numbers are base 10 and
+whitespace separated, of any length
+binary mode (`-b`, what oracle_client.py uses): each number is a 4 byte
+big-endian length n followed by n bytes of the number, big-endian
+*/
+#ifndef ORACLE_IO_H
+#define ORACLE_IO_H
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <ctype.h>
+#include <assert.h>
+#include <gmp.h>
+#ifdef _WIN32
+#include <io.h>
+#include <fcntl.h>
+#endif
+
+static int oracle_binary = 0;
+static unsigned char *oracle_buf = NULL; // grown as needed, shared by reads and writes
+static size_t oracle_buf_size = 0;
+
+static inline unsigned char *oracle_reserve(size_t size) {
+    if (size > oracle_buf_size) {
+        oracle_buf_size = size > 2*oracle_buf_size ? size : 2*oracle_buf_size;
+        oracle_buf = realloc(oracle_buf, oracle_buf_size);
+        assert(oracle_buf != NULL);
+    }
+    return oracle_buf;
+}
+
+static inline void oracle_io_init(int argc, char **argv) {
+    // looks for `-b` in the command line
+    for (int i=1; i<argc; ++i) {
+        if (strcmp(argv[i], "-b") == 0) {
+            oracle_binary = 1;
+        }
+    }
+#ifdef _WIN32
+    if (oracle_binary) { // or "\n" bytes would be turned into "\r\n"
+        _setmode(_fileno(stdin), _O_BINARY);
+        _setmode(_fileno(stdout), _O_BINARY);
+    }
+#endif
+}
+
+static inline int read_mpz(mpz_t x) {
+    // reads one number from stdin into x
+    // returns 0 on EOF so server mode knows when to stop
+    if (oracle_binary) {
+        unsigned char len_bytes[4];
+        if (fread(len_bytes, 1, 4, stdin) != 4) {
+            return 0;
+        }
+        size_t len = (size_t)len_bytes[0] << 24 | (size_t)len_bytes[1] << 16
+                   | (size_t)len_bytes[2] << 8 | (size_t)len_bytes[3];
+        unsigned char *buf = oracle_reserve(len + 1);
+        size_t got = fread(buf, 1, len, stdin);
+        assert(got == len);
+        mpz_import(x, len, 1, 1, 1, 0, buf);
+        return 1;
+    }
+    int ch;
+    do {
+        ch = getchar();
+    } while (ch != EOF && isspace(ch));
+    if (ch == EOF) {
+        return 0;
+    }
+    size_t len = 0;
+    while (ch != EOF && !isspace(ch)) {
+        oracle_reserve(len + 2)[len] = ch;
+        len++;
+        ch = getchar();
+    }
+    oracle_buf[len] = '\0';
+    int flag = mpz_set_str(x, (char *)oracle_buf, 10); // for parsing str to mpz_t
+    assert(flag == 0);
+    return 1;
+}
+
+static inline void write_mpz(mpz_t x, char sep) {
+    // writes x to stdout, followed by `sep` in text mode
+    if (!oracle_binary) {
+        mpz_out_str(stdout, 10, x);
+        putchar(sep);
+        return;
+    }
+    size_t len = mpz_sgn(x) == 0 ? 0 : (mpz_sizeinbase(x, 2) + 7) / 8;
+    unsigned char *buf = oracle_reserve(len + 4);
+    buf[0] = len >> 24;
+    buf[1] = len >> 16;
+    buf[2] = len >> 8;
+    buf[3] = len;
+    mpz_export(buf + 4, NULL, 1, 1, 1, 0, x);
+    fwrite(buf, 1, len + 4, stdout);
+}
+
+static inline void write_ui(unsigned long x, char sep) {
+    mpz_t x_mpz;
+    mpz_init_set_ui(x_mpz, x);
+    write_mpz(x_mpz, sep);
+    mpz_clear(x_mpz);
+}
+
+#endif
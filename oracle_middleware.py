@@ -0,0 +1,127 @@
+import collections
+import random
+import math
+import time
+
+
+def fault_class(f):
+    return "fault_free" if f == 0 else "faulty"
+
+
+class OracleMiddleware:
+    """
+    wraps any D(m, f) (a Python rsa_sign partial, an OracleClient, a
+    LibOracle, ...) and is itself a D with the same replies:
+    - fault-free replies are kept in an LRU cache of `cache_size` messages,
+      so asking for the same reference signature again costs no oracle call
+    - `calls[cls]` counts the oracle calls in each fault class, where
+      `classify(f)` gives the class (default: "fault_free" or "faulty",
+      or e.g. a task2_schedule.CycleMap's phase_of to count by phase)
+    - `latencies` has the wall times of up to `max_latencies` oracle calls,
+      a uniform sample of all of them once there have been more (reservoir
+      sampling), see `percentile`; `seconds` adds up every call's time
+    - `cycles` adds up the clock cycles of replies that report them
+    - every oracle call's (m, f, c, cycles) is added to `trace` if given
+      (a trace_store.TraceStore, flushed by whoever owns it)
+    """
+    calls: collections.Counter
+    cache_hits: int
+    latencies: list[float]
+    seconds: float
+    cycles: int
+
+    def __init__(self, D, cache_size: int=1024, classify=fault_class, trace=None,
+                 max_latencies: int=10000) -> None:
+        assert(max_latencies > 0)
+        self.D = D
+        self.cache_size = cache_size
+        self.max_latencies = max_latencies
+        self.__rng = random.Random() # its own, so seeding `random` for an attack isn't disturbed
+        self.classify = classify
+        self.trace = trace
+        self.cache = collections.OrderedDict()
+        self.reset()
+
+    def reset(self):
+        """
+        clears the counts and latencies (but not the cache)
+        """
+        self.calls = collections.Counter()
+        self.cache_hits = 0
+        self.latencies = []
+        self.seconds = 0.0
+        self.cycles = 0
+        self.__n_timed = 0
+        self.__sorted = None # latencies sorted, until the next call changes them
+
+    def __time(self, seconds):
+        # https://en.wikipedia.org/wiki/Reservoir_sampling#Simple:_Algorithm_R
+        self.seconds += seconds
+        self.__n_timed += 1
+        if len(self.latencies) < self.max_latencies:
+            self.latencies.append(seconds)
+        else:
+            i = self.__rng.randrange(self.__n_timed)
+            if i >= self.max_latencies:
+                return
+            self.latencies[i] = seconds
+        self.__sorted = None
+
+    def __call__(self, m, f=0):
+        if f == 0 and m in self.cache:
+            self.cache.move_to_end(m)
+            self.cache_hits += 1
+            return self.cache[m]
+        start = time.perf_counter()
+        try:
+            reply = self.D(m, f)
+        finally:
+            # a call that raises (like a countermeasure refusing to sign) still counts
+            self.__time(time.perf_counter() - start)
+            self.calls[self.classify(f)] += 1
+        if isinstance(reply, tuple):
+            self.cycles += reply[1]
+        if self.trace is not None:
+            c, cycles = reply if isinstance(reply, tuple) else (reply, 0)
+            self.trace.add(m, f, c, cycles)
+        if f == 0 and self.cache_size > 0:
+            self.cache[m] = reply
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return reply
+
+    @property
+    def n_calls(self):
+        return sum(self.calls.values())
+
+    def percentile(self, pct):
+        """
+        `pct`th percentile of the call latencies in seconds (nearest rank),
+        estimated from the sample once there are more than `max_latencies`
+        """
+        if not self.latencies:
+            return None
+        if self.__sorted is None:
+            self.__sorted = sorted(self.latencies)
+        return self.__sorted[max(0, math.ceil(pct/100 * len(self.__sorted)) - 1)]
+
+    def stats(self):
+        """
+        the counts and latency percentiles as a dict, e.g. for JSON
+        """
+        return {
+            "calls": dict(self.calls),
+            "n_calls": self.n_calls,
+            "cache_hits": self.cache_hits,
+            "cycles": self.cycles,
+            "seconds": self.seconds,
+            "latency": {f"p{pct}": self.percentile(pct) for pct in (50, 90, 99)},
+        }
+
+    def __str__(self):
+        calls = ", ".join(f"{n} {cls}" for cls, n in self.calls.most_common())
+        if not self.latencies:
+            return f"no oracle calls ({self.cache_hits} cached)"
+        return (f"{self.n_calls} oracle calls ({calls}), {self.cache_hits} cached, "
+                f"latency p50 {1000*self.percentile(50) :.3f}ms "
+                f"p90 {1000*self.percentile(90) :.3f}ms p99 {1000*self.percentile(99) :.3f}ms")
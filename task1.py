@@ -19,7 +19,38 @@ def gcd_extended(a, b):
     return old_s, old_t, old_r
 
 
-def rsa_keygen(n_bits, verbosity=1, n_checks=100):
+class CRTKey:
+    """
+    everything rsa_sign needs for a key, worked out once rather than per signature
+    - dp = d mod p-1, dq = d mod q-1
+    - x = 1/p (mod q), y = 1/q (mod p), so that xp + yq == 1
+    - xp = x*p (mod N), yq = y*q (mod N), so that c == b*xp + a*yq (mod N)
+    """
+    def __init__(self, p, q, N, d) -> None:
+        self.p, self.q, self.N, self.d = p, q, N, d
+        self.dp = d % (p-1)
+        self.dq = d % (q-1)
+        x, y, gcd = gcd_extended(p, q)
+        assert(gcd == 1)
+        self.x = x % q
+        self.y = y % p
+        self.xp = self.x*p % N
+        self.yq = self.y*q % N
+
+
+@functools.lru_cache(maxsize=64)
+def crt_key(p, q, N, d):
+    """
+    the CRTKey for p, q, N, d, only made the first time it's asked for
+    """
+    return CRTKey(p, q, N, d)
+
+
+def rsa_keygen(n_bits, verbosity=1, n_checks=100, pool=None):
+    if pool is not None:
+        # take the next undrawn key from a key_pool.KeyPool instead
+        assert(pool.n_bits == n_bits)
+        return pool.draw()[:5]
     if verbosity >= 1: print("Starting rsa_keygen")
     # randomise p, q primes with n_bits/2 bits
     p = int(Primality.generate_probable_prime(exact_bits=n_bits//2))
@@ -56,27 +87,28 @@ def rsa_keygen(n_bits, verbosity=1, n_checks=100):
     return p, q, N, e, d
 
 
-def rsa_sign(p, q, N, d, n_bits, m, f=0):
+def rsa_sign(p, q, N, d, n_bits, m, f=0, key=None):
     # find c == m^d (mod N)
     # using https://en.wikipedia.org/wiki/Chinese_remainder_theorem#Computation
+    # `key` is the key's CRTKey (looked up from p, q, N, d if not given)
+    if key is None:
+        key = crt_key(p, q, N, d)
     
     # first compute a == m^d%p-1 (mod p)
-    a = pow(m, d%(p-1), p)
+    a = pow(m, key.dp, p)
     if f == 1:
         # flip a random bit
         a ^= 1<<(random.randint(0, n_bits-1))
 
     # then compute b == m^d%q-1 (mod q)
-    b = pow(m, d%(q-1), q)
+    b = pow(m, key.dq, q)
     if f == 2:
         # flip a random bit
         b ^= 1<<(random.randint(0, n_bits-1))
 
     # now c == a (mod p), c == b (mod q) can be computed in O(log(N)^2) time with CRT
-    x, y, gcd = gcd_extended(p, q)
-    assert(gcd == 1)
     # => c == bxp + ayq (mod N) because xp + yq == 1 (mod N)
-    c = ((b*x*p % N) + (a*y*q % N)) % N
+    c = (b*key.xp + a*key.yq) % N
     
     return c
 
@@ -3,6 +3,8 @@
 #include <assert.h>
 #include <time.h>
 #include <stdlib.h>
+#include <string.h>
+#include "oracle_io.h"
 
 #define GENERATE_KEY 0 // 0 or 1
 
@@ -83,71 +85,83 @@ void rsaKeygen(mpz_t *p, mpz_t *q, mpz_t *N, mpz_t *e, mpz_t *d) {
 }
 #endif
 
-void rsaSign(mpz_t *p, mpz_t *q, mpz_t *N, mpz_t *d, mpz_t *m, mpz_t *f) {
+#if !GENERATE_KEY
+// everything rsaSign needs that only depends on the key, so a server
+// signing many messages works it out once rather than on every call
+struct crt_key {
+    mpz_t dp, dq; // d mod p-1, d mod q-1
+    mpz_t xp, yq; // xp == 1 (mod q) and yq == 1 (mod p), both mod N
+};
+
+void crt_key_init(struct crt_key *key, mpz_t p, mpz_t q, mpz_t N, mpz_t d) {
+    mpz_t x, y, gcd;
+    mpz_inits(x, y, gcd, NULL);
+    mpz_inits(key->dp, key->dq, key->xp, key->yq, NULL);
+
+    mpz_sub_ui(gcd, p, 1); // using gcd as a dummy variable
+    mpz_mod(key->dp, d, gcd);
+    mpz_sub_ui(gcd, q, 1);
+    mpz_mod(key->dq, d, gcd);
+
+    // compute x, y such that xp + qy == 1
+    mpz_gcdext(gcd, x, y, p, q);
+    assert(mpz_cmp_ui(gcd, 1) == 0); // check that the gcd is 1
+    mpz_mul(key->xp, x, p);
+    mpz_mod(key->xp, key->xp, N);
+    mpz_mul(key->yq, y, q);
+    mpz_mod(key->yq, key->yq, N);
+
+    mpz_clears(x, y, gcd, NULL);
+}
+
+void crt_key_clear(struct crt_key *key) {
+    mpz_clears(key->dp, key->dq, key->xp, key->yq, NULL);
+}
+
+void rsaSign(mpz_t *p, mpz_t *q, mpz_t *N, struct crt_key *key, mpz_t *m, mpz_t *f) {
     // init nums used for computation
-    mpz_t a, b, x, y, prime_minus_one, d_mod, gcd, c, flip_mask, flip_index;
+    mpz_t a, b, c, tmp, flip_mask;
     mpz_init(a);
     mpz_init(b);
-    mpz_init(prime_minus_one);
-    mpz_init(d_mod);
-    mpz_init(x);
-    mpz_init(y);
-    mpz_init(gcd);
     mpz_init(c);
+    mpz_init(tmp);
     mpz_init_set_ui(flip_mask, 0);
 
     // compute the flip_mask, for flipping one random bit of a or b
     mpz_setbit(flip_mask, rand()%l);
 
     // compute a = m^(d % p-1) (mod p)
-    mpz_sub_ui(prime_minus_one, *p, 1);
-    mpz_mod(d_mod, *d, prime_minus_one);
-    mpz_powm(a, *m, d_mod, *p);
+    mpz_powm(a, *m, key->dp, *p);
     if (mpz_cmp_ui(*f, 1) == 0) { // flip a bit of `a` if f=1
         mpz_xor(a, a, flip_mask);
     }
 
     // compute b = m^(d % q-1) (mod q)
-    mpz_sub_ui(prime_minus_one, *q, 1);
-    mpz_mod(d_mod, *d, prime_minus_one);
-    mpz_powm(b, *m, d_mod, *q);
+    mpz_powm(b, *m, key->dq, *q);
     if (mpz_cmp_ui(*f, 2) == 0) { // flip a bit of `b` if f=2
         mpz_xor(b, b, flip_mask);
     }
 
-    // compute x, y such that xp + qy == 1
-    mpz_gcdext(gcd, x, y, *p, *q);
-    assert(mpz_cmp_ui(gcd, 1) == 0); // check that the gcd is 1
-
     // c == bxp + ayq (mod N)
-    mpz_mul(c, b, x);
-    mpz_mod(c, c, *N);
-    mpz_mul(c, c, *p);
-    mpz_mod(c, c, *N);
-    mpz_mul(gcd, a, y); // using gcd as a dummy variable
-    mpz_mod(gcd, gcd, *N);
-    mpz_mul(gcd, gcd, *q);
-    mpz_mod(gcd, gcd, *N);
-    mpz_add(c, c, gcd);
+    mpz_mul(c, b, key->xp);
+    mpz_mul(tmp, a, key->yq);
+    mpz_add(c, c, tmp);
     mpz_mod(c, c, *N);
 
     // finally output c
-    mpz_out_str(stdout,10,c);
-    printf("\n");
+    write_mpz(c, '\n');
+    fflush(stdout);
 
     // (clear temporary nums)
     mpz_clear(a);
     mpz_clear(b);
-    mpz_clear(prime_minus_one);
-    mpz_clear(d_mod);
-    mpz_clear(x);
-    mpz_clear(y);
-    mpz_clear(gcd);
     mpz_clear(c);
+    mpz_clear(tmp);
     mpz_clear(flip_mask);
 }
+#endif
 
-int main() {
+int main(int argc, char **argv) {
     srand(time(NULL));
     for (int j=0; j<3; ++j) {
         int stop = 10+rand()%100;
@@ -156,6 +170,12 @@ int main() {
         }
     }
 
+    // server mode (`-s`): p, q, N, d are read once, then (m, f) pairs
+    // are signed one after the other until stdin is closed
+    // binary mode (`-b`): see oracle_io.h
+    int server = argc > 1 && strcmp(argv[1], "-s") == 0;
+    oracle_io_init(argc, argv);
+
     mpz_t p, q, N, e, d, m, f;
     mpz_init(p);
     mpz_init(q);
@@ -177,31 +197,20 @@ int main() {
     printf("\n");
     mpz_out_str(stdout,10,d);
 #else
-    char inputStr[1024];
-    int flag; // for parsing str to mpz_t
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(p, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(q, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(N, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(d, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(m, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(f, inputStr, 10);
-    assert(flag == 0);
-
+    if (!read_mpz(p) || !read_mpz(q) || !read_mpz(N) || !read_mpz(d)) {
+        return 1;
+    }
+    struct crt_key key;
+    crt_key_init(&key, p, q, N, d);
+    do {
+        if (!read_mpz(m) || !read_mpz(f)) {
+            break;
+        }
+        rsaSign(&p, &q, &N, &key, &m, &f);
+    } while (server);
+    crt_key_clear(&key);
 #endif
 
-    rsaSign(&p, &q, &N, &d, &m, &f);
-
     mpz_clear(p);
     mpz_clear(q);
     mpz_clear(N);
@@ -1,33 +1,106 @@
 import functools
 from Crypto.Math import Primality
 import random
+import sys
 import math
 import timeit
-from task1 import rsa_keygen, gcd_extended
+from task1 import rsa_keygen, gcd_extended, crt_key
+import task1
+
+T = 10000 # the t rsa_sign uses when it isn't given a ShamirKey
+
+
+def factorize(n):
+    """
+    prime factors of `n` as {prime: power}, by trial division
+    (fine for the small t's used here)
+    """
+    factors = {}
+    i = 2
+    while i*i <= n:
+        while n % i == 0:
+            factors[i] = factors.get(i, 0) + 1
+            n //= i
+        i += 1
+    if n > 1:
+        factors[n] = factors.get(n, 0) + 1
+    return factors
+
 
 def phi(n):
-    tot = 0
-    for i in range(n):
-        if math.gcd(i, n) == 1:
-            tot += 1
+    # https://en.wikipedia.org/wiki/Euler%27s_totient_function#Euler's_product_formula
+    tot = n
+    for prime in factorize(n):
+        tot = tot // prime * (prime-1)
     return tot
 
 
-def rsa_sign(p, q, N, d, n_bits, m, f=0):
+def random_prime(n_bits):
+    """
+    random prime of exactly `n_bits` bits
+    (Primality.generate_probable_prime won't go below 160 bits)
+    """
+    while True:
+        t = random.getrandbits(n_bits) | (1 << (n_bits-1)) | 1
+        if Primality.test_probable_prime(t) == Primality.PROBABLY_PRIME:
+            return t
+
+
+class ShamirKey:
+    """
+    everything the countermeasure needs for a key and a choice of t,
+    worked out once rather than per signature
+    - t, phi_t = phi(t)
+    - dpt, dqt: d reduced mod phi(p*t) = (p-1)*phi(t), and mod phi(q*t)
+    - crt: the key's CRTKey for the recombination
+
+    m^k == m^(k mod phi(n) + phi(n)) (mod n) for any m once k is at least
+    log2(n), even if m shares a factor with t, so the reduced exponents
+    keep phi(n) added on rather than being just k mod phi(n)
+    https://en.wikipedia.org/wiki/Euler%27s_theorem#Generalizations
+    """
+    def __init__(self, p, q, N, d, t=T, t_bits=32) -> None:
+        """
+        `t` of None picks a random prime of `t_bits` bits
+        """
+        if t is None:
+            t = random_prime(t_bits)
+        assert(math.gcd(t, N) == 1)
+        self.t = t
+        self.phi_t = phi(t)
+        self.dpt = self.__reduce(d, (p-1)*self.phi_t)
+        self.dqt = self.__reduce(d, (q-1)*self.phi_t)
+        self.crt = crt_key(p, q, N, d)
+
+    @staticmethod
+    def __reduce(d, phi_n):
+        return d % phi_n + phi_n if d >= phi_n else d
+
+
+@functools.lru_cache(maxsize=64)
+def shamir_key(p, q, N, d, t=T):
+    """
+    the ShamirKey for p, q, N, d with a given t, only made the first time
+    """
+    return ShamirKey(p, q, N, d, t)
+
+
+def rsa_sign(p, q, N, d, n_bits, m, f=0, key: ShamirKey=None):
     # find c == m^d (mod N)
     # using https://en.wikipedia.org/wiki/Chinese_remainder_theorem#Computation
-    
-    t = 10000
-    phi_t = phi(t)
+    # with Shamir's countermeasure, `key` picks t (default: T)
+    if key is None:
+        key = shamir_key(p, q, N, d)
+    t = key.t
 
     # first compute a == m^d%p-1 (mod p)
-    S_pt = pow(m, d, p*t)
+    S_pt = pow(m, key.dpt, p*t)
     if f == 1:
         # randomise
         S_pt = random.randint(0, N)
 
     # then compute b == m^d%q-1 (mod q)
-    S_qt = pow(m, d, q*t)
+    S_qt = pow(m, key.dqt, q*t)
     if f == 2:
         # flip a random bit
         S_qt = random.randint(0, N)
@@ -35,13 +108,25 @@ def rsa_sign(p, q, N, d, n_bits, m, f=0):
     assert(S_pt%t == S_qt%t)
 
     # now c == a (mod p), c == b (mod q) can be computed in O(log(N)^2) time with CRT
-    x, y, gcd = gcd_extended(p, q)
-    assert(gcd == 1)
     # => c == bxp + ayq (mod N) because xp + yq == 1 (mod N)
-    c = (((S_qt%q)*x*p % N) + ((S_pt%p)*y*q % N)) % N
+    c = ((S_qt%q)*key.crt.xp + (S_pt%p)*key.crt.yq) % N
     
     return c
 
+
+def overhead(p, q, N, d, n_bits, key: ShamirKey=None, n_signs=1000):
+    """
+    times `n_signs` signatures with the countermeasure against plain CRT
+    signing (task1.rsa_sign) on the same messages
+    returns (countermeasure seconds, plain seconds, ratio)
+    """
+    if key is None:
+        key = shamir_key(p, q, N, d)
+    messages = [random.randint(2, N-1) for _ in range(n_signs)]
+    time_shamir = timeit.timeit(lambda: [rsa_sign(p, q, N, d, n_bits, m, key=key) for m in messages], number=1)
+    time_plain = timeit.timeit(lambda: [task1.rsa_sign(p, q, N, d, n_bits, m) for m in messages], number=1)
+    return time_shamir, time_plain, time_shamir / time_plain
+
 def check_rsa_sign(sign_func, p, q, N, e, d, l, n_checks=1000):
     print("Checking rsa_sign")
     for _ in range(n_checks):
@@ -86,17 +171,15 @@ if  __name__ == '__main__':
     # c = rsa_sign(p, q, N, d, l, m, 0)
     # print(f"p: {p}\nq: {q}\nN: {N}\nd: {d}\nm: {m}\nf: {0}\n\nc: {c}")
 
-    n_passed = 0
-    n_att = 10000
     p, q, N, e, d = rsa_keygen(l, verbosity=0, n_checks=1)
-    D = functools.partial(rsa_sign, p, q, N, d, l)
-    for i in range(n_att):
-        if (i % 100 == 0):
-            print(f"attacks {100*i/n_att :.3f}% done")
-        try:
-            d2 = attack(D, N, e)
-            assert(d == d2)
-            n_passed += 1
-        except AssertionError:
-            continue
-    print(f"{n_passed}/{n_att} attacks successful ({100*n_passed / n_att :.4f}%)")
\ No newline at end of file
+    for t in (T, None):
+        key = ShamirKey(p, q, N, d, t)
+        time_shamir, time_plain, ratio = overhead(p, q, N, d, l, key)
+        print(f"t = {key.t}: {time_shamir :.3f}s vs {time_plain :.3f}s for plain CRT ({ratio :.2f}x)")
+
+    # the 10,000 trials are spread over every core, see campaign.py
+    # (python task1_shamir_countermeasure.py <journal> to be able to resume them)
+    from campaign import run_campaign
+    n_att = 10000
+    result = run_campaign("shamir", n_att, l, journal=sys.argv[1] if len(sys.argv) > 1 else None)
+    print(result)
\ No newline at end of file
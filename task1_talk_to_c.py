@@ -1,4 +1,4 @@
-from subprocess import Popen, PIPE
+from oracle_client import OracleClient
 from task1 import rsa_keygen, attack
 import random
 import time
@@ -7,15 +7,6 @@ if __name__ == "__main__":
     l = 1024
     p, q, N, e, d = rsa_keygen(l)
 
-    def D(m, f):
-        with Popen('task1_in_c.exe', stdin=PIPE, stdout=PIPE, universal_newlines=True) as prog:
-            print(p, file=prog.stdin, flush=True)
-            print(q, file=prog.stdin, flush=True)
-            print(N, file=prog.stdin, flush=True)
-            print(d, file=prog.stdin, flush=True)
-            print(m, file=prog.stdin, flush=True)
-            print(f, file=prog.stdin, flush=True)
-            c = int(prog.stdout.readline())
-        return c
-
-    attack(D, N, e)
\ No newline at end of file
+    # one long lived task1_in_c.exe for every call to D
+    with OracleClient('task1_in_c.exe', p, q, N, d, returns_cycles=False) as D:
+        attack(D, N, e)
\ No newline at end of file
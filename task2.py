@@ -1,5 +1,6 @@
-from task1 import gcd_extended, rsa_keygen, check_rsa_sign, attack
-from task2_coprocessor import Coprocessor
+from task1 import gcd_extended, rsa_keygen, check_rsa_sign, attack, CRTKey
+from task2_coprocessor import Coprocessor, Checkpoints
+from batch_gcd import accumulated_gcd
 import functools
 import random
 import math
@@ -17,6 +18,9 @@ B_ADR = 8
 X_ADR = 9
 Y_ADR = 10
 C_ADR = 11
+MONT_ADR = 12
+DP_ADR = 13
+DQ_ADR = 14
 
 def power(coprocessor: Coprocessor, x, y, z, N):
     """
@@ -25,56 +29,275 @@ def power(coprocessor: Coprocessor, x, y, z, N):
     """
     # https://cacr.uwaterloo.ca/hac/about/chap14.pdf, 14.79
     coprocessor.load_immediate(x, 1)
-    for bit in bin(coprocessor.R[z])[2:]: # assuming that taking bits costs 0 clock cycles since stored in binary anyway
+    for bit in bin(coprocessor.read(z))[2:]: # assuming that taking bits costs 0 clock cycles since stored in binary anyway
         coprocessor.mul(x, x, x, N)
         if bit == "1":
             coprocessor.mul(x, x, y, N)
 
+def mont_power(coprocessor: Coprocessor, x, y, z, N):
+    """
+    Same as `power` but the squares and muls are Montgomery muls
+    (`y` is converted into MONT_ADR, and the result is converted back)
+    """
+    coprocessor.to_mont(MONT_ADR, y, N)
+    coprocessor.load_immediate(x, 1)
+    coprocessor.to_mont(x, x, N)
+    for bit in bin(coprocessor.read(z))[2:]:
+        coprocessor.mont_mul(x, x, x, N)
+        if bit == "1":
+            coprocessor.mont_mul(x, x, MONT_ADR, N)
+    coprocessor.from_mont(x, x, N)
+
 
-def rsa_sign(p, q, N, d, n_bits, m, f=0):
+def rsa_sign(p, q, N, d, n_bits, m, f=0, montgomery=False, key: CRTKey=None, profiler=None):
     # find c == m^d (mod N)
     # using https://en.wikipedia.org/wiki/Chinese_remainder_theorem#Computation
     # realistic version using registers etc
+    # if `montgomery` the two exponentiations are done in the Montgomery domain
+    # if `key` is given its dp, dq and inverses are loaded rather than computed
+    # (RSA_SIGN_CRT_PROGRAM), like a device storing its key in CRT form
+    # a `profiler` (task2_profile.Profiler) records every op of the run
     
     # init coprocessor
-    c = Coprocessor(16, n_bits, f)
-    c.empty_regs()
-    c.reset_clock()
-    
-    # load args into coprocessor
-    c.load_immediate(P_ADR, p)
-    c.load_immediate(Q_ADR, q)
-    c.load_immediate(N_ADR, N)
-    c.load_immediate(D_ADR, d)
-    c.load_immediate(M_ADR, m)
+    c = Coprocessor(16, n_bits, f, profiler=profiler)
+    return sign_on_copro(c, p, q, N, d, m, montgomery, key)
 
+# the rsa_sign program as an instruction list, one (phase, op, *args) per instruction
+# - ops are Coprocessor methods, except "pow" which is `power` (or `mont_power`),
+#   the only instruction that takes more than one clock cycle
+# - a "load" of a str loads that argument of rsa_sign, otherwise the value itself
+RSA_SIGN_PROGRAM = [
+    # load args into coprocessor
+    ("load", "load", P_ADR, "p"),
+    ("load", "load", Q_ADR, "q"),
+    ("load", "load", N_ADR, "N"),
+    ("load", "load", D_ADR, "d"),
+    ("load", "load", M_ADR, "m"),
+    ("load", "load", ONE_ADR, 1),
     # compute a == m^(d mod p-1) (mod p)
-    # first compute p-1
-    c.load_immediate(ONE_ADR, 1)
-    c.sub(COMP_ADR_1, P_ADR, ONE_ADR, P_ADR)
-    # then d mod p-1
-    c.copy_mod(COMP_ADR_1, D_ADR, COMP_ADR_1)
-    # now a = m^(d mod p-1) (mod p)
-    power(c, A_ADR, M_ADR, COMP_ADR_1, P_ADR)
-
+    # first compute p-1, then d mod p-1
+    ("setup_p", "sub", COMP_ADR_1, P_ADR, ONE_ADR, P_ADR),
+    ("setup_p", "copy_mod", COMP_ADR_1, D_ADR, COMP_ADR_1),
+    ("pow_p", "pow", A_ADR, M_ADR, COMP_ADR_1, P_ADR),
     # now we do similar for b == m^(d mod q-1) (mod q)
-    c.sub(COMP_ADR_1, Q_ADR, ONE_ADR, Q_ADR)
-    c.copy_mod(COMP_ADR_1, D_ADR, COMP_ADR_1)
-    power(c, B_ADR, M_ADR, COMP_ADR_1, Q_ADR)
-
+    ("setup_q", "sub", COMP_ADR_1, Q_ADR, ONE_ADR, Q_ADR),
+    ("setup_q", "copy_mod", COMP_ADR_1, D_ADR, COMP_ADR_1),
+    ("pow_q", "pow", B_ADR, M_ADR, COMP_ADR_1, Q_ADR),
     # now we compute x = 1/p (mod q)
     # and y = 1/q (mod p)
-    c.mul_inverse(X_ADR, P_ADR, Q_ADR)
-    c.mul_inverse(Y_ADR, Q_ADR, P_ADR)
+    ("inverse", "mul_inverse", X_ADR, P_ADR, Q_ADR),
+    ("inverse", "mul_inverse", Y_ADR, Q_ADR, P_ADR),
     # so C = b*x*p + a*y*q (mod N)
-    c.mul(C_ADR, B_ADR, X_ADR, N_ADR)
-    c.mul(C_ADR, C_ADR, P_ADR, N_ADR)
-    c.mul(COMP_ADR_1, A_ADR, Y_ADR, N_ADR)
-    c.mul(COMP_ADR_1, COMP_ADR_1, Q_ADR, N_ADR)
-    c.add(C_ADR, C_ADR, COMP_ADR_1, N_ADR)
+    ("recombine", "mul", C_ADR, B_ADR, X_ADR, N_ADR),
+    ("recombine", "mul", C_ADR, C_ADR, P_ADR, N_ADR),
+    ("recombine", "mul", COMP_ADR_1, A_ADR, Y_ADR, N_ADR),
+    ("recombine", "mul", COMP_ADR_1, COMP_ADR_1, Q_ADR, N_ADR),
+    ("recombine", "add", C_ADR, C_ADR, COMP_ADR_1, N_ADR),
+]
+
+# rsa_sign with a CRTKey, so only the two exponentiations and the recombination
+# are left to do on the coprocessor
+RSA_SIGN_CRT_PROGRAM = [
+    ("load", "load", P_ADR, "p"),
+    ("load", "load", Q_ADR, "q"),
+    ("load", "load", N_ADR, "N"),
+    ("load", "load", M_ADR, "m"),
+    ("load", "load", DP_ADR, "dp"),
+    ("load", "load", DQ_ADR, "dq"),
+    ("load", "load", X_ADR, "x"),
+    ("load", "load", Y_ADR, "y"),
+    ("load", "load", ONE_ADR, 1), # unused here, but task2_in_c.c's pow starts from it
+    ("pow_p", "pow", A_ADR, M_ADR, DP_ADR, P_ADR),
+    ("pow_q", "pow", B_ADR, M_ADR, DQ_ADR, Q_ADR),
+    ("recombine", "mul", C_ADR, B_ADR, X_ADR, N_ADR),
+    ("recombine", "mul", C_ADR, C_ADR, P_ADR, N_ADR),
+    ("recombine", "mul", COMP_ADR_1, A_ADR, Y_ADR, N_ADR),
+    ("recombine", "mul", COMP_ADR_1, COMP_ADR_1, Q_ADR, N_ADR),
+    ("recombine", "add", C_ADR, C_ADR, COMP_ADR_1, N_ADR),
+]
+
+def run_program(c: Coprocessor, program, args, montgomery=False):
+    """
+    runs each instruction of `program` (see RSA_SIGN_PROGRAM) on `c`,
+    taking the values of loads from the dict `args`
+    """
+    pow_func = mont_power if montgomery else power
+    profiler = c.profiler
+    for phase, op, *operands in program:
+        if profiler is not None:
+            profiler.enter_phase(phase, c)
+        if op == "load":
+            x, val = operands
+            c.load_immediate(x, args[val] if isinstance(val, str) else val)
+        elif op == "pow":
+            pow_func(c, *operands)
+        else:
+            getattr(c, op)(*operands)
+    if profiler is not None:
+        profiler.enter_phase(None, c)
+
+# opcodes of a compiled program, see `compile_program`
+(OP_LOAD, OP_ADD, OP_SUB, OP_MUL, OP_MUL_INVERSE,
+ OP_ADD_INVERSE, OP_COPY_MOD, OP_POW, OP_MONT_POW) = range(9)
+OPCODES = {
+    "load": OP_LOAD, "add": OP_ADD, "sub": OP_SUB, "mul": OP_MUL,
+    "mul_inverse": OP_MUL_INVERSE, "add_inverse": OP_ADD_INVERSE,
+    "copy_mod": OP_COPY_MOD, "pow": OP_POW,
+}
+
+def compile_program(program, montgomery=False):
+    """
+    lowers `program` to a tuple of (opcode, x, y, z, N) instructions for
+    `run_compiled`, plus the list of values that loads refer to by index
+    (a load is (OP_LOAD, x, index, 0, 0))
+    unary ops like copy_mod have their N in the last slot and z = 0
+    """
+    code = []
+    loads = []
+    for _, op, *operands in program:
+        if op == "load":
+            x, val = operands
+            code.append((OP_LOAD, x, len(loads), 0, 0))
+            loads.append(val)
+        elif op == "pow":
+            code.append((OP_MONT_POW if montgomery else OP_POW, *operands))
+        elif len(operands) == 3:
+            x, y, N = operands
+            code.append((OPCODES[op], x, y, 0, N))
+        else:
+            code.append((OPCODES[op], *operands))
+    return tuple(code), loads
+
+def run_compiled(c: Coprocessor, compiled, args):
+    """
+    runs a program from `compile_program` on `c`, giving the same registers,
+    clock and fault as `run_program` but without a method call per cycle:
+    only the instruction containing the fault cycle `c.f` (or any with
+    overlapping operands) goes through the Coprocessor methods,
+    every other "pow" is a single builtin pow()
+    """
+    code, loads = compiled
+    vals = [args[val] if isinstance(val, str) else val for val in loads]
+    R = c.R
+    f = c.f
+    clock = c.clock
+    for op, x, y, z, N in code:
+        if op == OP_POW or op == OP_MONT_POW:
+            bits = bin(R[z])[2:]
+            cost = 1 + len(bits) + bits.count("1")
+            if op == OP_MONT_POW:
+                cost += 3
+                slow = R[N] % 2 == 0 or MONT_ADR in (x, y, z)
+            else:
+                slow = False
+            if slow or x == y or x == z or clock < f <= clock + cost:
+                c.clock = clock
+                (mont_power if op == OP_MONT_POW else power)(c, x, y, z, N)
+                clock = c.clock
+                continue
+            if op == OP_MONT_POW:
+                R[MONT_ADR] = (R[y] << R[N].bit_length()) % R[N]
+            R[x] = pow(R[y], int(bits, 2), R[N])
+            clock += cost
+            continue
+        if clock + 1 == f:
+            # this cycle is faulted so use the front-end which flips a bit
+            c.clock = clock
+            if op == OP_LOAD:
+                c.load_immediate(x, vals[y])
+            elif op == OP_MUL_INVERSE or op == OP_ADD_INVERSE or op == OP_COPY_MOD:
+                _UNARY_OPS[op](c, x, y, N)
+            else:
+                _BINARY_OPS[op](c, x, y, z, N)
+            clock = c.clock
+            continue
+        if op == OP_MUL:
+            R[x] = (R[y] * R[z]) % R[N]
+        elif op == OP_LOAD:
+            R[x] = vals[y]
+        elif op == OP_ADD:
+            R[x] = (R[y] + R[z]) % R[N]
+        elif op == OP_SUB:
+            R[x] = (R[y] - R[z]) % R[N]
+        elif op == OP_COPY_MOD:
+            R[x] = R[y] % R[N]
+        elif op == OP_MUL_INVERSE:
+            a, _, gcd = gcd_extended(R[y], R[N])
+            R[x] = a % R[N] if gcd == 1 else 0
+        else:
+            R[x] = (- R[y]) % R[N]
+        clock += 1
+    c.clock = clock
 
+_UNARY_OPS = {
+    OP_MUL_INVERSE: Coprocessor.mul_inverse,
+    OP_ADD_INVERSE: Coprocessor.add_inverse,
+    OP_COPY_MOD: Coprocessor.copy_mod,
+}
+_BINARY_OPS = {
+    OP_ADD: Coprocessor.add,
+    OP_SUB: Coprocessor.sub,
+    OP_MUL: Coprocessor.mul,
+}
+
+# (program, compiled program) for each (with a CRTKey, montgomery)
+RSA_SIGN_PROGRAMS = {
+    (crt, montgomery): (program, compile_program(program, montgomery))
+    for crt, program in ((False, RSA_SIGN_PROGRAM), (True, RSA_SIGN_CRT_PROGRAM))
+    for montgomery in (False, True)
+}
+
+def sign_on_copro(c: Coprocessor, p, q, N, d, m, montgomery=False, key: CRTKey=None):
+    """
+    runs the rsa_sign program on an already made coprocessor `c`
+    (so that it can be set up to record or resume from checkpoints)
+    returns c, clock cycles
+    """
+    c.empty_regs()
+    c.reset_clock()
+    args = {"p": p, "q": q, "N": N, "d": d, "m": m}
+    if key is not None:
+        args.update(dp=key.dp, dq=key.dq, x=key.x, y=key.y)
+    program, compiled = RSA_SIGN_PROGRAMS[key is not None, montgomery]
+    if c.checkpoints is None and c.resume_clock == 0 and c.profiler is None:
+        run_compiled(c, compiled, args)
+    else:
+        # checkpointing and profiling need to see every cycle
+        run_program(c, program, args, montgomery)
     return c.R[C_ADR], c.clock
 
+class CheckpointedSigner:
+    """
+    drop-in D(m, f) for `attack` which runs the full rsa_sign only once
+    per message, recording checkpoints every `interval` cycles;
+    a faulted call then resumes from the latest checkpoint before f
+    rather than from cycle 1, so only the prefix before that checkpoint is
+    skipped: a call at f still runs the T - f + interval cycles after it,
+    and a sweep over f in [a, T] costs about (T - a)^2 / 2 ops rather than
+    (T - a)*T (for attack's sweep over the back half, T^2/8 rather than
+    T^2/2, a constant factor)
+    """
+    def __init__(self, p, q, N, d, n_bits, interval=64, montgomery=False, key: CRTKey=None) -> None:
+        self.key = (p, q, N, d)
+        self.n_bits = n_bits
+        self.interval = interval
+        self.montgomery = montgomery
+        self.crt_key = key
+        self.m = None
+        self.golden = None
+        self.checkpoints: Checkpoints = None
+
+    def __call__(self, m, f=0):
+        if m != self.m:
+            copro = Coprocessor(16, self.n_bits, 0, checkpoint_interval=self.interval)
+            self.golden = sign_on_copro(copro, *self.key, m, self.montgomery, self.crt_key)
+            self.checkpoints = copro.checkpoints
+            self.m = m
+        if f == 0:
+            return self.golden
+        copro = Coprocessor(16, self.n_bits, f, resume=self.checkpoints)
+        return sign_on_copro(copro, *self.key, m, self.montgomery, self.crt_key)
+
 def attack(D, N, e):
     print("Beginning attack!")
     m = random.randint(2, N-1)
@@ -102,6 +325,112 @@ def attack(D, N, e):
     print("Finished attack!")
     return d
 
+def fault_values(m, m_signed, signatures, N, e, lenstra=False):
+    """
+    what each faulty signature in `signatures` leaves to gcd with N:
+    m_signed - S (mod N), or with `lenstra` m - S^e (mod N), which needs no
+    fault-free signature but costs a pow per signature (cheap for small e)
+    faults that didn't change the signature give 0 and are left out
+    """
+    # https://link.springer.com/article/10.1007/s001450010016 (Lenstra's version)
+    if lenstra:
+        values = ((m - pow(S, e, N)) % N for S in signatures)
+    else:
+        values = ((m_signed - S) % N for S in signatures)
+    return [v for v in values if v != 0]
+
+def block_attack(D, N, e, block=64, lenstra=False):
+    """
+    same as `attack`, but the faulty signatures of each `block` of fault
+    cycles are multiplied together (mod N) and given a single gcd, which
+    is only split up if it has both of N's primes in it
+    (see batch_gcd.accumulated_gcd)
+    with `lenstra` the fault-free call only gives the cycle count, see `fault_values`
+    """
+    print("Beginning attack!")
+    m = random.randint(2, N-1)
+    m_signed, clock_cycles = D(m, 0)
+
+    p, q = -1, -1 # temporary
+    for f_lo in range(clock_cycles//2, clock_cycles, block):
+        signatures = [D(m, f)[0] for f in range(f_lo, min(f_lo+block, clock_cycles))]
+        p = accumulated_gcd(fault_values(m, m_signed, signatures, N, e, lenstra), N)
+        if p is not None:
+            q = N // p
+            break
+    assert(p*q == N)
+    print("\tFound p,q!")
+
+    # Find d to 'prove' we have broken in
+    phi_n = (p-1)*(q-1)
+    d, _, gcd = gcd_extended(e, phi_n)
+    assert(gcd == 1)
+    d %= phi_n
+    print("\tFound d!")
+    print("Finished attack!")
+    return d
+
+def sweep_attack(oracle, N, e, chunk=64):
+    """
+    same as `attack`, but with an oracle_client.OracleClient in sweep mode
+    so each `chunk` of fault cycles is one request to a single process
+    """
+    print("Beginning attack!")
+    m = random.randint(2, N-1)
+    m_signed, clock_cycles = oracle.D(m, 0)
+
+    p, q = -1, -1 # temporary
+    for f_lo in range(clock_cycles//2, clock_cycles, chunk):
+        # each chunk gets one gcd, like `block_attack`
+        f_hi = min(f_lo+chunk-1, clock_cycles)
+        signatures = [S for _, S in oracle.sweep(m, f_lo, f_hi)]
+        p = accumulated_gcd(fault_values(m, m_signed, signatures, N, e), N)
+        if p is not None:
+            q = N // p
+            break
+    assert(p*q == N)
+    print(f"\tFound p,q from the faults at cycles {f_lo}..{f_hi}!")
+
+    # Find d to 'prove' we have broken in
+    phi_n = (p-1)*(q-1)
+    d, _, gcd = gcd_extended(e, phi_n)
+    assert(gcd == 1)
+    d %= phi_n
+    print("\tFound d!")
+    print("Finished attack!")
+    return d
+
+async def async_attack(oracle, N, e, window=None):
+    """
+    same as `attack`, but with an async_oracle_client.AsyncOracleClient:
+    `window` fault cycles (default: 4 per worker) are asked for at once
+    so that every worker is kept busy
+    """
+    print("Beginning attack!")
+    window = window or 4*oracle.n_workers
+    m = random.randint(2, N-1)
+    m_signed, clock_cycles = await oracle.D(m, 0)
+
+    p, q = -1, -1 # temporary
+    for f_lo in range(clock_cycles//2, clock_cycles, window):
+        fs = range(f_lo, min(f_lo+window, clock_cycles))
+        replies = await oracle.D_batch([(m, f) for f in fs])
+        p = accumulated_gcd(fault_values(m, m_signed, [S for S, _ in replies], N, e), N)
+        if p is not None:
+            q = N // p
+            break
+    assert(p*q == N)
+    print("\tFound p,q!")
+
+    # Find d to 'prove' we have broken in
+    phi_n = (p-1)*(q-1)
+    d, _, gcd = gcd_extended(e, phi_n)
+    assert(gcd == 1)
+    d %= phi_n
+    print("\tFound d!")
+    print("Finished attack!")
+    return d
+
 # # Main Code
 if __name__ == '__main__':
     l = 1024
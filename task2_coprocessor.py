@@ -1,18 +1,100 @@
 from task1 import gcd_extended
+import functools
 import random
 
+
+@functools.lru_cache(maxsize=256)
+def montgomery_constants(N):
+    """
+    returns k, 2^k - 1, N' such that N*N' == -1 (mod 2^k) with 2^k > `N`
+    for doing Montgomery reduction modulo the odd number `N`
+    (cached since there are only a couple of moduli per key)
+    returns None if `N` is even, which can only happen after a fault
+    """
+    # https://en.wikipedia.org/wiki/Montgomery_modular_multiplication#The_REDC_algorithm
+    k = N.bit_length()
+    n_inv, _, gcd = gcd_extended(N, 1 << k)
+    if gcd != 1:
+        return None
+    return k, (1 << k) - 1, (-n_inv) % (1 << k)
+
+
+def redc(T, N):
+    """
+    T / 2^k (mod `N`) using shifts and masks rather than a division by `N`
+    """
+    consts = montgomery_constants(N)
+    if consts is None:
+        return T % N
+    k, mask, n_prime = consts
+    m = ((T & mask) * n_prime) & mask
+    t = (T + m*N) >> k
+    # t < 2N whenever T < N * 2^k, but a faulted register can be
+    # much bigger than N so reduce fully rather than subtracting N once
+    return t if t < N else t % N
+
+class Checkpoints:
+    """
+    state recorded during one fault-free ("golden") run of a program:
+    - `snapshots[t]` is the register file after clock cycle t,
+      for every t that is a multiple of `interval`
+    - `reads` are the values the program read out of the registers
+      (with `Coprocessor.read`) in the order it read them
+    """
+    interval: int
+    snapshots: dict[int, list[int]]
+    reads: list[int]
+
+    def __init__(self, interval: int) -> None:
+        self.interval = interval
+        self.snapshots = {}
+        self.reads = []
+
+    def nearest_before(self, f: int) -> int:
+        """
+        clock of the latest snapshot taken before cycle `f`
+        (0 if there isn't one, meaning start from scratch)
+        """
+        t = ((f-1) // self.interval) * self.interval
+        while t > 0 and t not in self.snapshots:
+            t -= self.interval
+        return max(t, 0)
+
+
 class Coprocessor:
     N_REGISTERS: int
     R: list[int]
     clock: int
     f: int
+    checkpoints: Checkpoints | None
+    resume_clock: int
+    profiler: object
 
-    def __init__(self, n_registers: int, n_bits: int, fault_step: int=0) -> None:
+    def __init__(self, n_registers: int, n_bits: int, fault_step: int=0,
+                 checkpoint_interval: int=0, resume: Checkpoints | None=None,
+                 profiler=None) -> None:
+        """
+        if `checkpoint_interval` is set the run records a `Checkpoints`
+        (use for a fault-free run)
+        if `resume` is given the run restores the latest of its snapshots
+        before `fault_step` and only computes the ops after it
+        if a `profiler` (task2_profile.Profiler) is given it wraps this
+        coprocessor's ops, otherwise they run untouched
+        """
         self.N_REGISTERS = n_registers
         self.R = [0 for _ in range(self.N_REGISTERS)]
         self.clock = 0
         self.f = fault_step
         self.n_bits = n_bits
+        self.checkpoints = Checkpoints(checkpoint_interval) if checkpoint_interval > 0 else None
+        self.resume_clock = 0
+        self.__n_reads = 0
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.attach(self)
+        if resume is not None and fault_step > 0:
+            self.__resume = resume
+            self.resume_clock = resume.nearest_before(fault_step)
 
     def __complete_cycle(self, x):
         """
@@ -22,11 +104,38 @@ class Coprocessor:
         self.clock += 1
         if self.clock == self.f:
             self.R[x] ^= 1 << random.randint(0, self.n_bits-1)
+        if self.checkpoints is not None and self.clock % self.checkpoints.interval == 0:
+            self.checkpoints.snapshots[self.clock] = self.R.copy()
+
+    def __skip_cycle(self):
+        """
+        used instead of computing an op while resuming: only counts the cycle,
+        and restores the snapshot once the clock reaches it
+        """
+        self.clock += 1
+        if self.clock == self.resume_clock:
+            self.R = self.__resume.snapshots[self.clock].copy()
+
+    def read(self, x):
+        """
+        value of register `x` as read by the micro-controller
+        (e.g. to loop over exponent bits), doesn't use a clock cycle
+        """
+        if self.clock < self.resume_clock:
+            # registers aren't computed yet, so use what the golden run read
+            val = self.__resume.reads[self.__n_reads]
+        else:
+            val = self.R[x]
+            if self.checkpoints is not None:
+                self.checkpoints.reads.append(val)
+        self.__n_reads += 1
+        return val
 
     def add(self, x, y, z, N):
         """
         sums registers `y`+`z` into `x` (mod `N`)
         """
+        if self.clock < self.resume_clock: return self.__skip_cycle()
         self.R[x] = (self.R[y] + self.R[z]) % self.R[N]
         self.__complete_cycle(x)
 
@@ -34,6 +143,7 @@ class Coprocessor:
         """
         subs registers `y`-`z` into `x` (mod `N`)
         """
+        if self.clock < self.resume_clock: return self.__skip_cycle()
         self.R[x] = (self.R[y] - self.R[z]) % self.R[N]
         self.__complete_cycle(x)
 
@@ -41,6 +151,7 @@ class Coprocessor:
         """
         muls registers `y`*`z` into `x` (mod `N`)
         """
+        if self.clock < self.resume_clock: return self.__skip_cycle()
         self.R[x] = (self.R[y] * self.R[z]) % self.R[N]
         self.__complete_cycle(x)
 
@@ -49,6 +160,7 @@ class Coprocessor:
         puts 1/`y` into `x` (mod `N`) if it exists
         otherwise puts 0 into `x`
         """
+        if self.clock < self.resume_clock: return self.__skip_cycle()
         # https://en.wikipedia.org/wiki/Modular_multiplicative_inverse#Extended_Euclidean_algorithm
         # find R[y]*a + N*_ == 1 (mod N)
         a, _, gcd = gcd_extended(self.R[y], self.R[N])
@@ -63,6 +175,7 @@ class Coprocessor:
         """
         puts -`y` into `x` (mod `N`)    
         """
+        if self.clock < self.resume_clock: return self.__skip_cycle()
         self.R[x] = (- self.R[y]) % self.R[N]
         self.__complete_cycle(x)
 
@@ -70,9 +183,35 @@ class Coprocessor:
         """
         puts `y` into `x` (mod `N`)
         """
+        if self.clock < self.resume_clock: return self.__skip_cycle()
         self.R[x] = self.R[y] % self.R[N]
         self.__complete_cycle(x)
 
+    def to_mont(self, x, y, N):
+        """
+        puts `y` into `x` in the Montgomery domain of `N`, i.e. `y`*2^k (mod `N`)
+        """
+        if self.clock < self.resume_clock: return self.__skip_cycle()
+        self.R[x] = (self.R[y] << self.R[N].bit_length()) % self.R[N]
+        self.__complete_cycle(x)
+
+    def from_mont(self, x, y, N):
+        """
+        takes `y` out of the Montgomery domain of `N` into `x`
+        """
+        if self.clock < self.resume_clock: return self.__skip_cycle()
+        self.R[x] = redc(self.R[y], self.R[N])
+        self.__complete_cycle(x)
+
+    def mont_mul(self, x, y, z, N):
+        """
+        Montgomery muls registers `y`*`z`/2^k into `x` (mod `N`)
+        (both should already be in the Montgomery domain of `N`)
+        """
+        if self.clock < self.resume_clock: return self.__skip_cycle()
+        self.R[x] = redc(self.R[y] * self.R[z], self.R[N])
+        self.__complete_cycle(x)
+
     def empty_regs(self):
         """
         sets all coprocessor registers to 0
@@ -85,6 +224,7 @@ class Coprocessor:
         """
         puts `val` directly into location `x`
         """
+        if self.clock < self.resume_clock: return self.__skip_cycle()
         self.R[x] = val
         self.__complete_cycle(x)
 
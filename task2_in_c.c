@@ -3,8 +3,14 @@
 #include <assert.h>
 #include <time.h>
 #include <stdlib.h>
+#include <string.h>
+#include "oracle_io.h"
+#include "copro_jobs.h"
+#ifndef _WIN32
+#include <unistd.h>
+#include <sys/wait.h>
+#endif
 
-#define N_REGS 16
 #define P_ADR 0
 #define Q_ADR 1
 #define N_ADR 2
@@ -18,195 +24,830 @@
 #define Y_ADR 10
 #define C_ADR 11
 #define POW_ADR 12
+#define DP_ADR 13
+#define DQ_ADR 14
+#define POW_TMP_ADR 15 // y^2 for the sliding window, the second ladder register
+// R[13] and R[14] hold dp and dq with `-k`, so the window tables get
+// their own registers after R[15]: TABLE_ADR+v holds y^v (k-ary) or
+// y^(2v+1) (sliding window)
+#define TABLE_ADR 16
+#define MAX_WINDOW 6
+#define N_REGS (TABLE_ADR + (1 << MAX_WINDOW))
 
 #define l 1024
+#ifndef PROFILE
+#define PROFILE 0 // 0 or 1, 1 writes a histogram of every op to stderr on exit
+#endif
 
-unsigned long copro_clock;
-unsigned long f;
-mpz_t R[N_REGS];
+// exponentiation schedules for pow_on_copro, picked with `-p` (and `-W`
+// for the window size), task2_schedule.py maps the cycles of each
+// binary: left to right binary exp from the exponent's top bit (default)
+// full: the same but always from bit 1024, whatever the exponent's length
+// kary: k bits of the exponent at a time, https://cacr.uwaterloo.ca/hac/about/chap14.pdf, 14.82
+// sliding: sliding window, 14.85
+// ladder: Montgomery ladder, a square and a mul for every bit whatever its value
+enum pow_method {POW_BINARY, POW_FULL, POW_KARY, POW_SLIDING, POW_LADDER};
+const char *pow_method_names[] = {"binary", "full", "kary", "sliding", "ladder"};
+
+// one coprocessor: everything a run touches is in here rather than in
+// globals, so each thread can sign on its own context
+// (the PROFILE histogram is still global, so profile with one thread)
+struct copro {
+    mpz_t R[N_REGS];
+    unsigned long clock;
+    unsigned long f; // the cycle to fault, 0 for none
+    unsigned long long rng; // copro_rng_next's state, so faults don't need rand()
+    mpz_t one, gcd, dummy; // loaded into ONE_ADR, and mul_inverse's outputs
+    enum pow_method pow_method;
+    int pow_window;
+    unsigned long sweep_lo, sweep_hi; // sweep mode, see sweep_fork
+};
+
+int pow_set_method(struct copro *cp, const char *name, int window) {
+    // sets the schedule `cp` uses (a new context has binary, window 4)
+    // returns 0, or -1 for an unknown method or a window out of range
+    if (window < 1 || window > MAX_WINDOW) {
+        return -1;
+    }
+    for (int i=0; i<(int)(sizeof(pow_method_names) / sizeof(pow_method_names[0])); ++i) {
+        if (strcmp(name, pow_method_names[i]) == 0) {
+            cp->pow_method = i;
+            cp->pow_window = window;
+            return 0;
+        }
+    }
+    return -1;
+}
+
+
+#if PROFILE
+// same layout as task2_profile.Profiler.histogram, so task2_profile.py can print it
+#define MAX_PROFILE_BITS 4224
+#define MAX_PROFILE_PHASES 16
+
+enum profile_op {PROF_ADD, PROF_SUB, PROF_MUL, PROF_MUL_INVERSE, PROF_ADD_INVERSE,
+                 PROF_COPY_MOD, PROF_COPY, PROF_LOAD_IMMEDIATE, N_PROFILE_OPS};
+const char *profile_op_names[N_PROFILE_OPS] = {"add", "sub", "mul", "mul_inverse", "add_inverse",
+                                               "copy_mod", "copy", "load_immediate"};
+
+struct profile_stats {
+    unsigned long count;
+    double seconds;
+    unsigned long bits[MAX_PROFILE_BITS+1]; // bits[b] is how many operands had b bits
+} profile_ops[N_PROFILE_OPS];
+
+struct profile_phase {
+    const char *name;
+    unsigned long runs, cycles;
+    double seconds;
+} profile_phases[MAX_PROFILE_PHASES];
+int n_profile_phases = 0;
+
+// called as hook(phase, cp->clock) on entering each phase,
+// with a phase of NULL at the end of each rsaSign
+void (*profile_phase_hook)(const char *phase, unsigned long clock) = NULL;
+
+const char *profile_current_phase = NULL;
+unsigned long profile_phase_clock;
+struct timespec profile_phase_start;
+
+double profile_seconds_since(struct timespec *start) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (now.tv_sec - start->tv_sec) + 1e-9*(now.tv_nsec - start->tv_nsec);
+}
+
+size_t profile_bits(mpz_srcptr a) {
+    size_t bits = mpz_sgn(a) == 0 ? 0 : mpz_sizeinbase(a, 2);
+    return bits < MAX_PROFILE_BITS ? bits : MAX_PROFILE_BITS;
+}
+
+void profile_record(enum profile_op op, struct timespec *start, size_t bits_a, long bits_b) {
+    struct profile_stats *stats = &profile_ops[op];
+    stats->seconds += profile_seconds_since(start);
+    stats->count++;
+    stats->bits[bits_a]++;
+    if (bits_b >= 0) {
+        stats->bits[bits_b]++;
+    }
+}
+
+void profile_phase(struct copro *cp, const char *phase) {
+    // does nothing unless the phase has changed
+    if (phase == profile_current_phase || (phase != NULL && profile_current_phase != NULL
+                                           && strcmp(phase, profile_current_phase) == 0)) {
+        return;
+    }
+    if (profile_current_phase != NULL) {
+        int i = 0;
+        while (i < n_profile_phases && strcmp(profile_phases[i].name, profile_current_phase) != 0) {
+            ++i;
+        }
+        if (i == n_profile_phases) {
+            assert(n_profile_phases < MAX_PROFILE_PHASES);
+            profile_phases[n_profile_phases++].name = profile_current_phase;
+        }
+        profile_phases[i].runs++;
+        profile_phases[i].cycles += cp->clock - profile_phase_clock;
+        profile_phases[i].seconds += profile_seconds_since(&profile_phase_start);
+    }
+    if (profile_phase_hook != NULL) {
+        profile_phase_hook(phase, cp->clock);
+    }
+    profile_current_phase = phase;
+    profile_phase_clock = cp->clock;
+    clock_gettime(CLOCK_MONOTONIC, &profile_phase_start);
+}
+
+void profile_write(FILE *out) {
+    fprintf(out, "{\"model\": \"c\", \"ops\": {");
+    int first = 1;
+    for (int op=0; op<N_PROFILE_OPS; ++op) {
+        struct profile_stats *stats = &profile_ops[op];
+        if (stats->count == 0) {
+            continue;
+        }
+        fprintf(out, "%s\"%s\": {\"count\": %lu, \"seconds\": %.9f, \"bits\": {",
+                first ? "" : ", ", profile_op_names[op], stats->count, stats->seconds);
+        first = 0;
+        int first_bits = 1;
+        for (int b=0; b<=MAX_PROFILE_BITS; ++b) {
+            if (stats->bits[b]) {
+                fprintf(out, "%s\"%d\": %lu", first_bits ? "" : ", ", b, stats->bits[b]);
+                first_bits = 0;
+            }
+        }
+        fprintf(out, "}}");
+    }
+    fprintf(out, "}, \"phases\": {");
+    for (int i=0; i<n_profile_phases; ++i) {
+        fprintf(out, "%s\"%s\": {\"runs\": %lu, \"cycles\": %lu, \"seconds\": %.9f}",
+                i ? ", " : "", profile_phases[i].name, profile_phases[i].runs,
+                profile_phases[i].cycles, profile_phases[i].seconds);
+    }
+    fprintf(out, "}}\n");
+}
+
+// PROFILE_BEGIN reads the operand sizes before the op can overwrite them
+#define PROFILE_BEGIN(a, b) \
+    struct timespec profile_start; \
+    size_t profile_a = profile_bits(a); \
+    long profile_b = (b) == NULL ? -1 : (long)profile_bits(b); \
+    clock_gettime(CLOCK_MONOTONIC, &profile_start)
+#define PROFILE_END(op) profile_record(op, &profile_start, profile_a, profile_b)
+#define PROFILE_PHASE(cp, phase) profile_phase(cp, phase)
+#else
+// compiled out, so the ops cost exactly what they did before
+#define PROFILE_BEGIN(a, b)
+#define PROFILE_END(op)
+#define PROFILE_PHASE(cp, phase)
+#endif
 
 /*
 All of these are pretty much identical to
 those found in task2_coprocessor.py
 */
 
-void copro_init() {
-    copro_clock = 0;
+void copro_init(struct copro *cp) {
+    // the registers are made once here and reused by every run on `cp`
+    cp->clock = 0;
+    cp->f = 0;
+    for (int i=0; i<N_REGS; ++i) {
+        mpz_init(cp->R[i]);
+    }
+    mpz_init_set_ui(cp->one, 1);
+    mpz_inits(cp->gcd, cp->dummy, NULL);
+    copro_rng_seed(&cp->rng, 0);
+    cp->pow_method = POW_BINARY;
+    cp->pow_window = 4;
+    cp->sweep_lo = cp->sweep_hi = 0;
+}
+
+void copro_clear(struct copro *cp) {
     for (int i=0; i<N_REGS; ++i) {
-        mpz_init(R[i]);
+        mpz_clear(cp->R[i]);
+    }
+    mpz_clears(cp->one, cp->gcd, cp->dummy, NULL);
+}
+
+// sweep mode (`-w`): cycles in [sweep_lo, sweep_hi] of a fault-free run
+// each fork a child that faults that cycle and finishes the signature,
+// with at most sweep_max_children running at once
+// (the forks are per process, so these aren't in struct copro)
+int sweep_child = 0, sweep_children = 0, sweep_max_children = 1;
+
+void copro_flip(struct copro *cp, int reg, int bit) {
+    // flip bit `bit` of register `reg`
+    mpz_combit(cp->R[reg], bit);
+}
+
+void sweep_fork(struct copro *cp, int reg) {
+#ifndef _WIN32
+    int bit = copro_rng_next(&cp->rng)%l; // picked here so every child flips a different bit
+    fflush(stdout); // or the child would write out the parent's buffer again
+    pid_t pid = fork();
+    assert(pid >= 0);
+    if (pid == 0) {
+        // the child faults this cycle and doesn't fork any further
+        sweep_child = 1;
+        cp->sweep_lo = cp->clock; // the f this child reports
+        cp->sweep_hi = 0;
+        copro_flip(cp, reg, bit);
+        return;
     }
+    if (++sweep_children >= sweep_max_children) {
+        wait(NULL);
+        sweep_children--;
+    }
+#endif
 }
 
-void copro_completeCycle(int reg) {
-    copro_clock++;
-    if (copro_clock == f) {
+void copro_completeCycle(struct copro *cp, int reg) {
+    cp->clock++;
+    if (cp->clock == cp->f) {
         // flip a random bit
-        mpz_t flip_mask;
-        mpz_init(flip_mask);
-        mpz_setbit(flip_mask, rand()%l);
-        mpz_xor(R[reg], R[reg], flip_mask);
-        mpz_clear(flip_mask);
+        copro_flip(cp, reg, copro_rng_next(&cp->rng)%l);
+    }
+    if (cp->clock <= cp->sweep_hi && cp->clock >= cp->sweep_lo) {
+        sweep_fork(cp, reg);
     }
 }
 
-void copro_add(int x, int y, int z, int N) {
-    mpz_add(R[x], R[y], R[z]);
-    mpz_mod(R[x], R[x], R[N]);
-    copro_completeCycle(x);
+void copro_add(struct copro *cp, int x, int y, int z, int N) {
+    PROFILE_BEGIN(cp->R[y], cp->R[z]);
+    mpz_add(cp->R[x], cp->R[y], cp->R[z]);
+    mpz_mod(cp->R[x], cp->R[x], cp->R[N]);
+    copro_completeCycle(cp, x);
+    PROFILE_END(PROF_ADD);
 }
 
-void copro_sub(int x, int y, int z, int N) {
-    mpz_sub(R[x], R[y], R[z]);
-    mpz_mod(R[x], R[x], R[N]);
-    copro_completeCycle(x);
+void copro_sub(struct copro *cp, int x, int y, int z, int N) {
+    PROFILE_BEGIN(cp->R[y], cp->R[z]);
+    mpz_sub(cp->R[x], cp->R[y], cp->R[z]);
+    mpz_mod(cp->R[x], cp->R[x], cp->R[N]);
+    copro_completeCycle(cp, x);
+    PROFILE_END(PROF_SUB);
 }
 
-void copro_mul(int x, int y, int z, int N) {
-    mpz_mul(R[x], R[y], R[z]);
-    mpz_mod(R[x], R[x], R[N]);
-    copro_completeCycle(x);
+void copro_mul(struct copro *cp, int x, int y, int z, int N) {
+    PROFILE_BEGIN(cp->R[y], cp->R[z]);
+    mpz_mul(cp->R[x], cp->R[y], cp->R[z]);
+    mpz_mod(cp->R[x], cp->R[x], cp->R[N]);
+    copro_completeCycle(cp, x);
+    PROFILE_END(PROF_MUL);
 }
 
-void copro_mul_inverse(int x, int y, int N) {
-    mpz_t gcd, dummy;
-    mpz_init(gcd);
-    mpz_init(dummy);
-    mpz_gcdext(gcd, R[x], dummy, R[y], R[N]);
-    if (mpz_cmp_ui(gcd, 1) == 0) { // gcd == 1
-        mpz_mod(R[x], R[x], R[N]);
+void copro_mul_inverse(struct copro *cp, int x, int y, int N) {
+    PROFILE_BEGIN(cp->R[y], NULL);
+    mpz_gcdext(cp->gcd, cp->R[x], cp->dummy, cp->R[y], cp->R[N]);
+    if (mpz_cmp_ui(cp->gcd, 1) == 0) { // gcd == 1
+        mpz_mod(cp->R[x], cp->R[x], cp->R[N]);
     } else {
-        mpz_set_ui(R[x], 0);
+        mpz_set_ui(cp->R[x], 0);
     }
-
-    mpz_clear(dummy);
-    mpz_clear(gcd);
-    copro_completeCycle(x);
+    copro_completeCycle(cp, x);
+    PROFILE_END(PROF_MUL_INVERSE);
 }
 
-void copro_add_inverse(int x, int y, int N) {
-    mpz_mod(R[y], R[y], R[N]);
-    mpz_sub(R[x], R[N], R[y]);
-    copro_completeCycle(x);
+void copro_add_inverse(struct copro *cp, int x, int y, int N) {
+    PROFILE_BEGIN(cp->R[y], NULL);
+    mpz_mod(cp->R[y], cp->R[y], cp->R[N]);
+    mpz_sub(cp->R[x], cp->R[N], cp->R[y]);
+    copro_completeCycle(cp, x);
+    PROFILE_END(PROF_ADD_INVERSE);
 }
 
-void copro_copy_mod(int x, int y, int N) {
-    mpz_mod(R[x], R[y], R[N]);
-    copro_completeCycle(x);
+void copro_copy_mod(struct copro *cp, int x, int y, int N) {
+    PROFILE_BEGIN(cp->R[y], NULL);
+    mpz_mod(cp->R[x], cp->R[y], cp->R[N]);
+    copro_completeCycle(cp, x);
+    PROFILE_END(PROF_COPY_MOD);
 }
 
-void copro_copy(int x, int y) {
-    mpz_set(R[x], R[y]);
-    copro_completeCycle(x);
+void copro_copy(struct copro *cp, int x, int y) {
+    PROFILE_BEGIN(cp->R[y], NULL);
+    mpz_set(cp->R[x], cp->R[y]);
+    copro_completeCycle(cp, x);
+    PROFILE_END(PROF_COPY);
 }
 
-void copro_load_immediate(int x, mpz_t *val) {
-    mpz_set(R[x], *val);
-    copro_completeCycle(x);
+void copro_load_immediate(struct copro *cp, int x, mpz_t *val) {
+    PROFILE_BEGIN(*val, NULL);
+    mpz_set(cp->R[x], *val);
+    copro_completeCycle(cp, x);
+    PROFILE_END(PROF_LOAD_IMMEDIATE);
 }
 
-void copro_print_adr(int x) {
-    mpz_out_str(stdout, 10, R[x]);
+void copro_print_adr(struct copro *cp, int x) {
+    mpz_out_str(stdout, 10, cp->R[x]);
     printf("\n");
 }
 
-void pow_on_copro(int x, int y, int z, int N) {
-    // uses left to right binary exp again
-    copro_copy(POW_ADR, ONE_ADR);
-    for (int i=1024; i>=0; --i) { // loop thru bits
-        copro_mul(POW_ADR, POW_ADR, POW_ADR, N);
-        if (mpz_tstbit(R[z], i) == 1) {
-            copro_mul(POW_ADR, POW_ADR, y, N);
+long pow_n_bits(struct copro *cp, int z) {
+    // bits in the exponent, 1 for 0 (like bin(0) in task2.power)
+    return mpz_sizeinbase(cp->R[z], 2);
+}
+
+void pow_binary(struct copro *cp, int y, int z, int N, long top) {
+    copro_copy(cp, POW_ADR, ONE_ADR);
+    for (long i=top; i>=0; --i) { // loop thru bits
+        copro_mul(cp, POW_ADR, POW_ADR, POW_ADR, N);
+        if (mpz_tstbit(cp->R[z], i) == 1) {
+            copro_mul(cp, POW_ADR, POW_ADR, y, N);
         }
     }
-    copro_copy(x, POW_ADR);
 }
 
-void rsaSign(mpz_t *p, mpz_t *q, mpz_t *N, mpz_t *d, mpz_t *m, mpz_t *c) {
-    // "realistic" version
+int kary_power_reg(int y, unsigned long v) {
+    // register holding y^v
+    return v == 0 ? ONE_ADR : v == 1 ? y : TABLE_ADR + (int)v;
+}
+
+void pow_kary(struct copro *cp, int y, int z, int N, int k) {
+    // y^2 .. y^(2^k - 1) first, then one mul per non-zero digit
+    if (k > 1) {
+        copro_mul(cp, TABLE_ADR+2, y, y, N);
+    }
+    for (int v=3; v<(1 << k); ++v) {
+        copro_mul(cp, TABLE_ADR+v, TABLE_ADR+v-1, y, N);
+    }
+    long digits = (pow_n_bits(cp, z) + k - 1) / k;
+    for (long i=digits-1; i>=0; --i) {
+        unsigned long v = 0;
+        for (int j=k-1; j>=0; --j) {
+            v = v << 1 | mpz_tstbit(cp->R[z], i*k + j);
+        }
+        if (i == digits-1) { // start from the top digit's power rather than squaring 1
+            copro_copy(cp, POW_ADR, kary_power_reg(y, v));
+            continue;
+        }
+        for (int j=0; j<k; ++j) {
+            copro_mul(cp, POW_ADR, POW_ADR, POW_ADR, N);
+        }
+        if (v != 0) {
+            copro_mul(cp, POW_ADR, POW_ADR, kary_power_reg(y, v), N);
+        }
+    }
+}
+
+void pow_sliding(struct copro *cp, int y, int z, int N, int k) {
+    // only the odd powers y^3 .. y^(2^k - 1) are needed, from y^2
+    if (k > 1) {
+        copro_mul(cp, POW_TMP_ADR, y, y, N);
+        copro_mul(cp, TABLE_ADR+1, y, POW_TMP_ADR, N);
+    }
+    for (int v=2; v<(1 << (k-1)); ++v) {
+        copro_mul(cp, TABLE_ADR+v, TABLE_ADR+v-1, POW_TMP_ADR, N);
+    }
+    int started = 0;
+    long i = pow_n_bits(cp, z) - 1;
+    while (i >= 0) {
+        if (mpz_tstbit(cp->R[z], i) == 0) {
+            if (started) {
+                copro_mul(cp, POW_ADR, POW_ADR, POW_ADR, N);
+            }
+            i--;
+            continue;
+        }
+        // the longest window of at most k bits from bit i that ends in a 1
+        long t = i - k + 1 > 0 ? i - k + 1 : 0;
+        while (mpz_tstbit(cp->R[z], t) == 0) {
+            t++;
+        }
+        unsigned long v = 0;
+        for (long j=i; j>=t; --j) {
+            v = v << 1 | mpz_tstbit(cp->R[z], j);
+        }
+        int reg = v == 1 ? y : TABLE_ADR + (int)(v / 2);
+        if (started) {
+            for (long j=i; j>=t; --j) {
+                copro_mul(cp, POW_ADR, POW_ADR, POW_ADR, N);
+            }
+            copro_mul(cp, POW_ADR, POW_ADR, reg, N);
+        } else {
+            copro_copy(cp, POW_ADR, reg);
+            started = 1;
+        }
+        i = t - 1;
+    }
+    if (!started) { // the exponent is 0
+        copro_copy(cp, POW_ADR, ONE_ADR);
+    }
+}
 
-    // initialisation and loading args into 'coprocessor'
-    copro_init();
+void pow_ladder(struct copro *cp, int y, int z, int N) {
+    // POW_ADR = y^e and POW_TMP_ADR = y^(e+1) for the bits seen so far
+    copro_copy(cp, POW_ADR, ONE_ADR);
+    copro_copy(cp, POW_TMP_ADR, y);
+    for (long i=pow_n_bits(cp, z)-1; i>=0; --i) {
+        if (mpz_tstbit(cp->R[z], i) == 1) {
+            copro_mul(cp, POW_ADR, POW_ADR, POW_TMP_ADR, N);
+            copro_mul(cp, POW_TMP_ADR, POW_TMP_ADR, POW_TMP_ADR, N);
+        } else {
+            copro_mul(cp, POW_TMP_ADR, POW_ADR, POW_TMP_ADR, N);
+            copro_mul(cp, POW_ADR, POW_ADR, POW_ADR, N);
+        }
+    }
+}
 
-    copro_load_immediate(P_ADR, p);
-    copro_load_immediate(Q_ADR, q);
-    copro_load_immediate(N_ADR, N);
-    copro_load_immediate(D_ADR, d);
-    copro_load_immediate(M_ADR, m);
+void pow_on_copro(struct copro *cp, int x, int y, int z, int N) {
+    // works in POW_ADR (and the window tables), then copies the result into x
+    switch (cp->pow_method) {
+        case POW_BINARY: pow_binary(cp, y, z, N, pow_n_bits(cp, z) - 1); break;
+        case POW_FULL: pow_binary(cp, y, z, N, 1024); break;
+        case POW_KARY: pow_kary(cp, y, z, N, cp->pow_window); break;
+        case POW_SLIDING: pow_sliding(cp, y, z, N, cp->pow_window); break;
+        case POW_LADDER: pow_ladder(cp, y, z, N); break;
+    }
+    copro_copy(cp, x, POW_ADR);
+}
 
-    mpz_t one;
-    mpz_init_set_ui(one, 1);
-    copro_load_immediate(ONE_ADR, &one);
-    mpz_clear(one);
+// rsaSign's program as an instruction list, in the same order as
+// RSA_SIGN_PROGRAM in task2.py (so task2_schedule.py can map its cycles)
+// OP_POW is pow_on_copro, the only instruction taking more than one cycle
+enum copro_op {OP_ADD, OP_SUB, OP_MUL, OP_MUL_INVERSE, OP_ADD_INVERSE, OP_COPY_MOD, OP_COPY, OP_POW};
 
+struct copro_instr {
+    enum copro_op op;
+    int x, y, z, N; // unused operands are 0
+    const char *phase; // as in task2.py, for PROFILE
+};
+
+const struct copro_instr rsa_sign_program[] = {
     // compute a = m^(d mod p-1) (mod p)
-    copro_sub(COMP_ADR_1, P_ADR, ONE_ADR, P_ADR);
-    copro_copy_mod(COMP_ADR_1, D_ADR, COMP_ADR_1);
-    pow_on_copro(A_ADR, M_ADR, COMP_ADR_1, P_ADR);
+    {OP_SUB, COMP_ADR_1, P_ADR, ONE_ADR, P_ADR, "setup_p"},
+    {OP_COPY_MOD, COMP_ADR_1, D_ADR, 0, COMP_ADR_1, "setup_p"},
+    {OP_POW, A_ADR, M_ADR, COMP_ADR_1, P_ADR, "pow_p"},
     // similar for b = m^(d mod q-1) (mod q)
-    copro_sub(COMP_ADR_1, Q_ADR, ONE_ADR, Q_ADR);
-    copro_copy_mod(COMP_ADR_1, D_ADR, COMP_ADR_1);
-    pow_on_copro(B_ADR, M_ADR, COMP_ADR_1, Q_ADR);
-
+    {OP_SUB, COMP_ADR_1, Q_ADR, ONE_ADR, Q_ADR, "setup_q"},
+    {OP_COPY_MOD, COMP_ADR_1, D_ADR, 0, COMP_ADR_1, "setup_q"},
+    {OP_POW, B_ADR, M_ADR, COMP_ADR_1, Q_ADR, "pow_q"},
     // now compute x=1/p mod q, y=1/q mod p
-    copro_mul_inverse(X_ADR, P_ADR, Q_ADR);
-    copro_mul_inverse(Y_ADR, Q_ADR, P_ADR);
-
+    {OP_MUL_INVERSE, X_ADR, P_ADR, 0, Q_ADR, "inverse"},
+    {OP_MUL_INVERSE, Y_ADR, Q_ADR, 0, P_ADR, "inverse"},
     // so c = bxp + ayq (mod N)
-    copro_mul(C_ADR, B_ADR, X_ADR, N_ADR);
-    copro_mul(C_ADR, C_ADR, P_ADR, N_ADR);
-    copro_mul(COMP_ADR_1, A_ADR, Y_ADR, N_ADR);
-    copro_mul(COMP_ADR_1, COMP_ADR_1, Q_ADR, N_ADR);
-    copro_add(C_ADR, C_ADR, COMP_ADR_1, N_ADR);
-    mpz_set(*c, R[C_ADR]);
+    {OP_MUL, C_ADR, B_ADR, X_ADR, N_ADR, "recombine"},
+    {OP_MUL, C_ADR, C_ADR, P_ADR, N_ADR, "recombine"},
+    {OP_MUL, COMP_ADR_1, A_ADR, Y_ADR, N_ADR, "recombine"},
+    {OP_MUL, COMP_ADR_1, COMP_ADR_1, Q_ADR, N_ADR, "recombine"},
+    {OP_ADD, C_ADR, C_ADR, COMP_ADR_1, N_ADR, "recombine"},
+};
+
+// rsaSign's program with the key in CRT form (`-k`), same as
+// RSA_SIGN_CRT_PROGRAM in task2.py: d mod p-1, d mod q-1, x and y
+// are loaded rather than computed on the coprocessor
+const struct copro_instr rsa_sign_crt_program[] = {
+    {OP_POW, A_ADR, M_ADR, DP_ADR, P_ADR, "pow_p"},
+    {OP_POW, B_ADR, M_ADR, DQ_ADR, Q_ADR, "pow_q"},
+    {OP_MUL, C_ADR, B_ADR, X_ADR, N_ADR, "recombine"},
+    {OP_MUL, C_ADR, C_ADR, P_ADR, N_ADR, "recombine"},
+    {OP_MUL, COMP_ADR_1, A_ADR, Y_ADR, N_ADR, "recombine"},
+    {OP_MUL, COMP_ADR_1, COMP_ADR_1, Q_ADR, N_ADR, "recombine"},
+    {OP_ADD, C_ADR, C_ADR, COMP_ADR_1, N_ADR, "recombine"},
+};
+
+// the key in CRT form, worked out once in main for `-k`
+struct crt_key {
+    mpz_t dp, dq; // d mod p-1, d mod q-1
+    mpz_t x, y; // 1/p mod q, 1/q mod p
+};
+
+void crt_key_init(struct crt_key *key, mpz_t p, mpz_t q, mpz_t d) {
+    mpz_inits(key->dp, key->dq, key->x, key->y, NULL);
+    mpz_sub_ui(key->x, p, 1); // using x as a dummy variable
+    mpz_mod(key->dp, d, key->x);
+    mpz_sub_ui(key->x, q, 1);
+    mpz_mod(key->dq, d, key->x);
+    int ok = mpz_invert(key->x, p, q) && mpz_invert(key->y, q, p);
+    assert(ok);
+}
+
+void crt_key_clear(struct crt_key *key) {
+    mpz_clears(key->dp, key->dq, key->x, key->y, NULL);
+}
+
+void copro_run(struct copro *cp, const struct copro_instr *program, size_t len) {
+    for (size_t i=0; i<len; ++i) {
+        const struct copro_instr *in = &program[i];
+        PROFILE_PHASE(cp, in->phase);
+        switch (in->op) {
+            case OP_ADD: copro_add(cp, in->x, in->y, in->z, in->N); break;
+            case OP_SUB: copro_sub(cp, in->x, in->y, in->z, in->N); break;
+            case OP_MUL: copro_mul(cp, in->x, in->y, in->z, in->N); break;
+            case OP_MUL_INVERSE: copro_mul_inverse(cp, in->x, in->y, in->N); break;
+            case OP_ADD_INVERSE: copro_add_inverse(cp, in->x, in->y, in->N); break;
+            case OP_COPY_MOD: copro_copy_mod(cp, in->x, in->y, in->N); break;
+            case OP_COPY: copro_copy(cp, in->x, in->y); break;
+            case OP_POW: pow_on_copro(cp, in->x, in->y, in->z, in->N); break;
+        }
+    }
+    PROFILE_PHASE(cp, NULL);
+}
+
+void rsaSign(struct copro *cp, mpz_t *p, mpz_t *q, mpz_t *N, mpz_t *d, mpz_t *m, mpz_t *c, struct crt_key *key) {
+    // "realistic" version
+    // with a `key` its CRT parameters are loaded instead of d
+
+    // loading args into 'coprocessor'
+    // (registers are initialised once by copro_init)
+    cp->clock = 0;
+    PROFILE_PHASE(cp, "load");
+
+    copro_load_immediate(cp, P_ADR, p);
+    copro_load_immediate(cp, Q_ADR, q);
+    copro_load_immediate(cp, N_ADR, N);
+    if (key != NULL) {
+        copro_load_immediate(cp, M_ADR, m);
+        copro_load_immediate(cp, DP_ADR, &key->dp);
+        copro_load_immediate(cp, DQ_ADR, &key->dq);
+        copro_load_immediate(cp, X_ADR, &key->x);
+        copro_load_immediate(cp, Y_ADR, &key->y);
+        copro_load_immediate(cp, ONE_ADR, &cp->one);
+        copro_run(cp, rsa_sign_crt_program, sizeof(rsa_sign_crt_program) / sizeof(rsa_sign_crt_program[0]));
+        mpz_set(*c, cp->R[C_ADR]);
+        return;
+    }
+    copro_load_immediate(cp, D_ADR, d);
+    copro_load_immediate(cp, M_ADR, m);
+
+    copro_load_immediate(cp, ONE_ADR, &cp->one);
+
+    copro_run(cp, rsa_sign_program, sizeof(rsa_sign_program) / sizeof(rsa_sign_program[0]));
+    mpz_set(*c, cp->R[C_ADR]);
+}
+
+// threaded signing with copro_jobs.h: these sign on a struct copro per thread
+struct sign_args {
+    mpz_t *p, *q, *N, *d;
+    struct crt_key *key;
+    enum pow_method pow_method; // the schedule every thread's context uses
+    int pow_window;
+};
+
+void *copro_job_ctx_new(struct copro_jobs *jobs) {
+    struct sign_args *args = jobs->arg;
+    struct copro *cp = malloc(sizeof(struct copro));
+    assert(cp != NULL);
+    copro_init(cp);
+    cp->pow_method = args->pow_method;
+    cp->pow_window = args->pow_window;
+    return cp;
+}
+
+unsigned long copro_job_sign(struct copro_jobs *jobs, void *ctx, unsigned long long seed,
+                             unsigned long fault, mpz_t *m, mpz_t *c) {
+    struct sign_args *args = jobs->arg;
+    struct copro *cp = ctx;
+    copro_rng_seed(&cp->rng, seed);
+    cp->f = fault;
+    rsaSign(cp, args->p, args->q, args->N, args->d, m, c, args->key);
+    return cp->clock;
+}
+
+void copro_job_ctx_free(void *ctx) {
+    copro_clear(ctx);
+    free(ctx);
+}
+
+#ifdef COPRO_LIB
+/*
+Shared library build, for use in-process through task2_lib.py:
+    gcc -shared -fPIC -DCOPRO_LIB -O2 task2_in_c.c -o task2_in_c.so -lgmp -lpthread
+(also `make lib prog=task2_in_c`)
+profiled build (one thread, op histogram on stderr at exit), either way:
+    gcc -DPROFILE=1 -O2 task2_in_c.c -o task2_in_c.exe -lgmp -lpthread
+    gcc -shared -fPIC -DCOPRO_LIB -DPROFILE=1 -O2 task2_in_c.c -o task2_in_c.so -lgmp -lpthread
+the stable API is copro_seed and the copro_signer_* functions below,
+numbers go in and out as big-endian unsigned byte buffers
+*/
+struct copro_signer {
+    mpz_t p, q, N, d, m, c;
+    int crt; // use rsa_sign_crt_program, like `-k`
+    struct crt_key key;
+    struct copro copro; // its own registers, so signers can be used from different threads
+};
+
+unsigned long long copro_next_seed = 0; // for the next signer's faults
+
+void copro_seed(unsigned int seed) {
+    copro_next_seed = seed;
+}
+
+struct copro_signer *copro_signer_new(const unsigned char *p, size_t p_len, const unsigned char *q, size_t q_len,
+                                      const unsigned char *N, size_t N_len, const unsigned char *d, size_t d_len, int crt,
+                                      const char *pow_method, int window) {
+    // the key is imported once, like server mode reading it once in main
+    // `pow_method` and `window` are this signer's `-p` and `-W` (NULL for
+    // the default), returns NULL if they're invalid
+    struct copro_signer *signer = malloc(sizeof(struct copro_signer));
+    copro_init(&signer->copro);
+    if (pow_method != NULL && pow_set_method(&signer->copro, pow_method, window) != 0) {
+        copro_clear(&signer->copro);
+        free(signer);
+        return NULL;
+    }
+    copro_rng_seed(&signer->copro.rng, copro_next_seed++);
+    mpz_inits(signer->p, signer->q, signer->N, signer->d, signer->m, signer->c, NULL);
+    mpz_import(signer->p, p_len, 1, 1, 1, 0, p);
+    mpz_import(signer->q, q_len, 1, 1, 1, 0, q);
+    mpz_import(signer->N, N_len, 1, 1, 1, 0, N);
+    mpz_import(signer->d, d_len, 1, 1, 1, 0, d);
+    signer->crt = crt;
+    if (crt) {
+        crt_key_init(&signer->key, signer->p, signer->q, signer->d);
+    }
+    return signer;
+}
+
+long copro_signer_sign(struct copro_signer *signer, const unsigned char *m, size_t m_len,
+                       unsigned long fault, unsigned char *c, size_t c_size, unsigned long *cycles) {
+    // signs m with a fault at cycle `fault` (0 for none)
+    // c is written as exactly c_size bytes, zero padded on the left
+    // returns c_size, or -1 if c doesn't fit
+    mpz_import(signer->m, m_len, 1, 1, 1, 0, m);
+    signer->copro.f = fault;
+    rsaSign(&signer->copro, &signer->p, &signer->q, &signer->N, &signer->d, &signer->m, &signer->c,
+            signer->crt ? &signer->key : NULL);
+    *cycles = signer->copro.clock;
+    return export_padded(signer->c, c, c_size);
 }
 
-int main() {
-    srand(time(NULL));
+long copro_signer_sign_batch(struct copro_signer *signer, const unsigned char *m, size_t m_size, size_t n_m,
+                             const unsigned long *faults, size_t n, unsigned char *c, size_t c_size,
+                             unsigned long *cycles, int n_threads) {
+    // signs n messages, each with the fault at the same index of `faults`,
+    // on `n_threads` threads (each with its own coprocessor)
+    // m is n_m (1 or n) messages of m_size bytes each, c gets n signatures
+    // of c_size bytes each and cycles gets n cycle counts, in order
+    // returns c_size, or -1 if a signature doesn't fit
+    struct sign_args args = {
+        &signer->p, &signer->q, &signer->N, &signer->d, signer->crt ? &signer->key : NULL,
+        signer->copro.pow_method, signer->copro.pow_window,
+    };
+    struct copro_jobs jobs = {
+        .faults = faults, .n_jobs = n, .seed = copro_rng_next64(&signer->copro.rng), .arg = &args,
+        .ctx_new = copro_job_ctx_new, .sign = copro_job_sign, .ctx_free = copro_job_ctx_free,
+    };
+    return copro_sign_batch(&jobs, m, m_size, n_m, c, c_size, cycles,
+                            PROFILE ? 1 : n_threads); // the histogram isn't thread safe
+}
+
+void copro_signer_free(struct copro_signer *signer) {
+    if (signer->crt) {
+        crt_key_clear(&signer->key);
+    }
+    copro_clear(&signer->copro);
+    mpz_clears(signer->p, signer->q, signer->N, signer->d, signer->m, signer->c, NULL);
+    free(signer);
+}
+#else
+
+
+void sweep_thread_done(struct copro_jobs *jobs, size_t i, unsigned long cycles, mpz_t c) {
+    // threaded sweep: write each "f c" line as it completes, like the forks do
+    (void)cycles;
+    write_ui(jobs->faults[i], ' ');
+    write_mpz(c, '\n');
+    fflush(stdout);
+}
+
+int main(int argc, char **argv) {
+    struct copro cp;
+    copro_init(&cp);
+#ifndef _WIN32
+    copro_rng_seed(&cp.rng, time(NULL) ^ (unsigned long long)getpid() << 32); // so workers started together don't flip the same bits
+#else
+    copro_rng_seed(&cp.rng, time(NULL));
+#endif
     int i;
-    for (int j=0; j<3; ++j) {
-        int stop = 10+rand()%100;
-        for (i=0; i<stop; ++i) {
-            rand();
+
+    // server mode (`-s`): p, q, N, d are read once, then (m, f) pairs
+    // are signed one after the other until stdin is closed
+    // CRT key mode (`-k`): d mod p-1, d mod q-1 and the inverses are
+    // worked out once here and loaded, rather than computed on every sign
+    // sweep mode (`-w`): requests are (m, f_lo, f_hi) and the reply is one
+    // "f c" line for each faulty signature as it completes (in any order),
+    // then "0 c cycles" for the fault-free one
+    // `-t n` runs a sweep's faults on n threads rather than forking (only with `-w`)
+    // binary mode (`-b`): see oracle_io.h
+    // `-p method` picks pow_on_copro's schedule and `-W k` its window size
+    int server = 0, crt = 0, sweep = 0, window = 4, n_threads = 0;
+    const char *method = "binary";
+    oracle_io_init(argc, argv);
+    for (i=1; i<argc; ++i) {
+        if (strcmp(argv[i], "-s") == 0) {
+            server = 1;
+        } else if (strcmp(argv[i], "-k") == 0) {
+            crt = 1;
+        } else if (strcmp(argv[i], "-w") == 0) {
+            sweep = 1;
+        } else if (strcmp(argv[i], "-p") == 0 && i+1 < argc) {
+            method = argv[++i];
+        } else if (strcmp(argv[i], "-W") == 0 && i+1 < argc) {
+            window = atoi(argv[++i]);
+        } else if (strcmp(argv[i], "-t") == 0 && i+1 < argc) {
+            n_threads = atoi(argv[++i]);
         }
     }
+    if (pow_set_method(&cp, method, window) != 0) {
+        fprintf(stderr, "unknown pow method %s or window %d\n", method, window);
+        return 1;
+    }
+    if (n_threads != 0 && (!sweep || n_threads < 0)) {
+        fprintf(stderr, "-t needs sweep mode (-w) and at least 1 thread\n");
+        return 1;
+    }
+#ifdef _WIN32
+    if (sweep && n_threads == 0) {
+        fprintf(stderr, "sweep mode needs fork, or threads with -t\n");
+        return 1;
+    }
+#else
+    sweep_max_children = sysconf(_SC_NPROCESSORS_ONLN);
+#endif
 
     mpz_t p, q, N, e, d, m, f_mpz, c;
-    mpz_inits(p, q, N, e, d, m, f_mpz, c);
-
-    char inputStr[1024];
-    int flag; // for parsing str to mpz_t
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(p, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(q, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(N, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(d, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(m, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(f_mpz, inputStr, 10);
-    assert(flag == 0);
-
-    f = mpz_get_ui(f_mpz);
-
-    rsaSign(&p, &q, &N, &d, &m, &c);
-    mpz_out_str(stdout, 10, c);
-    printf("\n%d\n", copro_clock);
-
-    mpz_clear(p);
-    mpz_clear(q);
-    mpz_clear(N);
-    mpz_clear(e);
-    mpz_clear(d);
-    mpz_clear(m);
-    mpz_clear(f_mpz);
+    mpz_inits(p, q, N, e, d, m, f_mpz, c, NULL);
+
+    if (!read_mpz(p) || !read_mpz(q) || !read_mpz(N) || !read_mpz(d)) {
+        return 1;
+    }
+
+    struct crt_key key;
+    if (crt) {
+        crt_key_init(&key, p, q, d);
+    }
+
+    do {
+        if (!read_mpz(m) || !read_mpz(f_mpz)) {
+            break;
+        }
+        cp.f = mpz_get_ui(f_mpz);
+        if (sweep) {
+            cp.sweep_lo = cp.f > 0 ? cp.f : 1;
+            if (!read_mpz(f_mpz)) {
+                break;
+            }
+            cp.sweep_hi = mpz_get_ui(f_mpz);
+            cp.f = 0;
+        }
+
+        if (sweep && n_threads > 0) {
+            // the fault-free run first, so only cycles it has are swept
+            unsigned long lo = cp.sweep_lo, hi = cp.sweep_hi;
+            cp.sweep_hi = 0;
+            rsaSign(&cp, &p, &q, &N, &d, &m, &c, crt ? &key : NULL);
+            hi = hi < cp.clock ? hi : cp.clock;
+            size_t n_faults = hi >= lo ? hi - lo + 1 : 0;
+            unsigned long *faults = malloc((n_faults + 1) * sizeof(unsigned long));
+            assert(faults != NULL);
+            for (size_t j=0; j<n_faults; ++j) {
+                faults[j] = lo + j;
+            }
+            struct sign_args args = {&p, &q, &N, &d, crt ? &key : NULL, cp.pow_method, cp.pow_window};
+            struct copro_jobs jobs = {
+                .ms = &m, .n_ms = 1, .faults = faults, .n_jobs = n_faults,
+                .seed = copro_rng_next64(&cp.rng), .arg = &args,
+                .ctx_new = copro_job_ctx_new, .sign = copro_job_sign, .ctx_free = copro_job_ctx_free,
+                .done = sweep_thread_done,
+            };
+            copro_run_jobs(&jobs, PROFILE ? 1 : n_threads); // the histogram isn't thread safe
+            free(faults);
+        } else {
+            rsaSign(&cp, &p, &q, &N, &d, &m, &c, crt ? &key : NULL);
+        }
+        if (sweep_child) {
+            write_ui(cp.sweep_lo, ' ');
+            write_mpz(c, '\n');
+            fflush(stdout);
+            _exit(0);
+        }
+        if (sweep) {
+            cp.sweep_hi = 0;
+#ifndef _WIN32
+            for (; sweep_children > 0; sweep_children--) {
+                wait(NULL);
+            }
+#endif
+            write_ui(0, ' ');
+            write_mpz(c, ' ');
+            write_ui(cp.clock, '\n');
+        } else {
+            write_mpz(c, '\n');
+            write_ui(cp.clock, '\n');
+        }
+        fflush(stdout);
+    } while (server);
+
+#if PROFILE
+    profile_write(stderr);
+#endif
+    if (crt) {
+        crt_key_clear(&key);
+    }
+    mpz_clears(p, q, N, e, d, m, f_mpz, c, NULL);
+    copro_clear(&cp);
 
     return 0;
-}
\ No newline at end of file
+}
+#endif
@@ -0,0 +1,354 @@
+from task1 import gcd_extended, rsa_keygen, CRTKey
+from task2 import C_ADR, RSA_SIGN_PROGRAM, RSA_SIGN_CRT_PROGRAM
+import numpy as np
+import functools
+import random
+import math
+import time
+import sys
+
+# registers are arrays of 32 bit words (least significant first), kept in
+# uint64 so that a word times a word, or a sum of words, can't overflow
+WORD_BITS = 32
+WORD_MASK = np.uint64((1 << WORD_BITS) - 1)
+SHIFT = np.uint64(WORD_BITS)
+
+
+def to_limbs(xs, n_words):
+    """
+    (len(xs), `n_words`) array of the words of each int in `xs`
+    """
+    buf = b"".join(x.to_bytes(4*n_words, "little") for x in xs)
+    return np.frombuffer(buf, dtype="<u4").reshape(len(xs), n_words).astype(np.uint64)
+
+
+def from_limbs(a):
+    """
+    the ints in the rows of the word array `a`
+    """
+    return [int.from_bytes(row.astype("<u4").tobytes(), "little") for row in a]
+
+
+def _pad(a, n_words):
+    if a.shape[1] >= n_words:
+        return a
+    return np.pad(a, ((0, 0), (0, n_words - a.shape[1])))
+
+
+def _carry(cols):
+    """
+    normalises column sums so every word is < 2^32 again
+    (carries rarely run far, so this is a few passes rather than one per word)
+    """
+    while True:
+        carry = cols >> SHIFT
+        if not carry.any():
+            return cols
+        assert(not carry[:, -1].any())
+        cols &= WORD_MASK
+        cols[:, 1:] += carry[:, :-1]
+
+
+def _add(a, b):
+    n_words = max(a.shape[1], b.shape[1]) + 1
+    return _carry(_pad(a, n_words) + _pad(b, n_words))
+
+
+def _sub(a, b):
+    """
+    a - b for the rows where a >= b (other rows are garbage)
+    """
+    n_words = max(a.shape[1], b.shape[1])
+    diff = _pad(a, n_words).astype(np.int64) - _pad(b, n_words).astype(np.int64)
+    while True:
+        borrow = diff < 0
+        if not borrow[:, :-1].any():
+            return diff.astype(np.uint64)
+        diff[:, :-1][borrow[:, :-1]] += 1 << WORD_BITS
+        diff[:, 1:] -= borrow[:, :-1]
+
+
+def _mul(a, b):
+    """
+    schoolbook product of each row of `a` with the same row of `b`, one
+    word of `a` at a time against all of `b` (the 64 bit partial products
+    are split into their low and high words before they're added up)
+    """
+    n_a, n_b = a.shape[1], b.shape[1]
+    cols = np.zeros((a.shape[0], n_a + n_b), np.uint64)
+    prod = np.empty(b.shape, np.uint64)
+    half = np.empty(b.shape, np.uint64)
+    for i in range(n_a):
+        if not a[:, i].any(): # the top words are usually 0 in every lane
+            continue
+        np.multiply(a[:, i:i+1], b, out=prod)
+        cols[:, i:i+n_b] += np.bitwise_and(prod, WORD_MASK, out=half)
+        cols[:, i+1:i+1+n_b] += np.right_shift(prod, SHIFT, out=half)
+    return _carry(cols)
+
+
+def _ge(a, b):
+    """
+    which rows of `a` are >= the same row of `b` (same shape)
+    """
+    differ = a != b
+    top = differ.shape[1] - 1 - np.argmax(differ[:, ::-1], axis=1)
+    rows = np.arange(a.shape[0])
+    return ~differ.any(axis=1) | (a[rows, top] > b[rows, top])
+
+
+class LaneCoprocessor:
+    """
+    task2_coprocessor.Coprocessor with a register file of fixed width word
+    arrays, running every op on `lanes` independent signatures at once:
+    `R[x]` is a (lanes, n_words) array with one row per lane
+
+    each lane has its own clock and fault cycle (`fault_steps`, 0 for none);
+    an op can be given a `mask` of the lanes that execute it, and only those
+    lanes spend a clock cycle, so lanes can take different paths through
+    an exponentiation as if each were its own coprocessor
+
+    `fault_model` is "bit" (flip one random bit of the first `n_bits`, the
+    same as Coprocessor) or "word" (xor a random non-zero value into one
+    random word, like a glitch on a 32 bit datapath)
+    every fault is recorded in `faults` as (lane, clock, register, word, xor)
+
+    this is for modelling faults at the granularity of a datapath word, not
+    for speed: NumPy limb arithmetic is well over 10x slower per signature
+    than task2's Python ints (or GMP), so attacks should sweep with those
+    """
+    N_REGISTERS: int
+    R: np.ndarray
+    clock: np.ndarray
+    f: np.ndarray
+    faults: list[tuple[int, int, int, int, int]]
+
+    def __init__(self, n_registers: int, n_bits: int, lanes: int, fault_steps=None,
+                 fault_model: str="bit") -> None:
+        assert(fault_model in ("bit", "word"))
+        self.N_REGISTERS = n_registers
+        self.n_bits = n_bits
+        self.lanes = lanes
+        # room for any value a fault can make, plus a carry
+        self.n_words = n_bits // WORD_BITS + 1
+        self.R = np.zeros((n_registers, lanes, self.n_words), np.uint64)
+        self.clock = np.zeros(lanes, np.int64)
+        self.f = np.zeros(lanes, np.int64) if fault_steps is None else np.asarray(fault_steps, np.int64)
+        assert(self.f.shape == (lanes,))
+        self.fault_model = fault_model
+        self.faults = []
+        self.__all = np.ones(lanes, bool)
+        self.__mu = {}
+
+    def __complete_cycle(self, x, mask):
+        """
+        increments the clock of the lanes in `mask` and faults register `x`
+        in those that have reached their fault cycle
+        """
+        self.clock[mask] += 1
+        hit = mask & (self.clock == self.f)
+        for lane in np.flatnonzero(hit):
+            if self.fault_model == "bit":
+                bit = random.randint(0, self.n_bits-1)
+                word, flip = bit // WORD_BITS, 1 << (bit % WORD_BITS)
+            else:
+                word = random.randint(0, (self.n_bits-1) // WORD_BITS)
+                flip = random.randint(1, (1 << WORD_BITS) - 1)
+            self.R[x, lane, word] ^= np.uint64(flip)
+            self.faults.append((int(lane), int(self.clock[lane]), x, word, flip))
+
+    def __write(self, x, value, mask):
+        mask = self.__all if mask is None else mask
+        value = _pad(value, self.n_words)[:, :self.n_words]
+        self.R[x] = np.where(mask[:, None], value, self.R[x])
+        self.__complete_cycle(x, mask)
+
+    def __barrett_mu(self, n):
+        """
+        floor(2^(64*n_words) / n) for each lane's modulus `n`, computed once
+        per distinct modulus (normally all lanes share one)
+        """
+        mu = np.repeat(self.__mu_of(n[0])[None], len(n), axis=0)
+        for lane in np.flatnonzero((n != n[0]).any(axis=1)):
+            mu[lane] = self.__mu_of(n[lane])
+        return mu
+
+    def __mu_of(self, row):
+        key = row.tobytes()
+        if key not in self.__mu:
+            modulus = from_limbs(row[None])[0]
+            assert(modulus != 0)
+            self.__mu[key] = to_limbs([(1 << (2*WORD_BITS*self.n_words)) // modulus], 2*self.n_words + 1)[0]
+        return self.__mu[key]
+
+    def __mod(self, x, N):
+        """
+        `x` (< 2^(64*n_words)) mod register `N` in each lane, by Barrett reduction
+        https://en.wikipedia.org/wiki/Barrett_reduction
+        """
+        n = self.R[N]
+        width = 2*self.n_words
+        x = _pad(x, width)
+        q = _mul(x, self.__barrett_mu(n))[:, width:]
+        r = _sub(x, _mul(q, n)[:, :width])
+        # q is at most one too small, but loop in case
+        n = _pad(n, width)
+        while True:
+            over = _ge(r, n)
+            if not over.any():
+                return r[:, :self.n_words]
+            r = np.where(over[:, None], _sub(r, n), r)
+
+    def read(self, x):
+        """
+        value of register `x` in each lane, doesn't use a clock cycle
+        """
+        return from_limbs(self.R[x])
+
+    def add(self, x, y, z, N, mask=None):
+        """
+        sums registers `y`+`z` into `x` (mod `N`)
+        """
+        self.__write(x, self.__mod(_add(self.R[y], self.R[z]), N), mask)
+
+    def sub(self, x, y, z, N, mask=None):
+        """
+        subs registers `y`-`z` into `x` (mod `N`)
+        """
+        a = self.__mod(self.R[y], N)
+        b = self.__mod(self.R[z], N)
+        diff = np.where(_ge(a, b)[:, None], _sub(a, b), _sub(_add(a, self.R[N]), b)[:, :self.n_words])
+        self.__write(x, diff, mask)
+
+    def mul(self, x, y, z, N, mask=None):
+        """
+        muls registers `y`*`z` into `x` (mod `N`)
+        """
+        self.__write(x, self.__mod(_mul(self.R[y], self.R[z]), N), mask)
+
+    def mul_inverse(self, x, y, N, mask=None):
+        """
+        puts 1/`y` into `x` (mod `N`) if it exists, otherwise puts 0 into `x`
+        (per lane with Python ints: it's only used twice per signature)
+        """
+        inverses = []
+        for a, n in zip(self.read(y), self.read(N)):
+            s, _, gcd = gcd_extended(a, n)
+            inverses.append(s % n if gcd == 1 else 0)
+        self.__write(x, to_limbs(inverses, self.n_words), mask)
+
+    def add_inverse(self, x, y, N, mask=None):
+        """
+        puts -`y` into `x` (mod `N`)
+        """
+        a = self.__mod(self.R[y], N)
+        zero = ~a.any(axis=1)
+        self.__write(x, np.where(zero[:, None], a, _sub(self.R[N], a)), mask)
+
+    def copy_mod(self, x, y, N, mask=None):
+        """
+        puts `y` into `x` (mod `N`)
+        """
+        self.__write(x, self.__mod(self.R[y], N), mask)
+
+    def load_immediate(self, x, val, mask=None):
+        """
+        puts `val` (an int, or one int per lane) directly into location `x`
+        """
+        vals = [val] * self.lanes if isinstance(val, int) else list(val)
+        self.__write(x, to_limbs(vals, self.n_words), mask)
+
+    def empty_regs(self):
+        self.R[:] = 0
+
+    def reset_clock(self):
+        self.clock[:] = 0
+
+
+def power(coprocessor: LaneCoprocessor, x, y, z, N, mask=None):
+    """
+    task2.power on every lane: each lane squares for each bit of its own
+    exponent in `z` from its top bit, so lanes with shorter (or faulted)
+    exponents sit out the first few steps without spending clock cycles
+    """
+    mask = np.ones(coprocessor.lanes, bool) if mask is None else mask
+    coprocessor.load_immediate(x, 1, mask)
+    exponent = coprocessor.R[z].copy()
+    lengths = np.array([max(e.bit_length(), 1) for e in from_limbs(exponent)]) # bin(0) is "0"
+    for i in reversed(range(lengths.max())):
+        active = mask & (lengths > i)
+        coprocessor.mul(x, x, x, N, active)
+        bit = (exponent[:, i // WORD_BITS] >> np.uint64(i % WORD_BITS)) & np.uint64(1)
+        multiply = active & (bit == 1)
+        if multiply.any(): # no lane spends a cycle otherwise
+            coprocessor.mul(x, x, y, N, multiply)
+
+
+def run_lanes(c: LaneCoprocessor, program, args):
+    """
+    task2.run_program on a LaneCoprocessor (without Montgomery ops),
+    where a value in `args` can be an int or one int per lane
+    """
+    for _, op, *operands in program:
+        if op == "load":
+            x, val = operands
+            c.load_immediate(x, args[val] if isinstance(val, str) else val)
+        elif op == "pow":
+            power(c, *operands)
+        else:
+            getattr(c, op)(*operands)
+
+
+def sign_lanes(p, q, N, d, n_bits, ms, fs, key: CRTKey=None, fault_model="bit"):
+    """
+    task2.rsa_sign of each message in `ms` with a fault at the same index
+    of `fs`, all in one pass of a LaneCoprocessor
+    returns [(c, clock cycles)] in the same order
+    """
+    c = LaneCoprocessor(16, n_bits, len(ms), fs, fault_model)
+    args = {"p": p, "q": q, "N": N, "d": d, "m": ms}
+    if key is not None:
+        args.update(dp=key.dp, dq=key.dq, x=key.x, y=key.y)
+    run_lanes(c, RSA_SIGN_PROGRAM if key is None else RSA_SIGN_CRT_PROGRAM, args)
+    return list(zip(c.read(C_ADR), c.clock.tolist()))
+
+
+def exploitable(sign, N, m, fs):
+    """
+    for each fault cycle in `fs`, whether the faulty signature of `m` reveals
+    a factor of `N` (the Bellcore gcd with the fault-free one), from one pass
+    of `sign` (a partial of `sign_lanes` with the key)
+    """
+    (m_signed, _), = sign([m], [0])
+    return [1 < math.gcd(m_signed - m_signed_faulty, N) < N
+            for m_signed_faulty, _ in sign([m]*len(fs), fs)]
+
+
+if __name__ == '__main__':
+    # python task2_lanes.py [n_bits] [lanes] [bit|word]
+    from task1 import crt_key
+    from task2 import rsa_sign
+    l = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    lanes = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    fault_model = sys.argv[3] if len(sys.argv) > 3 else "bit"
+    p, q, N, e, d = rsa_keygen(l, verbosity=1)
+    key = crt_key(p, q, N, d)
+
+    # the fault-free lanes should match the Python model exactly
+    ms = [random.randint(2, N-1) for _ in range(lanes)]
+    start_time = time.perf_counter()
+    replies = sign_lanes(p, q, N, d, l, ms, [0]*lanes, key)
+    print(f"{lanes} signatures in {time.perf_counter()-start_time :.3f} seconds")
+    for m, (c, cycles) in zip(ms, replies):
+        assert(pow(c, e, N) == m)
+        assert((c, cycles) == rsa_sign(p, q, N, d, l, m, key=key))
+
+    # how often a fault at a random cycle gives a signature that reveals p or q
+    D = functools.partial(sign_lanes, p, q, N, d, l, key=key, fault_model=fault_model)
+    m = random.randint(2, N-1)
+    (_, clock_cycles), = D([m], [0])
+    fs = [random.randint(1, clock_cycles) for _ in range(lanes)]
+    start_time = time.perf_counter()
+    leaks = exploitable(D, N, m, fs)
+    print(f"{sum(leaks)}/{lanes} {fault_model} faults reveal a factor of N "
+          f"({time.perf_counter()-start_time :.3f} seconds)")
@@ -0,0 +1,105 @@
+import ctypes
+import os
+import random
+
+# the bits a fault can flip go up to l in the C files (1024 in task2_in_c.c),
+# so a faulty c can be a bit wider than N
+C_FAULT_BITS = 1024
+
+
+def _to_bytes(x):
+    return x.to_bytes((x.bit_length() + 7) // 8, "big")
+
+
+class LibOracle:
+    """
+    task2_in_c.c (or task2_nonCRT.c) built as a shared library with
+    -DCOPRO_LIB and called in-process through ctypes, so a call to D
+    costs no pipes and no decimal parsing
+
+    same interface as oracle_client.OracleClient: D(m, f) returns (c, cycles)
+    and D_batch signs many (m, f) at once on the library's own threads
+    each LibOracle has its own coprocessor, so any number can be open at once
+    """
+    def __init__(self, path: str, p: int, q: int, N: int, d: int, crt: bool=False,
+                 pow_method: str=None, window: int=4) -> None:
+        """
+        `path` is the built library (e.g. ./task2_in_c.so)
+        `crt` loads the key in CRT form, like task2_in_c's `-k`
+        `pow_method` and `window` pick task2_in_c's exponentiation, like
+        `-p` and `-W` (binary if not given, whatever other LibOracles use)
+        """
+        self.lib = ctypes.CDLL(path)
+        buf = ctypes.c_char_p
+        size = ctypes.c_size_t
+        self.lib.copro_seed.argtypes = [ctypes.c_uint]
+        self.lib.copro_signer_new.argtypes = [buf, size, buf, size, buf, size, buf, size, ctypes.c_int,
+                                              ctypes.c_char_p, ctypes.c_int]
+        self.lib.copro_signer_new.restype = ctypes.c_void_p
+        self.lib.copro_signer_sign.argtypes = [ctypes.c_void_p, buf, size, ctypes.c_ulong,
+                                               ctypes.c_char_p, size, ctypes.POINTER(ctypes.c_ulong)]
+        self.lib.copro_signer_sign.restype = ctypes.c_long
+        self.lib.copro_signer_sign_batch.argtypes = [ctypes.c_void_p, buf, size, size,
+                                                     ctypes.POINTER(ctypes.c_ulong), size, buf, size,
+                                                     ctypes.POINTER(ctypes.c_ulong), ctypes.c_int]
+        self.lib.copro_signer_sign_batch.restype = ctypes.c_long
+        self.lib.copro_signer_free.argtypes = [ctypes.c_void_p]
+
+        # seeded from `random` so faults are as reproducible as the Python model's
+        self.lib.copro_seed(random.getrandbits(32))
+        key = []
+        for x in (p, q, N, d):
+            key += [_to_bytes(x), len(_to_bytes(x))]
+        # the schedule is this signer's own, other LibOracles on the library keep theirs
+        self.signer = self.lib.copro_signer_new(*key, int(crt),
+                                                pow_method.encode() if pow_method is not None else None, window)
+        assert(self.signer is not None), f"unknown pow method {pow_method} or window {window}"
+        self.c_size = (max(N.bit_length(), C_FAULT_BITS) + 7) // 8
+        self.c_buf = ctypes.create_string_buffer(self.c_size)
+        self.cycles = ctypes.c_ulong()
+
+    def D(self, m, f=0):
+        """
+        signs `m` with a fault at `f`, returns (c, cycles)
+        """
+        m_bytes = _to_bytes(m)
+        n = self.lib.copro_signer_sign(self.signer, m_bytes, len(m_bytes), f,
+                                       self.c_buf, self.c_size, ctypes.byref(self.cycles))
+        assert(n == self.c_size)
+        return int.from_bytes(self.c_buf.raw, "big"), self.cycles.value
+
+    def D_batch(self, requests, n_threads=None):
+        """
+        signs every (m, f) in `requests` on `n_threads` threads (default: one
+        per CPU), returns the (c, cycles) replies in the same order
+        """
+        requests = list(requests)
+        n = len(requests)
+        if n == 0:
+            return []
+        n_threads = n_threads or os.cpu_count() or 1
+        # messages go in as one buffer of fixed width ones
+        m_size = max((m.bit_length() + 7) // 8 for m, _ in requests) or 1
+        m_buf = b"".join(m.to_bytes(m_size, "big") for m, _ in requests)
+        faults = (ctypes.c_ulong * n)(*(f for _, f in requests))
+        c_buf = ctypes.create_string_buffer(n * self.c_size)
+        cycles = (ctypes.c_ulong * n)()
+        size = self.lib.copro_signer_sign_batch(self.signer, m_buf, m_size, n, faults, n,
+                                                c_buf, self.c_size, cycles, n_threads)
+        assert(size == self.c_size)
+        raw = c_buf.raw
+        return [(int.from_bytes(raw[i*size:(i+1)*size], "big"), cycles[i]) for i in range(n)]
+
+    def close(self):
+        if self.signer is not None:
+            self.lib.copro_signer_free(self.signer)
+            self.signer = None
+
+    def __call__(self, m, f=0):
+        return self.D(m, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -3,6 +3,12 @@
 #include <assert.h>
 #include <time.h>
 #include <stdlib.h>
+#include <string.h>
+#include "oracle_io.h"
+#include "copro_jobs.h"
+#ifndef _WIN32
+#include <unistd.h>
+#endif
 
 #define N_REGS 16
 #define P_ADR 0
@@ -22,181 +28,276 @@
 
 #define l 512
 
-unsigned long copro_clock;
-unsigned long f;
-mpz_t R[N_REGS];
+// one coprocessor, same as task2_in_c.c's: everything a run touches is in
+// here rather than in globals, so each thread can sign on its own context
+struct copro {
+    mpz_t R[N_REGS];
+    unsigned long clock;
+    unsigned long f; // the cycle to fault, 0 for none
+    unsigned long long rng; // copro_rng_next's state, so faults don't need rand()
+    mpz_t one, gcd, dummy; // loaded into ONE_ADR, and mul_inverse's outputs
+};
 
 /*
 All of these are pretty much identical to
 those found in task2_coprocessor.py
 */
 
-void copro_init() {
-    copro_clock = 0;
+void copro_init(struct copro *cp) {
+    // the registers are made once here and reused by every run on `cp`
+    cp->clock = 0;
+    cp->f = 0;
     for (int i=0; i<N_REGS; ++i) {
-        mpz_init(R[i]);
+        mpz_init(cp->R[i]);
     }
+    mpz_init_set_ui(cp->one, 1);
+    mpz_inits(cp->gcd, cp->dummy, NULL);
+    copro_rng_seed(&cp->rng, 0);
 }
 
-void copro_completeCycle(int reg) {
-    copro_clock++;
-    if (copro_clock == f) {
+void copro_clear(struct copro *cp) {
+    for (int i=0; i<N_REGS; ++i) {
+        mpz_clear(cp->R[i]);
+    }
+    mpz_clears(cp->one, cp->gcd, cp->dummy, NULL);
+}
+
+void copro_completeCycle(struct copro *cp, int reg) {
+    cp->clock++;
+    if (cp->clock == cp->f) {
         // flip a random bit
-        mpz_t flip_mask;
-        mpz_init(flip_mask);
-        mpz_setbit(flip_mask, rand()%l);
-        mpz_xor(R[reg], R[reg], flip_mask);
-        mpz_clear(flip_mask);
+        mpz_combit(cp->R[reg], copro_rng_next(&cp->rng)%l);
     }
 }
 
-void copro_add(int x, int y, int z, int N) {
-    mpz_add(R[x], R[y], R[z]);
-    mpz_mod(R[x], R[x], R[N]);
-    copro_completeCycle(x);
+void copro_add(struct copro *cp, int x, int y, int z, int N) {
+    mpz_add(cp->R[x], cp->R[y], cp->R[z]);
+    mpz_mod(cp->R[x], cp->R[x], cp->R[N]);
+    copro_completeCycle(cp, x);
 }
 
-void copro_sub(int x, int y, int z, int N) {
-    mpz_sub(R[x], R[y], R[z]);
-    mpz_mod(R[x], R[x], R[N]);
-    copro_completeCycle(x);
+void copro_sub(struct copro *cp, int x, int y, int z, int N) {
+    mpz_sub(cp->R[x], cp->R[y], cp->R[z]);
+    mpz_mod(cp->R[x], cp->R[x], cp->R[N]);
+    copro_completeCycle(cp, x);
 }
 
-void copro_mul(int x, int y, int z, int N, int dont_use_clock) {
-    mpz_mul(R[x], R[y], R[z]);
-    mpz_mod(R[x], R[x], R[N]);
+void copro_mul(struct copro *cp, int x, int y, int z, int N, int dont_use_clock) {
+    mpz_mul(cp->R[x], cp->R[y], cp->R[z]);
+    mpz_mod(cp->R[x], cp->R[x], cp->R[N]);
     if (dont_use_clock) {
         return;
     }
-    copro_completeCycle(x);
+    copro_completeCycle(cp, x);
 }
 
-void copro_mul_inverse(int x, int y, int N) {
-    mpz_t gcd, dummy;
-    mpz_init(gcd);
-    mpz_init(dummy);
-    mpz_gcdext(gcd, R[x], dummy, R[y], R[N]);
-    if (mpz_cmp_ui(gcd, 1) == 0) { // gcd == 1
-        mpz_mod(R[x], R[x], R[N]);
+void copro_mul_inverse(struct copro *cp, int x, int y, int N) {
+    mpz_gcdext(cp->gcd, cp->R[x], cp->dummy, cp->R[y], cp->R[N]);
+    if (mpz_cmp_ui(cp->gcd, 1) == 0) { // gcd == 1
+        mpz_mod(cp->R[x], cp->R[x], cp->R[N]);
     } else {
-        mpz_set_ui(R[x], 0);
+        mpz_set_ui(cp->R[x], 0);
     }
-
-    mpz_clear(dummy);
-    mpz_clear(gcd);
-    copro_completeCycle(x);
+    copro_completeCycle(cp, x);
 }
 
-void copro_add_inverse(int x, int y, int N) {
-    mpz_mod(R[y], R[y], R[N]);
-    mpz_sub(R[x], R[N], R[y]);
-    copro_completeCycle(x);
+void copro_add_inverse(struct copro *cp, int x, int y, int N) {
+    mpz_mod(cp->R[y], cp->R[y], cp->R[N]);
+    mpz_sub(cp->R[x], cp->R[N], cp->R[y]);
+    copro_completeCycle(cp, x);
 }
 
-void copro_copy_mod(int x, int y, int N) {
-    mpz_mod(R[x], R[y], R[N]);
-    copro_completeCycle(x);
+void copro_copy_mod(struct copro *cp, int x, int y, int N) {
+    mpz_mod(cp->R[x], cp->R[y], cp->R[N]);
+    copro_completeCycle(cp, x);
 }
 
-void copro_copy(int x, int y, int skip) {
-    mpz_set(R[x], R[y]);
+void copro_copy(struct copro *cp, int x, int y, int skip) {
+    mpz_set(cp->R[x], cp->R[y]);
     if (skip) {return;}
-    copro_completeCycle(x);
+    copro_completeCycle(cp, x);
 }
 
-void copro_load_immediate(int x, mpz_t *val) {
-    mpz_set(R[x], *val);
-    copro_completeCycle(x);
+void copro_load_immediate(struct copro *cp, int x, mpz_t *val) {
+    mpz_set(cp->R[x], *val);
+    copro_completeCycle(cp, x);
 }
 
-void copro_print_adr(int x) {
-    mpz_out_str(stdout, 10, R[x]);
+void copro_print_adr(struct copro *cp, int x) {
+    mpz_out_str(stdout, 10, cp->R[x]);
     printf("\n");
 }
 
-void pow_on_copro(int x, int y, int z, int N) {
+void pow_on_copro(struct copro *cp, int x, int y, int z, int N) {
     // uses left to right binary exp again
-    copro_copy(POW_ADR, ONE_ADR, 0);
-    copro_copy(POW_ADR2, y, 0);
+    copro_copy(cp, POW_ADR, ONE_ADR, 0);
+    copro_copy(cp, POW_ADR2, y, 0);
     for (int k=0; k<l; ++k) { // loop thru bits
-        if (mpz_tstbit(R[z], k) == 1) {
-            copro_mul(POW_ADR, POW_ADR, POW_ADR2, N, 1);
+        if (mpz_tstbit(cp->R[z], k) == 1) {
+            copro_mul(cp, POW_ADR, POW_ADR, POW_ADR2, N, 1);
         }
-        copro_mul(POW_ADR2, POW_ADR2, POW_ADR2, N, 1);
-        copro_completeCycle(POW_ADR);
+        copro_mul(cp, POW_ADR2, POW_ADR2, POW_ADR2, N, 1);
+        copro_completeCycle(cp, POW_ADR);
     }
-    f = 999999;
-    copro_copy(x, POW_ADR, 1);
+    cp->f = 999999;
+    copro_copy(cp, x, POW_ADR, 1);
 }
 
-void rsaSign(mpz_t *p, mpz_t *q, mpz_t *N, mpz_t *d, mpz_t *m, mpz_t *c) {
+void rsaSign(struct copro *cp, mpz_t *p, mpz_t *q, mpz_t *N, mpz_t *d, mpz_t *m, mpz_t *c) {
     // "realistic" version
 
-    // initialisation and loading args into 'coprocessor'
-    copro_init();
+    // loading args into 'coprocessor'
+    // (registers are initialised once by copro_init)
+    cp->clock = 0;
 
-    copro_load_immediate(N_ADR, N);
-    copro_load_immediate(D_ADR, d);
-    copro_load_immediate(M_ADR, m);
+    copro_load_immediate(cp, N_ADR, N);
+    copro_load_immediate(cp, D_ADR, d);
+    copro_load_immediate(cp, M_ADR, m);
 
-    mpz_t one;
-    mpz_init_set_ui(one, 1);
-    copro_load_immediate(ONE_ADR, &one);
-    mpz_clear(one);
+    copro_load_immediate(cp, ONE_ADR, &cp->one);
 
     // compute c = m^d (mod N)
-    pow_on_copro(C_ADR, M_ADR, D_ADR, N_ADR);
+    pow_on_copro(cp, C_ADR, M_ADR, D_ADR, N_ADR);
 
-    mpz_set(*c, R[C_ADR]);
+    mpz_set(*c, cp->R[C_ADR]);
 }
 
-int main() {
-    srand(time(NULL));
-    int i;
-    for (int j=0; j<3; ++j) {
-        int stop = 10+rand()%100;
-        for (i=0; i<stop; ++i) {
-            rand();
-        }
-    }
+// threaded signing with copro_jobs.h: these sign on a struct copro per thread
+struct sign_args {
+    mpz_t *p, *q, *N, *d;
+};
+
+void *copro_job_ctx_new(struct copro_jobs *jobs) {
+    (void)jobs;
+    struct copro *cp = malloc(sizeof(struct copro));
+    assert(cp != NULL);
+    copro_init(cp);
+    return cp;
+}
+
+unsigned long copro_job_sign(struct copro_jobs *jobs, void *ctx, unsigned long long seed,
+                             unsigned long fault, mpz_t *m, mpz_t *c) {
+    struct sign_args *args = jobs->arg;
+    struct copro *cp = ctx;
+    copro_rng_seed(&cp->rng, seed);
+    cp->f = fault;
+    rsaSign(cp, args->p, args->q, args->N, args->d, m, c);
+    return cp->clock;
+}
+
+void copro_job_ctx_free(void *ctx) {
+    copro_clear(ctx);
+    free(ctx);
+}
+
+#ifdef COPRO_LIB
+/*
+Shared library build, for use in-process through task2_lib.py:
+    gcc -shared -fPIC -DCOPRO_LIB -O2 task2_nonCRT.c -o task2_nonCRT.so -lgmp -lpthread
+(also `make lib prog=task2_nonCRT`)
+the stable API is copro_seed and the copro_signer_* functions below,
+numbers go in and out as big-endian unsigned byte buffers
+*/
+struct copro_signer {
+    mpz_t p, q, N, d, m, c;
+    struct copro copro; // its own registers, so signers can be used from different threads
+};
+
+unsigned long long copro_next_seed = 0; // for the next signer's faults
+
+void copro_seed(unsigned int seed) {
+    copro_next_seed = seed;
+}
+
+struct copro_signer *copro_signer_new(const unsigned char *p, size_t p_len, const unsigned char *q, size_t q_len,
+                                      const unsigned char *N, size_t N_len, const unsigned char *d, size_t d_len, int crt,
+                                      const char *pow_method, int window) {
+    // the key is imported once, like server mode reading it once in main
+    struct copro_signer *signer = malloc(sizeof(struct copro_signer));
+    copro_init(&signer->copro);
+    copro_rng_seed(&signer->copro.rng, copro_next_seed++);
+    mpz_inits(signer->p, signer->q, signer->N, signer->d, signer->m, signer->c, NULL);
+    mpz_import(signer->p, p_len, 1, 1, 1, 0, p);
+    mpz_import(signer->q, q_len, 1, 1, 1, 0, q);
+    mpz_import(signer->N, N_len, 1, 1, 1, 0, N);
+    mpz_import(signer->d, d_len, 1, 1, 1, 0, d);
+    // no CRT or other exponentiations here, kept so both libraries have the same API
+    (void)crt;
+    (void)pow_method;
+    (void)window;
+    return signer;
+}
+
+long copro_signer_sign(struct copro_signer *signer, const unsigned char *m, size_t m_len,
+                       unsigned long fault, unsigned char *c, size_t c_size, unsigned long *cycles) {
+    // signs m with a fault at cycle `fault` (0 for none)
+    // c is written as exactly c_size bytes, zero padded on the left
+    // returns c_size, or -1 if c doesn't fit
+    mpz_import(signer->m, m_len, 1, 1, 1, 0, m);
+    signer->copro.f = fault;
+    rsaSign(&signer->copro, &signer->p, &signer->q, &signer->N, &signer->d, &signer->m, &signer->c);
+    *cycles = signer->copro.clock;
+    return export_padded(signer->c, c, c_size);
+}
+
+long copro_signer_sign_batch(struct copro_signer *signer, const unsigned char *m, size_t m_size, size_t n_m,
+                             const unsigned long *faults, size_t n, unsigned char *c, size_t c_size,
+                             unsigned long *cycles, int n_threads) {
+    // same as task2_in_c.c's: n signatures with faults[i] on n_threads threads
+    // returns c_size, or -1 if a signature doesn't fit
+    struct sign_args args = {&signer->p, &signer->q, &signer->N, &signer->d};
+    struct copro_jobs jobs = {
+        .faults = faults, .n_jobs = n, .seed = copro_rng_next64(&signer->copro.rng), .arg = &args,
+        .ctx_new = copro_job_ctx_new, .sign = copro_job_sign, .ctx_free = copro_job_ctx_free,
+    };
+    return copro_sign_batch(&jobs, m, m_size, n_m, c, c_size, cycles, n_threads);
+}
+
+void copro_signer_free(struct copro_signer *signer) {
+    copro_clear(&signer->copro);
+    mpz_clears(signer->p, signer->q, signer->N, signer->d, signer->m, signer->c, NULL);
+    free(signer);
+}
+#else
+
+
+int main(int argc, char **argv) {
+    struct copro cp;
+    copro_init(&cp);
+#ifndef _WIN32
+    copro_rng_seed(&cp.rng, time(NULL) ^ (unsigned long long)getpid() << 32); // so workers started together don't flip the same bits
+#else
+    copro_rng_seed(&cp.rng, time(NULL));
+#endif
+
+    // server mode (`-s`): p, q, N, d are read once, then (m, f) pairs
+    // are signed one after the other until stdin is closed
+    // binary mode (`-b`): see oracle_io.h
+    int server = argc > 1 && strcmp(argv[1], "-s") == 0;
+    oracle_io_init(argc, argv);
 
     mpz_t p, q, N, e, d, m, f_mpz, c;
-    mpz_inits(p, q, N, e, d, m, f_mpz, c);
-
-    char inputStr[1024];
-    int flag; // for parsing str to mpz_t
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(p, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(q, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(N, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(d, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(m, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(f_mpz, inputStr, 10);
-    assert(flag == 0);
-
-    f = mpz_get_ui(f_mpz);
-
-    rsaSign(&p, &q, &N, &d, &m, &c);
-    mpz_out_str(stdout, 10, c);
-    printf("\n%d\n", copro_clock);
-
-    mpz_clear(p);
-    mpz_clear(q);
-    mpz_clear(N);
-    mpz_clear(e);
-    mpz_clear(d);
-    mpz_clear(m);
-    mpz_clear(f_mpz);
+    mpz_inits(p, q, N, e, d, m, f_mpz, c, NULL);
+
+    if (!read_mpz(p) || !read_mpz(q) || !read_mpz(N) || !read_mpz(d)) {
+        return 1;
+    }
+
+    do {
+        if (!read_mpz(m) || !read_mpz(f_mpz)) {
+            break;
+        }
+        cp.f = mpz_get_ui(f_mpz);
+
+        rsaSign(&cp, &p, &q, &N, &d, &m, &c);
+        write_mpz(c, '\n');
+        write_ui(cp.clock, '\n');
+        fflush(stdout);
+    } while (server);
+
+    mpz_clears(p, q, N, e, d, m, f_mpz, c, NULL);
+    copro_clear(&cp);
 
     return 0;
-}
\ No newline at end of file
+}
+#endif
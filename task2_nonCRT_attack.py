@@ -1,6 +1,9 @@
-from subprocess import Popen, PIPE
 from task1 import rsa_keygen, check_rsa_sign
+from oracle_client import OracleClient
+from task2_nonCRT_verify import BitVerifier, PrefixState
+from journal import Journal, check_key, journaled_keygen, recovered_bits
 import random
+import sys
 import time
 import math as maths
 import itertools
@@ -18,54 +21,143 @@ def moduloMultiplication(a, b, mod):
         b >>= 1
     return res
 
-def attack2(D, N, e):
+def attack2(D, N, e, journal=None):
+    # with a `journal` (see journal.py) each digit is recorded as it is
+    # found, and a rerun on the same journal starts after the last one
     d_known = ""
+    if journal is not None:
+        check_key(journal, N, e)
+        done = recovered_bits(journal)
+        d_known = "".join(str(done[pos]) for pos in range(n-1, n-1-len(done), -1))
     _, t0 = D(random.randint(2, N), 0)
+    verifier = BitVerifier(N, e, n)
     print("finding d...")
     start_time = time.perf_counter()
     times_passed = 0
-    for i in range(n):
-        broke = False
+    calls = 0
+    for i in range(len(d_known), n):
+        # one faulty signature is enough to test both guesses for the next digit:
+        # they only differ by a factor of m^(2^pos) so m^w is only computed once
+        pos = n - len(d_known) - 1
+        m = random.randint(2, N)
+        S_hat, _ = D(m, t0-len(d_known)-1)
+        mw = {"0": pow(m, int(d_known.ljust(n, "0"), 2), N)}
+        mw["1"] = (mw["0"] * pow(m, 1 << pos, N)) % N
         digits = ["0", "1"]
         random.shuffle(digits)
-        for extra in digits:
-            d_known_pow = int((d_known+extra).ljust(n, "0"), 2)
-            # print(f"d_known_pow = {bin(d_known_pow)[2:].zfill(n)}")
-            m = random.randint(2, N)
-            S_hat, _ = D(m, t0-len(d_known)-1)
-            # instead of doing this:
-            # passed = False
-            # temp = pow(m, d_known_pow, N)
-            # for b in range(n):
-            #     q = moduloMultiplication(1<<b, temp, N)
-            #     X = S_hat + q
-            #     Y = S_hat - q
-            #     if pow(X, e, N) == m or pow(Y, e, N) == m:
-            #         passed = True
-            #         break
-            
-            # , use the c file which does it MUCH faster
-            with Popen('task2_nonCRT_speedup.exe', stdin=PIPE, stdout=PIPE, universal_newlines=True) as prog:
-                print(m,           file=prog.stdin, flush=True)
-                print(d_known_pow, file=prog.stdin, flush=True)
-                print(N,           file=prog.stdin, flush=True)
-                print(S_hat,       file=prog.stdin, flush=True)
-                print(e,           file=prog.stdin, flush=True)
-                passed = bool(int((prog.stdout.readline())))
-            if passed: 
-                d_known = d_known + extra
-                print(f"{d_known}...({n-i})")
-                broke = True
-                break
-        if broke: continue
+        passed = verifier.check_batch([(m, mw[extra], S_hat) for extra in digits])
+        calls += 1
+        if passed != -1:
+            d_known = d_known + digits[passed]
+            if journal is not None:
+                journal.append("bit", pos=pos, bit=int(digits[passed]), calls=calls)
+            calls = 0
+            print(f"{d_known}...({n-i})")
+            continue
         print("couldn't find d-digit")
     end_time = time.perf_counter()
     print(f"Took {end_time-start_time} seconds")
     return int(d_known, 2)
 
 
-def attack(D, N, e):
-    return attack2(D, N, e)
+def attack_incremental(D, N, e, n_messages=4, max_retries=8, journal=None):
+    # like attack2, but with a fixed set of messages that are each signed
+    # once without a fault, so checking a guess is a modmul (see PrefixState)
+    # and the whole key is recovered with ~1 oracle call per bit
+    # with a `journal` (see journal.py) the messages and each digit are
+    # recorded, and a rerun on the same journal carries on from the last digit
+    saved = None
+    done = {}
+    if journal is not None:
+        check_key(journal, N, e)
+        saved = journal.last("messages")
+        done = recovered_bits(journal)
+    if saved is not None:
+        t0 = saved["t0"]
+        states = [PrefixState(m, S, N, n) for m, S in saved["signatures"]]
+    else:
+        states = []
+        for _ in range(n_messages):
+            m = random.randint(2, N-1)
+            S, t0 = D(m, 0)
+            states.append(PrefixState(m, S, N, n))
+        if journal is not None:
+            journal.append("messages", t0=t0, signatures=[[state.m, state.S] for state in states])
+    n_messages = len(states)
+    print("finding d...")
+    start_time = time.perf_counter()
+    d_known = 0
+    # the fault for the last digit would hit the copy of m rather than the
+    # accumulator, so digits go down to 1 and digit 0 is found at the end
+    for pos in range(n-1, 0, -1):
+        if pos in done:
+            for state in states:
+                state.push(pos, done[pos])
+            d_known |= done[pos] << pos
+            continue
+        f = t0 - (n-1-pos) - 1
+        bits = []
+        for attempt in range(max_retries):
+            state = states[(pos + attempt) % n_messages]
+            S_hat, _ = D(state.m, f)
+            bits = [bit for bit in (0, 1) if state.passes(pos, bit, S_hat)]
+            if len(bits) == 1:
+                break
+        if len(bits) != 1:
+            print(f"couldn't find d-digit {pos}")
+            bits = [0]
+        for state in states:
+            state.push(pos, bits[0])
+        d_known |= bits[0] << pos
+        if journal is not None:
+            journal.append("bit", pos=pos, bit=bits[0], calls=attempt+1)
+    # the last digit is whichever gives back a known signature
+    if pow(states[0].m, d_known, N) != states[0].S:
+        d_known |= 1
+    end_time = time.perf_counter()
+    print(f"Took {end_time-start_time} seconds")
+    return d_known
+
+
+async def async_attack(oracle, N, e, n_messages=4, max_retries=8):
+    # attack_incremental with an async_oracle_client.AsyncOracleClient:
+    # the faulty signature for each digit doesn't depend on the digits
+    # found before it, so the first try at every digit is asked for in one
+    # batch over all the workers, and only retries wait on a single call
+    messages = [random.randint(2, N-1) for _ in range(n_messages)]
+    replies = await oracle.D_batch([(m, 0) for m in messages])
+    states = [PrefixState(m, S, N, n) for m, (S, _) in zip(messages, replies)]
+    t0 = replies[0][1]
+    print("finding d...")
+    start_time = time.perf_counter()
+    positions = range(n-1, 0, -1)
+    fs = {pos: t0 - (n-1-pos) - 1 for pos in positions}
+    first_tries = await oracle.D_batch([(states[pos % n_messages].m, fs[pos]) for pos in positions])
+    d_known = 0
+    for pos, (S_hat, _) in zip(positions, first_tries):
+        state = states[pos % n_messages]
+        bits = [bit for bit in (0, 1) if state.passes(pos, bit, S_hat)]
+        for attempt in range(1, max_retries):
+            if len(bits) == 1:
+                break
+            state = states[(pos + attempt) % n_messages]
+            S_hat, _ = await oracle.D(state.m, fs[pos])
+            bits = [bit for bit in (0, 1) if state.passes(pos, bit, S_hat)]
+        if len(bits) != 1:
+            print(f"couldn't find d-digit {pos}")
+            bits = [0]
+        for state in states:
+            state.push(pos, bits[0])
+        d_known |= bits[0] << pos
+    if pow(states[0].m, d_known, N) != states[0].S:
+        d_known |= 1
+    end_time = time.perf_counter()
+    print(f"Took {end_time-start_time} seconds")
+    return d_known
+
+
+def attack(D, N, e, journal=None):
+    return attack_incremental(D, N, e, journal=journal)
     m = 8 # choose 1 <= m <= n
     l = maths.ceil((n/m) * maths.log2(2*n))
     # get the length of computation
@@ -83,6 +175,7 @@ def attack(D, N, e):
     fs.sort(key = lambda q: -q[0])
     print(fs)
     print("done")
+    verifier = BitVerifier(N, e, n)
     k = [0 for _ in range(n)]
     d = ["_" for _ in range(n)]
     i = n+1
@@ -103,34 +196,9 @@ def attack(D, N, e):
                 for j in range(a-r, a):
                     w += int(bin_u[j])*(1 << j)
                 print(f"\tTrying w = {bin(w)[2:].zfill(n)}")
-                any_messages_pass = False
-                for j in range(l):
-                    Sj = S_hat[j]
-                    Mj = M[j]
-                    
-                    if j%64 == 0: print(f"\t\tTrying j={j}/{l}")
-                    # for b in range(n+1):
-                    #     q = ((2**b)*pow(Mj, w, N))%N
-                    #     X = Sj + q
-                    #     Y = Sj - q
-                    #     if (pow(X, e, N) == Mj):
-                    #         any_messages_pass = True
-                    #         break
-                    #     if (pow(Y, e, N) == Mj):
-                    #         any_messages_pass = True
-                    #         break
-                    # if any_messages_pass: break
-
-                    with Popen('task2_nonCRT_speedup.exe', stdin=PIPE, stdout=PIPE, universal_newlines=True) as prog:
-                        print(Mj,    file=prog.stdin, flush=True)
-                        print(w,     file=prog.stdin, flush=True)
-                        print(N,     file=prog.stdin, flush=True)
-                        print(Sj, file=prog.stdin, flush=True)
-                        print(e,     file=prog.stdin, flush=True)
-                        passed = bool(int((prog.stdout.readline())))
-                    if passed: 
-                        any_messages_pass = True
-                        break
+                # check every message in one batch, stopping at the first that passes
+                candidates = [(M[j], pow(M[j], w, N), S_hat[j]) for j in range(l)]
+                any_messages_pass = verifier.check_batch(candidates) != -1
                 
                 if any_messages_pass:
                     print("this u works!!!!!")
@@ -161,25 +229,27 @@ def check_rsa_sign(sign_func, n_checks=1000):
     print("rsa_sign passed checks")
 
 if __name__ == "__main__":
-    p, q, N, e, d = rsa_keygen(n)
-
-    def D(m, f):
-        with Popen('task2_nonCRT.exe', stdin=PIPE, stdout=PIPE, universal_newlines=True) as prog:
-            print(p, file=prog.stdin, flush=True)
-            print(q, file=prog.stdin, flush=True)
-            print(N, file=prog.stdin, flush=True)
-            print(d, file=prog.stdin, flush=True)
-            print(m, file=prog.stdin, flush=True)
-            print(f, file=prog.stdin, flush=True)
-            c = int(prog.stdout.readline())
-            time = int(prog.stdout.readline())
-        return c, time
+    # python task2_nonCRT_attack.py [journal]
+    # with a journal, the key and every digit found are kept in it, so an
+    # interrupted run can be started again with the same journal to resume
+    journal = Journal(sys.argv[1]) if len(sys.argv) > 1 else None
+    if journal is not None:
+        p, q, N, e, d = journaled_keygen(journal, lambda: rsa_keygen(n))
+    else:
+        p, q, N, e, d = rsa_keygen(n)
+
+    # one long lived task2_nonCRT.exe for every call to D
+    oracle = OracleClient('task2_nonCRT.exe', p, q, N, d)
+    D = oracle.D
 
     # check_rsa_sign(lambda *args, **kwargs: D(*args, **kwargs)[0])
 
     print(f"true d: {bin(d)[2:].zfill(n)}")
-    d2 = attack(D, N, e)
+    d2 = attack(D, N, e, journal)
     if d == d2:
         print("Attack successful")
     else:
-        print("Attack failed")
\ No newline at end of file
+        print("Attack failed")
+    oracle.close()
+    if journal is not None:
+        journal.close()
\ No newline at end of file
@@ -3,6 +3,7 @@
 #include <assert.h>
 #include <time.h>
 #include <stdlib.h>
+#include "oracle_io.h"
 
 #define n 512
 
@@ -30,33 +31,18 @@ void doBCalc(mpz_t m, mpz_t d_known, mpz_t N, mpz_t S_hat, mpz_t e) {
         mpz_mul_ui(b, b, 2);
     }
     mpz_clears(a, q, b, exp, NULL);
-    printf("%d", pass);
+    write_ui(pass, '\n');
 }
 
-int main() {
+int main(int argc, char **argv) {
+    oracle_io_init(argc, argv);
     mpz_t m, d_known, N, S_hat, e;
     mpz_inits(m, d_known, N, S_hat, e, NULL);
 
-    char inputStr[1024];
-    int flag; // for parsing str to mpz_t
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(m, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(d_known, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(N, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(S_hat, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(e, inputStr, 10);
-    assert(flag == 0);
+    int flag = read_mpz(m) && read_mpz(d_known) && read_mpz(N) && read_mpz(S_hat) && read_mpz(e);
+    assert(flag);
 
     doBCalc(m, d_known, N, S_hat, e);
 
     mpz_clears(m, d_known, N, S_hat, e, NULL);
-    return 0;
-}
\ No newline at end of file
+}
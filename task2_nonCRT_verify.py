@@ -0,0 +1,97 @@
+from task1 import gcd_extended
+
+
+class BitVerifier:
+    """
+    in-process replacement for task2_nonCRT_speedup.exe
+
+    a fault flipping bit b of the accumulator of the right to left
+    exponentiation in task2_nonCRT.c gives a faulty signature
+        S_hat = S +- 2^b * m^w (mod N)
+    where w is the part of d above the faulted step, so a guess of w is
+    right if (S_hat -+ 2^b * m^w)^e == m (mod N) for some b
+    """
+    N: int
+    e: int
+    shifts: list[int]
+
+    def __init__(self, N, e, n_bits) -> None:
+        self.N = N
+        self.e = e
+        # 2^b (mod N) for every bit b the fault could have flipped
+        self.shifts = [(1 << b) % N for b in range(n_bits)]
+
+    def check(self, m, mw, S_hat):
+        """
+        does S_hat come from a fault under the guess with m^w == `mw` (mod N)?
+        """
+        return self.check_batch([(m, mw, S_hat)]) == 0
+
+    def check_batch(self, candidates):
+        """
+        `candidates` is a list of (m, m^w (mod N), S_hat)
+        returns the index of a candidate that passes, or -1 if none do
+
+        every candidate is tried at bit b before any is tried at bit b+1,
+        so the search stops as soon as the right one is found rather than
+        trying all n bits of each wrong candidate first
+        """
+        N, e = self.N, self.e
+        for shift in self.shifts:
+            for i, (m, mw, S_hat) in enumerate(candidates):
+                q = (shift * mw) % N
+                if pow(S_hat + q, e, N) == m or pow(S_hat - q, e, N) == m:
+                    return i
+        return -1
+
+
+class PrefixState:
+    """
+    running state for recovering d from the top bit down with a message `m`
+    that is reused for every bit, and whose fault-free signature `S` is known
+
+    since S_hat - S == +-2^b * m^w (mod N), a guess of w is right exactly when
+    (S_hat - S) * m^-w (mod N) is +-2^b, so no e'th powers are needed;
+    m^-w is kept as m^-prefix (the bits of d found so far, in place) and
+    a table of m^-(2^j), so each bit costs one modmul instead of a full
+    exponentiation
+    """
+    m: int
+    S: int
+    N: int
+    n_bits: int
+    inv_squares: list[int]
+    prefix_inv: int
+
+    def __init__(self, m, S, N, n_bits) -> None:
+        self.m = m
+        self.S = S
+        self.N = N
+        self.n_bits = n_bits
+        m_inv, _, gcd = gcd_extended(m, N)
+        assert(gcd == 1)
+        # inv_squares[j] = m^-(2^j) (mod N), by repeated squaring
+        self.inv_squares = [m_inv % N]
+        for _ in range(n_bits - 1):
+            self.inv_squares.append(self.inv_squares[-1]**2 % N)
+        self.prefix_inv = 1
+
+    def passes(self, pos, bit, S_hat):
+        """
+        is `bit` the digit of d at `pos`, given the faulty signature `S_hat`
+        of `m` whose fault was just before the step for `pos`?
+        """
+        mw_inv = self.prefix_inv * self.inv_squares[pos] % self.N if bit else self.prefix_inv
+        delta = (S_hat - self.S) * mw_inv % self.N
+        return self.__is_shift(delta) or self.__is_shift(self.N - delta)
+
+    def __is_shift(self, x):
+        # x == 2^b for some bit b the fault could have flipped
+        return x != 0 and x & (x-1) == 0 and x.bit_length() <= self.n_bits
+
+    def push(self, pos, bit):
+        """
+        records that the digit of d at `pos` is `bit`
+        """
+        if bit:
+            self.prefix_inv = self.prefix_inv * self.inv_squares[pos] % self.N
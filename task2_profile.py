@@ -0,0 +1,175 @@
+from task1 import rsa_keygen
+import collections
+import json
+import random
+import sys
+import time
+
+# Coprocessor ops a Profiler records -> indices of their register operands
+# (None for load_immediate, whose operand is the value it loads)
+PROFILED_OPS = {
+    "add": (1, 2),
+    "sub": (1, 2),
+    "mul": (1, 2),
+    "mul_inverse": (1,),
+    "add_inverse": (1,),
+    "copy_mod": (1,),
+    "to_mont": (1,),
+    "from_mont": (1,),
+    "mont_mul": (1, 2),
+    "load_immediate": None,
+}
+
+
+class OpStats:
+    """
+    what a Profiler saw of one op: how many times it ran, the wall time
+    it took in total, and how many operands of each bit length it read
+    """
+    count: int
+    seconds: float
+    bits: collections.Counter
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.seconds = 0.0
+        self.bits = collections.Counter()
+
+
+class Profiler:
+    """
+    opt-in instrumentation for a Coprocessor, made with `profiler=`
+    - `ops[name]` is the OpStats of each op in PROFILED_OPS
+    - `phases[name]` is [runs, cycles, seconds] of each phase of a program
+    - hooks added with `add_hook` are called as hook(phase, coprocessor)
+      on entering each phase, and with a phase of None at the end of a run
+
+    only the coprocessors given a profiler have their ops wrapped, so the
+    others (and the compiled interpreter in task2.py) pay nothing for it
+    """
+    ops: dict[str, OpStats]
+    phases: dict[str, list]
+
+    def __init__(self) -> None:
+        self.ops = {name: OpStats() for name in PROFILED_OPS}
+        self.phases = {}
+        self.hooks = []
+        self.__phase = None
+        self.__phase_clock = 0
+        self.__phase_start = 0.0
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def attach(self, copro):
+        """
+        replaces each op of `copro` (just on that instance) with one that
+        records it
+        """
+        for name, operands in PROFILED_OPS.items():
+            setattr(copro, name, self.__wrap(copro, getattr(copro, name), self.ops[name], operands))
+
+    @staticmethod
+    def __wrap(copro, op, stats, operands):
+        perf_counter = time.perf_counter
+        def profiled(*args):
+            if operands is None:
+                stats.bits[args[1].bit_length()] += 1
+            else:
+                for i in operands:
+                    stats.bits[copro.R[args[i]].bit_length()] += 1
+            start = perf_counter()
+            op(*args)
+            stats.seconds += perf_counter() - start
+            stats.count += 1
+        return profiled
+
+    def enter_phase(self, phase, copro):
+        """
+        called by task2.run_program before each instruction (and with None
+        after the last one), does nothing unless the phase has changed
+        """
+        if phase == self.__phase:
+            return
+        now = time.perf_counter()
+        if self.__phase is not None:
+            stats = self.phases.setdefault(self.__phase, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += copro.clock - self.__phase_clock
+            stats[2] += now - self.__phase_start
+        for hook in self.hooks:
+            hook(phase, copro)
+        self.__phase = phase
+        self.__phase_clock = copro.clock
+        self.__phase_start = time.perf_counter()
+
+    def histogram(self):
+        """
+        the profile as a dict ready for JSON, in the same layout as the
+        one task2_in_c.c writes when built with PROFILE 1
+        """
+        return {
+            "model": "python",
+            "ops": {
+                name: {
+                    "count": stats.count,
+                    "seconds": stats.seconds,
+                    "bits": {str(b): n for b, n in sorted(stats.bits.items())},
+                }
+                for name, stats in self.ops.items() if stats.count
+            },
+            "phases": {
+                name: {"runs": runs, "cycles": cycles, "seconds": seconds}
+                for name, (runs, cycles, seconds) in self.phases.items()
+            },
+        }
+
+    def write(self, path):
+        with open(path, "w") as file:
+            json.dump(self.histogram(), file, indent=2)
+
+
+def load_histogram(path):
+    """
+    reads a histogram written by `Profiler.write` or by task2_in_c.c
+    """
+    with open(path) as file:
+        return json.load(file)
+
+
+def format_histogram(hist):
+    """
+    the ops and phases of `hist` as a table, slowest first
+    """
+    lines = [f"{hist['model']} model"]
+    total = sum(op["seconds"] for op in hist["ops"].values()) or 1.0
+    for name, op in sorted(hist["ops"].items(), key=lambda item: -item[1]["seconds"]):
+        bits = {int(b): n for b, n in op["bits"].items()}
+        widest = max(bits) if bits else 0
+        lines.append(f"{name:>16}: {op['count']:>9} calls {1000*op['seconds'] :>10.3f}ms "
+                     f"({100*op['seconds']/total :5.1f}%), widest operand {widest} bits")
+    for name, phase in hist["phases"].items():
+        lines.append(f"{name:>16}: {phase['runs']:>9} runs  {1000*phase['seconds'] :>10.3f}ms "
+                     f"{phase['cycles']/phase['runs'] :>9.1f} cycles per run")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    # python task2_profile.py [n_signs] [out.json]
+    #   profiles task2.rsa_sign (and its montgomery version)
+    # python task2_profile.py <histogram.json>
+    #   prints a histogram, e.g. from task2_in_c.c built with PROFILE 1
+    if len(sys.argv) > 1 and sys.argv[1].endswith(".json"):
+        print(format_histogram(load_histogram(sys.argv[1])))
+    else:
+        from task2 import rsa_sign
+        n_signs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+        l = 1024
+        p, q, N, e, d = rsa_keygen(l, verbosity=0, n_checks=1)
+        for montgomery in (False, True):
+            profiler = Profiler()
+            for _ in range(n_signs):
+                rsa_sign(p, q, N, d, l, random.randint(2, N-1), montgomery=montgomery, profiler=profiler)
+            print(format_histogram(profiler.histogram()))
+            if len(sys.argv) > 2 and not montgomery:
+                profiler.write(sys.argv[2])
@@ -0,0 +1,275 @@
+from task1 import gcd_extended
+from task2 import RSA_SIGN_PROGRAM, MONT_ADR, B_ADR
+import functools
+import math
+import random
+
+# the models a cycle map can be made for, they only differ in what a "pow" costs
+# ("c" is task2_in_c.c, whose pow_on_copro works in its own register,
+# "c_full", "c_kary", ... are the same with `-p full`, `-p kary`, ...,
+# and the windowed ones can be given `-W` too, e.g. "c_sliding:5")
+MODELS = ("python", "montgomery", "c", "c_full", "c_kary", "c_sliding", "c_ladder")
+C_POW_ADR = 12
+C_POW_TMP_ADR = 15
+C_TABLE_ADR = 16
+C_WINDOW = 4 # task2_in_c.c's default `-W`
+
+
+def pow_writes(x, n_bits, weight, model="python"):
+    """
+    registers written on each cycle of a "pow" into `x`, for an exponent of
+    `n_bits` bits with `weight` of them set
+    """
+    if model == "python":
+        # load_immediate, then a square per bit and a mul per set bit
+        return [x] * (1 + n_bits + weight)
+    if model == "montgomery":
+        # same as python, plus converting m and 1 in and the result back out
+        return [MONT_ADR] + [x] * (2 + n_bits + weight + 1)
+    if model == "c" or model == "c_full":
+        # copy 1 into POW_ADR, the square and mul loop, copy into x
+        # (`-p full` always loops over bits 1024..0)
+        if model == "c_full":
+            n_bits = 1025
+        return [C_POW_ADR] * (1 + n_bits + weight) + [x]
+    raise ValueError(f"unknown model {model}")
+
+
+def c_pow_writes(x, e, method, k=C_WINDOW):
+    """
+    registers written on each cycle of task2_in_c.c's pow_on_copro into `x`
+    with exponent `e` and `-p method -W k`, for the schedules whose cost
+    depends on the exponent's bit pattern rather than just its weight
+    """
+    n_bits = max(e.bit_length(), 1)
+    if method == "ladder":
+        # copy 1 and y in, then a mul and a square per bit
+        writes = [C_POW_ADR, C_POW_TMP_ADR]
+        for bit in bin(e)[2:]:
+            writes += [C_POW_ADR, C_POW_TMP_ADR] if bit == "1" else [C_POW_TMP_ADR, C_POW_ADR]
+        return writes + [x]
+    if method == "kary":
+        # the table of y^2 .. y^(2^k - 1), copy the top digit's power in,
+        # then k squares and a mul (unless the digit is 0) per digit
+        writes = [C_TABLE_ADR + v for v in range(2, 1 << k)] + [C_POW_ADR]
+        for i in range((n_bits + k - 1) // k - 2, -1, -1):
+            digit = (e >> (i*k)) & ((1 << k) - 1)
+            writes += [C_POW_ADR] * (k + (digit != 0))
+        return writes + [x]
+    if method == "sliding":
+        # y^2 and the odd powers, then a square per 0 bit and a run of
+        # squares and a mul per window (the first window is copied in)
+        writes = [C_POW_TMP_ADR] + [C_TABLE_ADR + v for v in range(1, 1 << (k-1))] if k > 1 else []
+        started = False
+        i = n_bits - 1
+        while i >= 0:
+            if not e >> i & 1:
+                writes += [C_POW_ADR] * started
+                i -= 1
+                continue
+            t = max(i - k + 1, 0)
+            while not e >> t & 1:
+                t += 1
+            writes += [C_POW_ADR] * (i - t + 2) if started else [C_POW_ADR]
+            started = True
+            i = t - 1
+        if not started:
+            writes.append(C_POW_ADR)
+        return writes + [x]
+    raise ValueError(f"unknown method {method}")
+
+
+# the models whose "pow" cost depends on more than the exponent's length and weight
+WINDOWED_MODELS = ("c_kary", "c_sliding", "c_ladder")
+
+
+def windowed(model):
+    """
+    (method, window) of a windowed model like "c_sliding:5", None for the others
+    """
+    name, _, window = model.partition(":")
+    if name not in WINDOWED_MODELS:
+        return None
+    return name[2:], int(window) if window else C_WINDOW
+
+
+def exponent_writes(x, e, model="python"):
+    """
+    registers written on each cycle of a "pow" into `x` with exponent `e`
+    """
+    if windowed(model) is not None:
+        return c_pow_writes(x, e, *windowed(model))
+    return pow_writes(x, e.bit_length(), bin(e).count("1"), model)
+
+
+def shape_writes(x, n_bits, weight, model="python"):
+    """
+    `pow_writes` for any model, where the windowed ones stand in an
+    exponent of that shape with its set bits spread evenly
+    """
+    if windowed(model) is None:
+        return pow_writes(x, n_bits, weight, model)
+    e = 0
+    if n_bits > 0 and weight > 0:
+        step = n_bits / weight
+        e = sum(1 << (n_bits - 1 - int(i*step)) for i in range(weight))
+    return exponent_writes(x, e, model)
+
+
+class CycleMap:
+    """
+    what a run of a program does on each clock cycle
+    cycles count from 1, like `Coprocessor.clock`
+    - `phases` is a list of (phase, first cycle, last cycle)
+    - `writes[t-1]` is the register written on cycle t
+    """
+    phases: list[tuple[str, int, int]]
+    writes: list[int]
+
+    def __init__(self) -> None:
+        self.phases = []
+        self.writes = []
+
+    def append(self, phase, writes):
+        """
+        adds the cycles writing `writes` to the end of `phase`
+        (starting a new phase if it isn't the last one)
+        """
+        if not writes:
+            return
+        first = len(self.writes) + 1
+        self.writes.extend(writes)
+        if self.phases and self.phases[-1][0] == phase:
+            first = self.phases[-1][1]
+            self.phases.pop()
+        self.phases.append((phase, first, len(self.writes)))
+
+    @property
+    def total_cycles(self):
+        return len(self.writes)
+
+    def phase_bounds(self, phase):
+        """
+        (first cycle, last cycle) of `phase`
+        """
+        for name, first, last in self.phases:
+            if name == phase:
+                return first, last
+        raise KeyError(phase)
+
+    def phase_of(self, t):
+        """
+        name of the phase cycle `t` is in
+        """
+        for name, first, last in self.phases:
+            if first <= t <= last:
+                return name
+        raise IndexError(t)
+
+    def last_write(self, phase, x):
+        """
+        last cycle of `phase` that writes register `x`
+        """
+        first, last = self.phase_bounds(phase)
+        for t in range(last, first-1, -1):
+            if self.writes[t-1] == x:
+                return t
+        raise KeyError((phase, x))
+
+
+def cycle_map(exponents, model="python", program=RSA_SIGN_PROGRAM, pad=0):
+    """
+    exact cycle map of `program` where the i'th "pow" uses `exponents[i]`
+    (for rsa_sign, d mod p-1 then d mod q-1)
+    `pad` cycles are added to (or if negative, taken off) the start of the
+    first "pow", see `estimated_cycle_map`
+    """
+    return _cycle_map([functools.partial(exponent_writes, e=e, model=model) for e in exponents],
+                      program, pad)
+
+
+def cycle_map_for(exponent_shapes, model="python", program=RSA_SIGN_PROGRAM, pad=0):
+    """
+    cycle map of `program` where the i'th "pow" has an exponent with
+    `exponent_shapes[i]` = (n_bits, weight)
+    """
+    return _cycle_map([functools.partial(shape_writes, n_bits=n_bits, weight=weight, model=model)
+                       for n_bits, weight in exponent_shapes], program, pad)
+
+
+def _cycle_map(pows, program, pad):
+    # `pows[i](x)` gives the writes of the i'th "pow"
+    cmap = CycleMap()
+    pows = iter(pows)
+    for phase, op, *operands in program:
+        if op == "pow":
+            writes = next(pows)(operands[0])
+            if pad != 0:
+                writes = writes[:1] * pad + writes if pad > 0 else writes[-pad:]
+                pad = 0
+            cmap.append(phase, writes)
+        else:
+            cmap.append(phase, [operands[0]])
+    return cmap
+
+
+def estimated_cycle_map(exp_len, total_cycles=None, model="python", program=RSA_SIGN_PROGRAM):
+    """
+    cycle map as seen by an attacker who only knows the exponents are about
+    `exp_len` bits long (e.g. half the length of N) and, optionally, the
+    `total_cycles` a fault-free run took
+    each exponent is assumed to have half its bits set; with `total_cycles`
+    the first "pow" absorbs the difference, so the end of the last "pow" and
+    everything after it are exact, while the boundaries between the pows
+    are only estimates
+    """
+    n_pows = sum(op == "pow" for _, op, *_ in program)
+    shapes = [(exp_len, exp_len//2) for _ in range(n_pows)]
+    if total_cycles is not None:
+        extra = total_cycles - cycle_map_for(shapes, model, program).total_cycles
+        n_bits, weight = shapes[0]
+        # keep the guess sensible: a weight can't go below 0 or above n_bits
+        weight = min(max(weight + extra, 0), n_bits)
+        n_bits += extra - (weight - shapes[0][1])
+        shapes[0] = (n_bits, weight)
+        # the windowed C schedules don't cost a cycle per bit, so whatever
+        # is left over is padded onto the start of the first "pow"
+        extra = total_cycles - cycle_map_for(shapes, model, program).total_cycles
+        return cycle_map_for(shapes, model, program, pad=extra)
+    return cycle_map_for(shapes, model, program)
+
+
+def fault_target(total_cycles, exp_len, model="python", program=RSA_SIGN_PROGRAM):
+    """
+    the cycle to fault to corrupt only b == m^(d mod q-1) (mod q) in
+    rsa_sign: its last write, just before the CRT recombination
+    """
+    cmap = estimated_cycle_map(exp_len, total_cycles, model, program)
+    return cmap.last_write("pow_q", B_ADR)
+
+
+def targeted_attack(D, N, e, model="python", program=RSA_SIGN_PROGRAM):
+    """
+    Bellcore attack that faults the one cycle from `fault_target`
+    rather than sweeping, so it only needs two calls to D:
+    one to learn the cycle count and one faulted signature
+    """
+    print("Beginning targeted attack!")
+    m = random.randint(2, N-1)
+    _, clock_cycles = D(m, 0)
+    f = fault_target(clock_cycles, N.bit_length()//2, model, program)
+    S_faulty, _ = D(m, f)
+
+    # https://link.springer.com/article/10.1007/s001450010016 (Lenstra's version)
+    p = math.gcd(m - pow(S_faulty, e, N), N)
+    q = N // p
+    assert(p*q == N and 1 < p < N)
+    print(f"\tFound p,q from a fault at cycle {f}/{clock_cycles}!")
+
+    # Find d to 'prove' we have broken in
+    phi_n = (p-1)*(q-1)
+    d, _, gcd = gcd_extended(e, phi_n)
+    assert(gcd == 1)
+    d %= phi_n
+    print("Finished attack!")
+    return d
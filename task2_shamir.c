@@ -3,6 +3,7 @@
 #include <assert.h>
 #include <time.h>
 #include <stdlib.h>
+#include "oracle_io.h"
 #include <x86intrin.h>
 
 #define l 1024
@@ -169,7 +170,8 @@ void rsaSign(mpz_t p, mpz_t q, mpz_t N, mpz_t d, mpz_t m, mpz_t q_inverse, mpz_t
 #endif
 }
 
-int main() {
+int main(int argc, char **argv) {
+    oracle_io_init(argc, argv);
     srand(time(NULL));
     int i;
     for (int j=0; j<3; ++j) {
@@ -188,23 +190,8 @@ int main() {
     rsaKeygen(p, q, N, e, d);
     printf("finished keygen\n");
 #else
-    char inputStr[1024];
-    int flag; // for parsing str to mpz_t
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(p, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(q, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(N, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(d, inputStr, 10);
-    assert(flag == 0);
-    scanf("%1023s" , inputStr);
-    flag = mpz_set_str(m, inputStr, 10);
-    assert(flag == 0);
+    int flag = read_mpz(p) && read_mpz(q) && read_mpz(N) && read_mpz(d) && read_mpz(m);
+    assert(flag);
 #endif
     unsigned long long start_time, end_time, total_time;
     // init rng
@@ -1,4 +1,4 @@
-from subprocess import Popen, PIPE
+from oracle_client import OracleClient
 from task1 import rsa_keygen
 from task2 import attack
 import random
@@ -8,17 +8,7 @@ if __name__ == "__main__":
     l = 1024
     p, q, N, e, d = rsa_keygen(l)
 
-    def D(m, f):
-        with Popen('task2_in_c.exe', stdin=PIPE, stdout=PIPE, universal_newlines=True) as prog:
-            print(p, file=prog.stdin, flush=True)
-            print(q, file=prog.stdin, flush=True)
-            print(N, file=prog.stdin, flush=True)
-            print(d, file=prog.stdin, flush=True)
-            print(m, file=prog.stdin, flush=True)
-            print(f, file=prog.stdin, flush=True)
-            c = int(prog.stdout.readline())
-            time = int(prog.stdout.readline())
-        return c, time
-
-    d2 = attack(D, N, e)
+    # one long lived task2_in_c.exe for every call to D
+    with OracleClient('task2_in_c.exe', p, q, N, d) as D:
+        d2 = attack(D, N, e)
     assert(d == d2)
\ No newline at end of file
@@ -0,0 +1,206 @@
+from file_lock import FileLock
+import numpy as np
+import os
+import struct
+import sys
+
+# a directory of one file per column, plus a header and a lock file
+# header:  magic, n_bits, number of committed rows
+# columns: m and S_hat as ceil(n_bits/64) little-endian uint64 limbs per row,
+#          f and cycles as one uint64 per row (cycles is 0 for oracles that
+#          don't report them)
+# rows past the committed count (from a writer that died part way through)
+# are ignored and written over by the next append
+MAGIC = b"ORISTRCE"
+HEADER = struct.Struct(">8sIQ")
+INT_COLUMNS = ("m", "S_hat")
+COLUMNS = ("m", "f", "S_hat", "cycles")
+LIMB_BITS = 64
+
+
+def to_limbs(xs, n_limbs):
+    """
+    the non-negative ints in `xs` as an (len(xs), n_limbs) array of uint64
+    limbs, least significant first
+    """
+    raw = b"".join(x.to_bytes(8*n_limbs, "little") for x in xs)
+    return np.frombuffer(raw, dtype="<u8").reshape(-1, n_limbs)
+
+
+def from_limbs(limbs):
+    """
+    the int in one row of limbs (or a list of them for a 2d array)
+    """
+    if limbs.ndim == 2:
+        return [int.from_bytes(row.tobytes(), "little") for row in limbs]
+    return int.from_bytes(limbs.tobytes(), "little")
+
+
+class TraceStore:
+    """
+    on-disk columns of (m, f, S_hat, cycles) oracle calls that can grow past
+    what fits in memory
+
+    - any number of processes can append to the same store at once, each
+      append takes a file lock and only becomes visible once all of its
+      rows are written
+    - `column` maps the committed rows straight from the file with numpy,
+      so reading a column doesn't copy it into memory
+    - `add` buffers rows and appends them `buffer_size` at a time
+    """
+    path: str
+    n_bits: int
+    n_limbs: int
+
+    def __init__(self, path, n_bits=None, buffer_size=4096) -> None:
+        """
+        opens the store in directory `path`, making an empty one if `n_bits`
+        (the widest m or S_hat it will hold) is given and it doesn't exist yet
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        header = os.path.join(path, "header")
+        if not os.path.exists(header):
+            if n_bits is None:
+                raise FileNotFoundError(header)
+            os.makedirs(path, exist_ok=True)
+            self.__lock = FileLock(os.path.join(path, "lock"))
+            with self.__lock:
+                # another process may have made it while this one waited
+                if not os.path.exists(header):
+                    for name in COLUMNS:
+                        open(self.__column_path(name), "ab").close()
+                    with open(header + ".tmp", "wb") as file:
+                        file.write(HEADER.pack(MAGIC, n_bits, 0))
+                    os.replace(header + ".tmp", header)
+        else:
+            self.__lock = FileLock(os.path.join(path, "lock"))
+        magic, self.n_bits, _ = self.__read_header()
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a trace store")
+        if n_bits is not None and n_bits > self.n_bits:
+            raise ValueError(f"{path} holds {self.n_bits} bit values, not {n_bits}")
+        self.n_limbs = (self.n_bits + LIMB_BITS - 1) // LIMB_BITS
+
+    def __column_path(self, name):
+        return os.path.join(self.path, name)
+
+    def __read_header(self):
+        with open(os.path.join(self.path, "header"), "rb") as file:
+            return HEADER.unpack(file.read(HEADER.size))
+
+    def __width(self, name):
+        # bytes per row of column `name`
+        return 8*self.n_limbs if name in INT_COLUMNS else 8
+
+    def __len__(self):
+        return self.__read_header()[2]
+
+    def append(self, records):
+        """
+        adds the (m, f, S_hat, cycles) tuples in `records` to the end of the store
+        """
+        records = list(records)
+        if not records:
+            return
+        ms, fs, S_hats, cycles = zip(*records)
+        limit = 1 << self.n_bits
+        assert(all(0 <= x < limit for x in ms + S_hats)), f"values must fit in {self.n_bits} bits"
+        columns = {
+            "m": to_limbs(ms, self.n_limbs),
+            "f": np.array(fs, dtype="<u8"),
+            "S_hat": to_limbs(S_hats, self.n_limbs),
+            "cycles": np.array(cycles, dtype="<u8"),
+        }
+        with self.__lock:
+            magic, n_bits, count = self.__read_header()
+            for name, values in columns.items():
+                with open(self.__column_path(name), "r+b") as file:
+                    # at the committed end, not the file's end, to write over
+                    # anything a writer that died left behind
+                    file.seek(count * self.__width(name))
+                    file.write(values.tobytes())
+                    file.truncate()
+            with open(os.path.join(self.path, "header"), "r+b") as file:
+                file.write(HEADER.pack(magic, n_bits, count + len(records)))
+
+    def add(self, m, f, S_hat, cycles=0):
+        """
+        buffers one row, appending the buffer once it has `buffer_size` rows
+        """
+        self.buffer.append((m, f, S_hat, cycles))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.append(self.buffer)
+        self.buffer = []
+
+    def column(self, name, count=None):
+        """
+        the first `count` (default: every committed) rows of column `name`,
+        memory-mapped read-only: m and S_hat are (count, n_limbs) limbs, see
+        `from_limbs`, and f and cycles are (count,)
+        """
+        if count is None:
+            count = len(self)
+        shape = (count, self.n_limbs) if name in INT_COLUMNS else (count,)
+        if count == 0:
+            return np.empty(shape, dtype="<u8")
+        return np.memmap(self.__column_path(name), dtype="<u8", mode="r", shape=shape)
+
+    def columns(self):
+        """
+        every column (as in `column`) over the same committed rows
+        """
+        count = len(self)
+        return {name: self.column(name, count) for name in COLUMNS}
+
+    def chunks(self, chunk_rows=1 << 16):
+        """
+        the committed rows `chunk_rows` at a time, as dicts of column views,
+        so an analysis can stream through a store of any size
+        """
+        columns = self.columns()
+        count = len(columns["f"])
+        for start in range(0, count, chunk_rows):
+            yield {name: values[start:start+chunk_rows] for name, values in columns.items()}
+
+    def __getitem__(self, i):
+        """
+        row `i` as (m, f, S_hat, cycles)
+        """
+        columns = self.columns()
+        if not 0 <= i < len(columns["f"]):
+            raise IndexError(i)
+        return (from_limbs(columns["m"][i]), int(columns["f"][i]),
+                from_limbs(columns["S_hat"][i]), int(columns["cycles"][i]))
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            yield from zip(from_limbs(chunk["m"]), map(int, chunk["f"]),
+                           from_limbs(chunk["S_hat"]), map(int, chunk["cycles"]))
+
+    def close(self):
+        self.flush()
+        self.__lock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == '__main__':
+    # python trace_store.py <path>
+    # prints how many rows a store holds and a summary of its cycle counts
+    with TraceStore(sys.argv[1]) as store:
+        columns = store.columns()
+        print(f"{len(columns['f'])} rows of {store.n_bits} bit values")
+        cycles = columns["cycles"][columns["cycles"] > 0]
+        faulty = np.count_nonzero(columns["f"])
+        print(f"{faulty} faulty, {len(columns['f']) - faulty} fault-free")
+        if len(cycles):
+            print(f"cycles: min {cycles.min()}, mean {cycles.mean() :.1f}, max {cycles.max()}")